@@ -1,15 +1,21 @@
 #!/usr/bin/env python
+import functools
 import logging
 import itertools
+import json
+import os
 import platform
 import serial
 import time
 import sys
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 #from Arduino import m328
 from Arduino import m328p as uK
+from Arduino.registerdb import encode, database
 from serial.tools import list_ports
-from pygments.styles import arduino
-from libxml2mod import parent
 if platform.system() == 'Windows':
     import _winreg as winreg
 else:
@@ -44,6 +50,43 @@ READ_16_BIT_REGISTER_INCR_ADDR =    0x80
 READ_16_BIT_REGISTER_DECR_ADDR =    0x90
 REPEAT_CMD_BUFFER =                 0xA0
 SET_DATA =                          0xB0
+"""
+Number of bytes the firmware sends back per command
+"""
+RESPONSE_SIZE = {READ_REGISTER: 1,
+                 READ_REGISTER_BIT: 1,
+                 READ_16_BIT_REGISTER_INCR_ADDR: 2,
+                 READ_16_BIT_REGISTER_DECR_ADDR: 2}
+"""
+ADC streaming: one conversion is start / wait / read (6 bytes in, 2 out)
+"""
+ADC_ENABLE = 1<<uK.ADEN | 1<<uK.ADPS2 | 1<<uK.ADPS1 | 1<<uK.ADPS0  # clk/128
+ADC_CONVERSION = bytes([SET_REGISTER_BIT + uK.ADSC, uK.ADCSRA,
+                        WAIT_UNTIL_BIT_IS_CLEARED + uK.ADSC, uK.ADCSRA,
+                        READ_16_BIT_REGISTER_INCR_ADDR, uK.ADCL])
+ADC_SETUP = bytes([SET_DATA, ADC_ENABLE, SET_REGISTER, uK.ADCSRA])
+STREAM_WRITE_SIZE = 120     # bytes per write, two writes stay in the ring
+STREAM_DEPTH = 2
+LOOP_READ_SIZE = 2048       # bytes per read while a cmdLoop streams
+STOP_DRAIN_TIMEOUT = 0.05   # s of silence after cmdStop's reset
+SAMPLE_READ_TIME = 0.1      # s of sampleEvery frames per read
+PULSE_CHUNK = 16            # measurePulses pulses per read
+"""
+Timer1 prescalers and their CS1 clock select values (TCCR1B)
+"""
+T1_PRESCALERS = ((1, 1), (8, 2), (64, 3), (256, 4), (1024, 5))
+"""
+Stopwatch read: TCNT1, TOV1, write the TOV1 read back to TIFR1, TCNT1 again
+(5 bytes out). READ_REGISTER_BIT leaves 1 or 0 in r16 and TOV1 is bit 0,
+so SET_REGISTER clears the flag only if it was read as set: an overflow
+after the read stays flagged for the next one.
+"""
+STOPWATCH_READ = bytes([READ_16_BIT_REGISTER_INCR_ADDR, uK.TCNT1L,
+                        READ_REGISTER_BIT + uK.TOV1, uK.TIFR1,
+                        SET_REGISTER, uK.TIFR1,
+                        READ_16_BIT_REGISTER_INCR_ADDR, uK.TCNT1L])
+STOPWATCH_READ_SIZE = 5     # response bytes
+STOPWATCH_LATCH = 8         # bytes up to the TCNT1 read the ticks are of
 
 def enumerate_serial_ports():
     """
@@ -82,35 +125,264 @@ def build_cmd_str(cmd, args=None):
     return "@{cmd}%{args}$!".format(cmd=cmd, args=args)
 
 
+"""
+Port discovery: probes run in parallel, known boards are remembered
+"""
+PORT_CACHE = os.path.join(os.path.expanduser('~'), '.arduino_serial_api_ports.json')
+BOOT_DELAY = 2              # s, the bootloader runs after the port is opened
+PROBE_THREADS = 8
+
+def candidate_ports():
+    if platform.system() == 'Windows':
+        return list(enumerate_serial_ports())
+    elif platform.system() == 'Darwin':
+        return [i[0] for i in list_ports.comports()]
+    return glob.glob("/dev/ttyUSB*") + glob.glob("/dev/ttyACM*")
+
+def usb_serial_numbers():
+    """
+    returns: {port: USB serial number} of the ports that report one
+    """
+    return {i.device: i.serial_number for i in list_ports.comports()
+            if i.serial_number}
+
+def load_port_cache(path=PORT_CACHE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_port_cache(boards, path=PORT_CACHE):
+    try:
+        with open(path, 'w') as f:
+            json.dump(boards, f, indent=1, sort_keys=True)
+    except OSError as e:
+        log.debug('Port cache not saved: %s', e)
+
+def probe_port(p, baud, timeout, stop=None):
+    """
+    Opens port p and checks the firmware version. Setting the `stop`
+    event ends the probe, also while it waits for the bootloader.
+    returns: (serial port, version) or (None, version)
+    """
+    if stop is None:
+        stop = threading.Event()
+    if stop.is_set():
+        return None, None
+    log.debug('Found %s, testing...', p)
+    try:
+        sr = serial.Serial(p, baud, timeout=timeout)
+    except (serial.serialutil.SerialException, OSError) as e:
+        log.debug('%s', e)
+        return None, None
+    if stop.wait(BOOT_DELAY):
+        sr.close()
+        return None, None
+    version = get_version(sr)
+    if version != 6 : #'version': # Davidtle moram dat hex 6
+        log.debug('Bad version %s. This is not a Shrimp/Arduino!', version)
+        sr.close()
+        return None, version
+    if stop.is_set():
+        sr.close()
+        return None, None
+    return sr, version
+
+def find_ports(baud, timeout, count=None, cache=PORT_CACHE):
+    """
+    Finds the ports connected to an arduino with a compatible firmware.
+    inputs:
+        count: stop after this many boards (all of them if None)
+        cache: json file remembering port -> USB serial number and
+            firmware version, None to always probe. A port whose USB
+            serial number matches the cache is opened without a probe.
+    returns:
+        list of opened serial ports
+    """
+    ports = candidate_ports()
+    serial_numbers = usb_serial_numbers()
+    known = load_port_cache(cache) if cache else {}
+    found = []
+    for p in ports:
+        if count is not None and len(found) >= count:
+            break
+        board = known.get(p)
+        if board and board.get('serial_number') and \
+                board['serial_number'] == serial_numbers.get(p):
+            try:
+                found.append(serial.Serial(p, baud, timeout=timeout))
+                log.info('Using known board on port %s.', p)
+            except (serial.serialutil.SerialException, OSError) as e:
+                log.debug('%s', e)
+    if found:
+        time.sleep(BOOT_DELAY)
+    opened = [sr.port for sr in found]
+    probe = [p for p in ports if p not in opened]
+    if probe and (count is None or len(found) < count):
+        stop = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=min(PROBE_THREADS, len(probe)))
+        futures = {pool.submit(probe_port, p, baud, timeout, stop): p for p in probe}
+        for future in as_completed(futures):
+            p = futures[future]
+            sr, version = future.result()
+            if sr is None:
+                known.pop(p, None)
+                continue
+            if stop.is_set():
+                sr.close()
+                continue
+            log.info('Using port %s.', p)
+            found.append(sr)
+            known[p] = {'serial_number': serial_numbers.get(p), 'version': version}
+            if count is not None and len(found) >= count:
+                break
+        stop.set()              # probes still running close their ports
+        pool.shutdown(wait=False, cancel_futures=True)
+        if cache:
+            save_port_cache(known, cache)
+    return found
+
 def find_port(baud, timeout):
     """
     Find the first port that is connected to an arduino with a compatible
     sketch installed.
     """
-    if platform.system() == 'Windows':
-        ports = enumerate_serial_ports()
-    elif platform.system() == 'Darwin':
-        ports = [i[0] for i in list_ports.comports()]
-    else:
-        ports = glob.glob("/dev/ttyUSB*") + glob.glob("/dev/ttyACM*")
-    for p in ports:
-        log.debug('Found {0}, testing...'.format(p))
-        try:
-            sr = serial.Serial(p, baud, timeout=timeout)
-        except (serial.serialutil.SerialException, OSError) as e:
-            log.debug(str(e))
-            continue
-        time.sleep(2)
-        version = get_version(sr)
-        if version != 6 : #'version': # Davidtle moram dat hex 6
-            log.debug('Bad version {0}. This is not a Shrimp/Arduino!'.format(version))
-            sr.close()
-            continue
-        log.info('Using port {0}.'.format(p))
-        if sr:
-            return sr
+    found = find_ports(baud, timeout, count=1)
+    if found:
+        return found[0]
     return None
 
+def decode_response(cmd, rd):
+    """
+    Converts the bytes returned for a read command into an integer.
+    READ_16_BIT_REGISTER_INCR_ADDR sends the low byte first (ADCL, TCNT1L..),
+    READ_16_BIT_REGISTER_DECR_ADDR is given the high byte address and sends
+    it first.
+    """
+    if cmd == READ_16_BIT_REGISTER_INCR_ADDR:
+        return int.from_bytes(rd, byteorder='little', signed=False)
+    return int.from_bytes(rd, byteorder='big', signed=False)
+
+def adc_select(channel):
+    """
+    Commands that select an analog channel (AVcc reference).
+    """
+    return bytes([SET_DATA, 0x40 + channel, SET_REGISTER, uK.ADMUX])
+
+def adc_scan_frame(channels):
+    """
+    Commands of one analogScan frame: select and convert every channel.
+    """
+    return b''.join(adc_select(channel) + ADC_CONVERSION for channel in channels)
+
+def sample_frame(what, profile=None):
+    """
+    Commands of one sampleEvery frame: wait for TOV1, clear it (writing 1
+    clears only that flag) and read every item of `what`:
+        0..7 or 'A0'..'A7'       - ADC channel, 2 bytes
+        register name or address - 8 bit register, e.g. 'PIND', 1 byte
+    ADC channels are checked against the board profile, if given.
+    returns:
+        (commands, numpy dtype of the frame's response)
+    """
+    cmd_str = bytearray([WAIT_UNTIL_BIT_IS_SET + uK.TOV1, uK.TIFR1,
+                         SET_DATA, 1 << uK.TOV1, SET_REGISTER, uK.TIFR1])
+    fields = []
+    for i, item in enumerate(what):
+        if isinstance(item, str) and item[:1] == 'A' and item[1:].isdigit():
+            item = int(item[1:])
+        if isinstance(item, str):
+            item = database().address(item)
+        if item < 8:
+            if profile is not None:
+                item = profile.adc_channel(item)
+            cmd_str += adc_select(item) + ADC_CONVERSION
+            fields.append(('f%d' % i, '<u2'))
+        else:
+            cmd_str += bytes([READ_REGISTER, item])
+            fields.append(('f%d' % i, 'u1'))
+    return bytes(cmd_str), fields
+
+def logic_registers(ports):
+    """
+    PINx addresses of captureLogic ports: 'B', 'PINB', 'PORTB' or an
+    address (uK.PINB).
+    """
+    registers = []
+    for port in ports:
+        if isinstance(port, str):
+            port = database().address('PIN' + port[-1].upper())
+        registers.append(port)
+    return registers
+
+def logic_bits(raw, registers, pins):
+    """
+    Splits PINx snapshots into pins.
+    inputs:
+        raw: numpy.uint8 array of shape (samples, len(registers))
+        registers: PINx address of every column
+        pins: PinCodes of the board profile, by pin number
+    returns:
+        {pin number: numpy bool array} of the pins on those ports
+    """
+    import numpy as np
+    bits = np.unpackbits(raw[:, :, None], axis=2, bitorder='little').astype(bool)
+    return {number: bits[:, registers.index(codes.pin), codes.bit]
+            for number, codes in enumerate(pins) if codes.pin in registers}
+
+def pulse_frame(rising=True):
+    """
+    Commands of one measurePulses pulse: two input captures, on the
+    leading edge and on the trailing one. Each waits for ICF1, reads ICR1,
+    switches ICES1 to the other edge and clears ICF1 (the datasheet asks
+    for the clear after an edge change). 4 bytes out per pulse.
+    """
+    leading = SET_REGISTER_BIT if rising else CLR_REGISTER_BIT
+    trailing = CLR_REGISTER_BIT if rising else SET_REGISTER_BIT
+    cmd_str = bytearray()
+    for edge in (trailing, leading):
+        cmd_str += bytes([WAIT_UNTIL_BIT_IS_SET + uK.ICF1, uK.TIFR1,
+                          READ_16_BIT_REGISTER_INCR_ADDR, uK.ICR1L,
+                          edge + uK.ICES1, uK.TCCR1B,
+                          SET_DATA, 1 << uK.ICF1, SET_REGISTER, uK.TIFR1])
+    return bytes(cmd_str)
+
+"""
+measurePulses result: timestamps (s) of the leading edges since the first,
+widths (s) the signal was HIGH per pulse, mean period (s), frequency (Hz)
+and duty (0..1)
+"""
+Pulses = namedtuple('Pulses', ('timestamps', 'widths', 'period', 'frequency', 'duty'))
+
+def decode_pulses(rd, rising, tick):
+    """
+    Converts the ICR1 values of pulse_frame responses into Pulses.
+    ICR1 is 16 bit, the captures are unwrapped modulo 65536 ticks, so every
+    HIGH and LOW phase must be shorter than 65536 ticks.
+    inputs:
+        rd: responses, 4 bytes per pulse
+        tick: seconds per Timer1 tick
+    """
+    import numpy as np
+    icr = np.frombuffer(rd, dtype='<u2').astype(np.int64)
+    ticks = np.zeros(len(icr), dtype=np.int64)
+    ticks[1:] = np.cumsum((icr[1:] - icr[:-1]) & 0xFFFF)
+    leading = ticks[0::2] * tick
+    trailing = ticks[1::2] * tick
+    timestamps = leading - leading[0] if len(leading) else leading
+    if rising:
+        widths = trailing - leading[:len(trailing)]
+    else:
+        widths = leading[1:] - trailing[:len(leading) - 1]  # rise to next fall
+    if len(leading) < 2:
+        nan = float('nan')
+        return Pulses(timestamps, widths, nan, nan, nan)
+    period = float(timestamps[-1]) / (len(timestamps) - 1)
+    return Pulses(timestamps, widths, period, 1 / period, float(widths.mean()) / period)
+
+LOW_VALUES = frozenset(("LOW", 0))      # 0 == False
+
 def get_version(sr):
     cmd_str = build_cmd_str("version")
     try:
@@ -129,13 +401,50 @@ def get_version(sr):
     ver = sr.read()
     return int(int.from_bytes(ver,byteorder='big'))
 
+def locked(method):
+    """
+    Holds the board's lock while method sends commands and reads their
+    responses, so that requests from other threads do not interleave.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class Arduino:
 
-    def __init__(self, baud=115200, port=None, timeout=2, sr=None):
+    def __init__(self, baud=115200, port=None, timeout=2, sr=None,
+                 flow_control=False, reader=False, shadow=False, board='uno',
+                 metrics=False, wire_log=None):
         """
         Initializes serial communication with Arduino if no connection is
         given. Attempts to self-select COM port, if not specified.
+        flow_control=True keeps track of the firmware's 256 byte command
+        buffer and blocks writes that would overrun it (see flowcontrol.py).
+        reader=True drains the port with a background thread and matches
+        the responses to the read commands in order (see reader.py).
+        shadow=True mirrors the written registers in board.registers, so
+        writes that change nothing are skipped and reads of known
+        registers need no round trip (see shadow.py).
+        board: 'uno', 'nano328', 'nano168' or a BoardProfile (see boards.py)
+        metrics=True counts commands, bytes and read latencies in
+        board.metrics (see metrics.py)
+        wire_log: file name, every write and read is logged there with
+        its time (see wirelog.py)
+        board.lock serialises the board's requests, hold it to keep
+        several requests together while other threads use the board.
         """
+        from Arduino.boards import get_profile
+        from Arduino import encoder
+        self.profile = get_profile(board)
+        self.lock = threading.RLock()
+        self._encoder = encoder.CommandEncoder()
+        self._cmd = encoder.command             # cached 2 byte commands
+        self._set_register = encoder.set_register
+        self._analog_read = encoder.analog_read
+        if flow_control and reader:
+            raise ValueError('flow_control and reader can not be combined.')
         if not sr:
             if not port:
                 sr = find_port(baud, timeout)
@@ -143,13 +452,38 @@ class Arduino:
                     raise ValueError("Could not find port.")
             else:
                 sr = serial.Serial(port, baud, timeout=timeout)
+        if wire_log:
+            from Arduino.wirelog import WireRecorder
+            sr = WireRecorder(sr, wire_log)
         sr.flush()
         self.sr = sr
         self.cmd_buffer_num = 0
         self.cmd_do_buffer_num = 0
         self.cmd_loop_buffer_num = 0
-        self.F_CPU=16
-        self.TimerOne=Timer(self)
+        self._batch = None
+        self._batch_depth = 0
+        self._loop_open = False
+        self._recording = None
+        self.flow = None
+        self.reader = None
+        self.registers = None
+        self.metrics = None
+        if metrics:
+            from Arduino.metrics import Metrics
+            self.metrics = Metrics(self)
+        if shadow:
+            from Arduino.shadow import ShadowRegisters
+            self.registers = ShadowRegisters()
+        if reader:
+            from Arduino.reader import ReaderThread
+            self.reader = ReaderThread(sr)
+        if flow_control:
+            from Arduino.flowcontrol import FlowControl
+            self.flow = FlowControl(self)
+        self._flushInput()                  # e.g. the version after reset
+        self.F_CPU=self.profile.f_cpu
+        self.TimerOne=self._newTimer()
+        self.clock = None
         
     """
     ##############################################################
@@ -157,31 +491,234 @@ class Arduino:
     ##############################################################
     """
 
+    def _newTimer(self):
+        return Timer(self)
+
+    @locked
     def sendAPICmd(self, cmd_str):
-        cmd_api_str = bytearray()
-        for cmd_byte in cmd_str:
-            cmd_api_str.append(cmd_byte)
+        if self._recording is not None:
+            self._recording.append(cmd_str)
+        else:
+            if self.registers is not None:
+                cmd_str = self.registers.filter(cmd_str, self._loop_open)
+                if not cmd_str:
+                    return
+            if self._batch is not None:
+                self._batch += cmd_str
+            elif not self._write(cmd_str):
+                return
+        self.cmd_buffer_num += len(cmd_str)
+        if self.cmd_buffer_num > 255:
+            self.cmd_buffer_num -= 256
+
+    def _write(self, cmd_str):
         try:
-            self.sr.write(cmd_api_str)
-            self.sr.flush()
-            self.cmd_buffer_num += len(cmd_str)
-            if self.cmd_buffer_num > 255:
-                self.cmd_buffer_num -= 256
+            if self.flow is not None:
+                self.flow.write(cmd_str)
+            else:
+                if self.reader is not None:
+                    self.reader.sent(cmd_str)
+                self.sr.write(cmd_str)
+                self.sr.flush()
+            if self.metrics is not None:
+                self.metrics.written(cmd_str)
+            return True
+        except BufferError:
+            raise
         except:
             print("Unexpected error:", sys.exc_info()[0])
-            pass
+            return False
+
+    def _flushBatch(self):
+        """
+        Sends the commands collected so far in an open batch, so that a
+        response can be read. The batch stays open.
+        """
+        if self._batch:
+            self._write(self._batch)
+            del self._batch[:]
+            self._batchSent()
+
+    def _batchSent(self):
+        """
+        What a batch sent so far is no longer undone by rollback().
+        """
+        self._batch_start_num = self.cmd_buffer_num
+        if self.registers is not None:
+            self._batch_shadow = self.registers.save()
+
+    def _read(self, size=1):
+        if self._recording is not None:
+            return b''
+        self._flushBatch()
+        if self.metrics is not None:
+            started = time.perf_counter()
+        if self.flow is not None:
+            rd = self.flow.read(size)
+        elif self.reader is not None:
+            rd = self.reader.read(size)
+        else:
+            rd = self.sr.read(size)
+        if self.metrics is not None:
+            self.metrics.read(size, rd, started)
+        return rd
+
+    def _flushInput(self):
+        """
+        Drops stale bytes waiting in the input buffer.
+        """
+        if self._recording is not None:
+            return
+        if self.flow is not None:
+            self.flow.flushInput()
+        elif self.reader is not None:
+            self.reader.flushInput()
+        elif self.sr.inWaiting()>0 :
+            self.sr.flushInput()
+
+    def begin(self):
+        """
+        Starts a batch: commands are only encoded and collected until
+        commit() sends all of them with a single serial write.
+        Batches can be nested, the outermost commit() sends. The board's
+        lock is held until the batch ends.
+        """
+        self.lock.acquire()
+        if self._batch_depth == 0:
+            self._batch = bytearray()
+            self._batchSent()
+        self._batch_depth += 1
+
+    def commit(self):
+        """
+        Ends a batch started with begin() and sends the collected commands.
+        """
+        if self._batch_depth == 0:
+            return
+        self._batch_depth -= 1
+        try:
+            if self._batch_depth == 0:
+                self._flushBatch()
+                self._batch = None
+        finally:
+            self.lock.release()
+
+    def rollback(self):
+        """
+        Drops an open batch without sending it. The shadow registers
+        forget the writes that were not sent.
+        """
+        if self._batch_depth:
+            self.cmd_buffer_num = self._batch_start_num
+            if self.registers is not None:
+                self.registers.restore(self._batch_shadow)
+            self._batch = None
+            for _ in range(self._batch_depth):
+                self.lock.release()
+            self._batch_depth = 0
+
+    @contextmanager
+    def record(self):
+        """
+        Records the commands issued inside the block into a Program instead
+        of sending them. Reads are recorded but return a placeholder (0 or
+        None) while recording, run() returns their values.
+            with board.record() as rec:
+                board.digitalWrite(13, 'HIGH')
+            board.run(rec.program)
+        """
+        from Arduino.program import Recorder
+        self.lock.acquire()
+        saved = (self.cmd_buffer_num, self.cmd_do_buffer_num, self._loop_open)
+        self._recording = Recorder()
+        self.cmd_buffer_num = 0
+        self.cmd_do_buffer_num = 0
+        try:
+            yield self._recording
+            self._recording.finish()
+        finally:
+            self._recording = None
+            self.cmd_buffer_num, self.cmd_do_buffer_num, self._loop_open = saved
+            self.lock.release()
+
+    def compile(self, builder, *args, **kwargs):
+        """
+        Returns the Program recorded by builder(board, *args, **kwargs).
+        Programs are kept in an LRU cache keyed by builder and parameters,
+        so a builder runs only once per set of parameters (and board
+        profile and F_CPU, which the encoded commands may depend on).
+        Parameters that can not be hashed bypass the cache.
+        """
+        from Arduino.program import program_cache, program_key
+        key = program_key(builder, args, kwargs, self.profile.name, self.F_CPU)
+        program = program_cache.get(key) if key is not None else None
+        if program is None:
+            with self.record() as rec:
+                builder(self, *args, **kwargs)
+            program = rec.program
+            if key is not None:
+                program_cache.put(key, program)
+        return program
+
+    @locked
+    def run(self, program):
+        """
+        Sends a compiled Program with one write.
+        returns:
+            decoded responses of the program's reads, or None if the
+            program loops (read its output with readMany-like calls).
+        """
+        log.debug('run: program of %d bytes', len(program.code))
+        if program.loops:
+            self._loop_open = False
+        self.sendAPICmd(program.code)
+        if program.reads and not program.loops:
+            return program.decode(self._read(program.response_size))
+        return None
+
+    @contextmanager
+    def batch(self):
+        """
+        Coalesces all commands issued inside the block into one write:
+            with board.batch():
+                for pin in range(2, 14):
+                    board.pinMode(pin, 'OUTPUT')
+                    board.digitalWrite(pin, 'LOW')
+        Reads inside the block send the commands collected so far.
+        """
+        self.begin()
+        try:
+            yield self
+        except:
+            self.rollback()
+            raise
+        self.commit()
     
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+        self.sr.close()
+
+    @locked
     def version(self):    
+        self._flushBatch()
+        if self.flow is not None:
+            self.flow.reset()
+        if self.registers is not None:
+            self.registers.clear()
+        if self.reader is not None:
+            self._write(bytes([PROCES_RESET]))
+            return int.from_bytes(self._read(), byteorder='big')
         return get_version(self.sr)
     
+    @locked
     def softwareReset(self):
         cmd_string = bytearray()
         cmd_string.append(PROCES_RESET)
         try:
             self.sendAPICmd(cmd_string)
-            if self.sr.inWaiting()>0 :
-                self.sr.flushInput()
-            rd = self.sr.read()
+            self._flushInput()
+            rd = self._read()
             x = int.from_bytes(rd,byteorder='big', signed=False)
             return 0
         except:
@@ -189,6 +726,9 @@ class Arduino:
              
     def cmdDo(self):
         self.cmd_do_buffer_num = self.cmd_buffer_num
+        self._loop_open = True
+        if self._recording is not None:
+            self._recording.mark()
     
     def cmdLoop(self):
         if self.cmd_do_buffer_num <= self.cmd_buffer_num:
@@ -196,83 +736,144 @@ class Arduino:
         else: 
             Repeat_last_cmd_buffer_num = self.cmd_buffer_num + (256 - self.cmd_do_buffer_num)
         try:
-            cmd_string = bytearray()
-            cmd_string.append(REPEAT_CMD_BUFFER)
-            cmd_string.append(Repeat_last_cmd_buffer_num)
-            self.sendAPICmd(cmd_string)
+            self.sendAPICmd(self._cmd(REPEAT_CMD_BUFFER, Repeat_last_cmd_buffer_num))
+        except BufferError:
+            raise
         except:
             pass
+        self._loop_open = False
     
     def setRegister(self, reg_name, reg_value):
-        log.debug('setRegister: ' +str(reg_name) +'=' +str(reg_value) )
+        log.debug('setRegister: %s=%s', reg_name, reg_value)
         try:
-            cmd_string = bytearray()
-            cmd_string.append(SET_DATA)
-            cmd_string.append(reg_value)
-            cmd_string.append(SET_REGISTER)
-            cmd_string.append(reg_name)
-            self.sendAPICmd(cmd_string)
+            self.sendAPICmd(self._set_register(reg_name, reg_value))
+        except BufferError:
+            raise
         except:
             pass
 
+    def _cached(self, reg_name, bit_name=None):
+        """
+        Value of a register (bit) known to the shadow register file, or None.
+        """
+        if self.registers is None or self._recording is not None:
+            return None
+        if bit_name is None:
+            x = self.registers.get(reg_name)
+        elif self.registers.cacheable(reg_name):
+            x = self.registers.getBit(bit_name, reg_name)
+        else:
+            x = None
+        if x is not None:
+            self.registers.hits += 1
+        return x
+
+    @locked
     def readRegisterBit(self, bit_name, reg_name):
-        log.debug('readRegister.Bit: ' + str(reg_name)+'.'+str(bit_name))
+        log.debug('readRegister.Bit: %s.%s', reg_name, bit_name)
+        x = self._cached(reg_name, bit_name)
+        if x is not None:
+            return x
         try:
-            if self.sr.inWaiting()>0 :
-                self.sr.flushInput()
-            cmd_string = bytearray()
-            cmd_string.append(READ_REGISTER_BIT+bit_name)
-            cmd_string.append(reg_name)
-            self.sendAPICmd(cmd_string)
-            rd = self.sr.read()
+            self._flushInput()
+            self.sendAPICmd(self._cmd(READ_REGISTER_BIT + bit_name, reg_name))
+            rd = self._read()
             x = int.from_bytes(rd,byteorder='big', signed=False)
             return int(x)
+        except BufferError:
+            raise
         except:
             pass
 
+    @locked
     def readRegister(self, reg_name):
-        log.debug('readRegister: ' + str(reg_name))
+        log.debug('readRegister: %s', reg_name)
+        x = self._cached(reg_name)
+        if x is not None:
+            return x
         try:
-            cmd_string = bytearray()
-            cmd_string.append(READ_REGISTER)
-            cmd_string.append(reg_name)
-            self.sendAPICmd(cmd_string)
-            if self.sr.inWaiting()>0 :
-                self.sr.flushInput()
-            rd = self.sr.read()
+            self.sendAPICmd(self._cmd(READ_REGISTER, reg_name))
+            self._flushInput()
+            rd = self._read()
             x = int.from_bytes(rd,byteorder='big', signed=False)
+            if self.registers is not None and len(rd) == 1:
+                self.registers.learn(reg_name, x)
             return int(x)
+        except BufferError:
+            raise
         except:
             pass
     
+    @locked
     def read16bRegister(self, reg_name):
-        log.debug('readRegister: ' + str(reg_name))
+        log.debug('readRegister: %s', reg_name)
         try:
-            if self.sr.inWaiting()>0 :
-                self.sr.flushInput()
-            cmd_string = bytearray()
-            cmd_string.append(READ_16_BIT_REGISTER_INCR_ADDR)
-            cmd_string.append(reg_name)
-            self.sendAPICmd(cmd_string)
-            rd = self.sr.read(2)
+            self._flushInput()
+            self.sendAPICmd(self._cmd(READ_16_BIT_REGISTER_INCR_ADDR, reg_name))
+            rd = self._read(2)
             x = int.from_bytes(rd,byteorder='little', signed=False)
             return int(x)
+        except BufferError:
+            raise
         except:
             pass
     
+    @locked
+    def readMany(self, requests):
+        """
+        Pipelined reads: all requests are sent with one write and the
+        responses are collected with one read, in order.
+        inputs:
+            requests: list of
+                reg_name                                   - 8 bit register
+                (READ_REGISTER, reg_name)                  - 8 bit register
+                (READ_REGISTER_BIT, bit_name, reg_name)    - one bit
+                (READ_16_BIT_REGISTER_INCR_ADDR, reg_name) - e.g. ADCL, TCNT1L
+                (READ_16_BIT_REGISTER_DECR_ADDR, reg_name) - e.g. ADCH, TCNT1H
+        returns:
+            list of integers (None for responses that did not arrive)
+        """
+        enc = self._encoder.clear()
+        cmds = []
+        for request in requests:
+            if isinstance(request, int):
+                request = (READ_REGISTER, request)
+            cmd = request[0]
+            if cmd not in RESPONSE_SIZE:
+                raise ValueError('Not a read command: ' + hex(cmd))
+            bit_name = request[1] if len(request) == 3 else 0
+            enc._put(cmd + bit_name, request[-1])
+            cmds.append(cmd)
+        log.debug('readMany: %d requests', len(cmds))
+        self.sendAPICmd(enc.view())
+        rd = self._read(sum(RESPONSE_SIZE[cmd] for cmd in cmds))
+        values = []
+        pos = 0
+        for cmd in cmds:
+            size = RESPONSE_SIZE[cmd]
+            if pos + size <= len(rd):
+                values.append(decode_response(cmd, rd[pos:pos + size]))
+            else:
+                values.append(None)
+            pos += size
+        if pos > len(rd) and self._recording is None:
+            log.error('readMany: %d of %d bytes received.', len(rd), pos)
+        return values
+
     def writeRegisterBit(self, bit_name, reg_name, bit_value):
-        log.debug('Write Register.Bit: ' +str(reg_name) +'.' +str(bit_name) +'=' + str(bit_value) )
-        cmd_string = bytearray()
+        log.debug('Write Register.Bit: %s.%s=%s', reg_name, bit_name, bit_value)
         if bit_value==1 or bit_value =='HIGH':
-            cmd_string.append(SET_REGISTER_BIT +bit_name)
+            cmd = SET_REGISTER_BIT + bit_name
         else:
-            cmd_string.append(CLR_REGISTER_BIT +bit_name)
+            cmd = CLR_REGISTER_BIT + bit_name
         try:
-            cmd_string.append(reg_name)
-            self.sendAPICmd(cmd_string)
+            self.sendAPICmd(self._cmd(cmd, reg_name))
+        except BufferError:
+            raise
         except:
             pass
     
+    @locked
     def readADC(self):
         """
         Execute the ANALOG READ of pre-set channel
@@ -283,20 +884,15 @@ class Arduino:
                 - setting the ADMUX register
         """
         log.debug('readADC: ' )
-        if self.sr.inWaiting()>0 :
-            self.sr.flushInput()
-        cmd_str = bytearray()
-        cmd_str.append(SET_REGISTER_BIT+6)          # start ADC conversion
-        cmd_str.append(uK.ADCSRA)                 
-        cmd_str.append(WAIT_UNTIL_BIT_IS_CLEARED+6) # wait ADC to complete conwersion
-        cmd_str.append(uK.ADCSRA)
-        cmd_str.append(READ_16_BIT_REGISTER_INCR_ADDR)
-        cmd_str.append(uK.ADCL)
+        self._flushInput()
         try:
-            self.sendAPICmd(cmd_str)
-            rd= self.sr.readline(2)
+            self.sendAPICmd(ADC_CONVERSION)     # start, wait, read ADCL/ADCH
+            self._flushBatch()
+            rd= self._read(2)
             x = int.from_bytes(rd,byteorder='little', signed=False)
             return int(x)
+        except BufferError:
+            raise
         except:
             log.error('readADC not executed.')
     
@@ -307,20 +903,18 @@ class Arduino:
         Meanwhile all other instructions send by computer will be saved
         into the hardware buffer. 
         """
-        cmd_str = bytearray()
         if len(reg_name) > 0:
             #ok it is more advances ... reg and bit
-            log.debug('hardware bit wait to be set: bit=' +str(bit_num)+' reg=' +str(reg_name[0]))
-            cmd_str.append(WAIT_UNTIL_BIT_IS_SET+bit_num)          # start ADC conversion
-            cmd_str.append(reg_name[0])
+            log.debug('hardware bit wait to be set: bit=%s reg=%s', bit_num, reg_name[0])
+            cmd_str = self._cmd(WAIT_UNTIL_BIT_IS_SET + bit_num, reg_name[0])
         else:
             # Arduino pinout
-            log.debug('hardware bit wait to be set: Arduino pinout=' +str(bit_num))
-            log.debug('hardware bit wait to be set: bit=' +str(pin_name[bit_num])+' reg=' +str(pin_port[bit_num]-2))
-            cmd_str.append(WAIT_UNTIL_BIT_IS_SET+pin_name[bit_num])
-            cmd_str.append(pin_port[bit_num]-2) 
+            log.debug('hardware bit wait to be set: Arduino pinout=%d', bit_num)
+            cmd_str = self.profile.pins[bit_num].wait_set
         try:
             self.sendAPICmd(cmd_str)
+        except BufferError:
+            raise
         except:
             log.error('waitUntilBitIsSet not executed.')
             
@@ -331,20 +925,18 @@ class Arduino:
         Meanwhile all other instructions send by computer will be saved
         into the hardware buffer. 
         """
-        cmd_str = bytearray()
         if len(reg_name) > 0:
             #ok it is more advances ... reg and bit
-            log.debug('hardware bit wait to be set: bit=' +str(bit_num)+' reg=' +str(reg_name[0]))
-            cmd_str.append(WAIT_UNTIL_BIT_IS_CLEARED+bit_num)          # start ADC conversion
-            cmd_str.append(reg_name[0])
+            log.debug('hardware bit wait to be set: bit=%s reg=%s', bit_num, reg_name[0])
+            cmd_str = self._cmd(WAIT_UNTIL_BIT_IS_CLEARED + bit_num, reg_name[0])
         else:
             # Arduino pinout
-            log.debug('hardware bit wait to be set: Arduino pinout=' +str(bit_num))
-            log.debug('hardware bit wait to be set: bit=' +str(pin_name[bit_num])+' reg=' +str(pin_port[bit_num]-2))
-            cmd_str.append(WAIT_UNTIL_BIT_IS_CLEARED+pin_name[bit_num])
-            cmd_str.append(pin_port[bit_num]-2) 
+            log.debug('hardware bit wait to be set: Arduino pinout=%d', bit_num)
+            cmd_str = self.profile.pins[bit_num].wait_cleared
         try:
             self.sendAPICmd(cmd_str)
+        except BufferError:
+            raise
         except:
             log.error('waitUntilBitIsSet not executed.')
             
@@ -361,23 +953,11 @@ class Arduino:
            pin: pin number to toggle
            val: "INPUT" or "OUTPUT"
         """
-        cmd_pin = pin_name[pin]
-        cmd_port= pin_port[pin]-1 #ddrX = portx - 1
-                
-        if val == "OUTPUT":
-            cmd_pin += SET_REGISTER_BIT
-        elif val == "INPUT_PULLUP":
-            cmd_pin += CLR_REGISTER_BIT
-        else: #INPUT - default option
-            cmd_pin += CLR_REGISTER_BIT
+        modes = self.profile.pins[pin].modes
         try:
-            cmd_string = bytearray()
-            cmd_string.append(cmd_pin)
-            cmd_string.append(cmd_port)
-            if val == "INPUT_PULLUP":
-                cmd_string.append(pin_name[pin]+SET_REGISTER_BIT)
-                cmd_string.append(pin_port[pin])
-            self.sendAPICmd(cmd_string)
+            self.sendAPICmd(modes.get(val, modes["INPUT"])) #INPUT - default option
+        except BufferError:
+            raise
         except:
             pass
 
@@ -390,23 +970,15 @@ class Arduino:
            pin : digital pin number
            val : either "HIGH" or "LOW"
         """
-        cmd_pin = pin_name[pin]
-        cmd_port= pin_port[pin]
-        cmd_string = bytearray()
-        
-        if val == "LOW" or val == 0:
-            cmd_pin += CLR_REGISTER_BIT
-        else:
-            cmd_pin += SET_REGISTER_BIT
+        codes = self.profile.pins[pin]
         try:
-            cmd_string = bytearray()
-            cmd_string.append(cmd_pin)
-            cmd_string.append(cmd_port)
-            self.sendAPICmd(cmd_string)
-            self.sr.flush()
+            self.sendAPICmd(codes.low if val in LOW_VALUES else codes.high)
+        except BufferError:
+            raise
         except:
             pass
 
+    @locked
     def digitalRead(self, pin):
         """
         Returns the value of a specified
@@ -416,51 +988,140 @@ class Arduino:
         returns:
            value: 0 for "LOW", 1 for "HIGH"
         """
-        cmd_string = bytearray()
-        cmd_string.append(pin_name[pin] + READ_REGISTER_BIT)
-        cmd_string.append(pin_port[pin] - 2)
         try:
-            if self.sr.inWaiting()>0 :
-                self.sr.flushInput()
-            self.sendAPICmd(cmd_string)
-            rd = self.sr.read()
+            self._flushInput()
+            self.sendAPICmd(self.profile.pins[pin].read)
+            rd = self._read()
             x = int.from_bytes(rd,byteorder='big')
             return int(x)
+        except BufferError:
+            raise
         except:
             return -10
 
+    @locked
+    def digitalWriteMany(self, values):
+        """
+        Sets several digital pins with one write.
+        inputs:
+            values: {pin: "HIGH"/"LOW"/1/0}
+        Pins are grouped by port; a port is written as a whole when all
+        its pins are given, or when that is shorter than one bit command
+        per pin and shadow=True knows the other pins of the port.
+        """
+        ports = {}
+        for pin, val in values.items():
+            codes = self.profile.pins[pin]
+            ports.setdefault(codes.port, {})[codes.bit] = val not in LOW_VALUES
+        enc = self._encoder.clear()
+        for port in sorted(ports):
+            self._encodeBits(enc, port, ports[port])
+        self.sendAPICmd(enc.view())
+
+    @locked
+    def pinModeMany(self, modes):
+        """
+        Sets the I/O mode of several pins with one write.
+        inputs:
+            modes: {pin: "INPUT"/"OUTPUT"/"INPUT_PULLUP"}
+        """
+        registers = {}
+        for pin, val in modes.items():
+            codes = self.profile.pins[pin]
+            registers.setdefault(codes.ddr, {})[codes.bit] = val == "OUTPUT"
+            if val == "INPUT_PULLUP":
+                registers.setdefault(codes.port, {})[codes.bit] = True
+        enc = self._encoder.clear()
+        for reg in sorted(registers):
+            self._encodeBits(enc, reg, registers[reg])
+        self.sendAPICmd(enc.view())
+
+    def _encodeBits(self, enc, reg, bits):
+        """
+        Encodes the commands that set the bits {bit: True/False} of
+        register reg into enc: SET_DATA+SET_REGISTER (4 bytes) if all bits
+        are given or the shadow registers know the others, else one
+        SET/CLR_REGISTER_BIT (2 bytes) per bit. The shadow is not used
+        while recording, the program may run when the pins have changed.
+        """
+        value = None
+        if len(bits) == 8:
+            value = 0
+        elif len(bits) > 2 and self.registers is not None and \
+                not self._loop_open and self._recording is None:
+            value = self.registers.get(reg)
+        if value is None:
+            for bit, high in sorted(bits.items()):
+                if high:
+                    enc.setBit(bit, reg)
+                else:
+                    enc.clearBit(bit, reg)
+            return
+        for bit, high in bits.items():
+            if high:
+                value |= 1 << bit
+            else:
+                value &= ~(1 << bit)
+        enc.setRegister(reg, value)
+
+    def readPorts(self, as_array=False, capture=None):
+        """
+        Reads all digital pins with one pipelined read of PINB, PINC and
+        PIND.
+        inputs:
+            capture: EdgeCapture (capture.py) the snapshot is appended to
+        returns:
+            bitmask with bit n = pin n, or a numpy bool array indexed by
+            pin number (as_array=True); None if the board did not answer
+        """
+        registers = self._pinRegisters()
+        return self._ports(registers, self.readMany(registers), as_array, capture)
+
+    def _pinRegisters(self):
+        """
+        PINx addresses of the board profile's pins.
+        """
+        return sorted(set(codes.pin for codes in self.profile.pins))
+
+    def _ports(self, registers, responses, as_array, capture):
+        """
+        readPorts' result from the responses of the PINx reads.
+        """
+        values = dict(zip(registers, responses))
+        if None in values.values():
+            return None
+        if capture is not None:
+            capture.append([values[reg] for reg in capture.registers])
+        pins = self.profile.pins
+        mask = 0
+        for pin, codes in enumerate(pins):
+            mask |= (values[codes.pin] >> codes.bit & 1) << pin
+        if as_array:
+            import numpy as np
+            return np.array([mask >> pin & 1 for pin in range(len(pins))], dtype=bool)
+        return mask
+
+    @locked
     def analogRead(self, pin):
         """
         Returns the value of a specified
         analog pin.
         inputs:
-           pin : analog pin number for measurement
+           pin : analog pin number for measurement, 0.. or 'A0'..
+                 (ValueError if the board profile has no such pin)
         returns:
            value: integer from 1 to 1023
         """
-        if self.sr.inWaiting()>0 :
-            self.sr.flushInput()
-        cmd_str = bytearray()
-        cmd_str.append(SET_DATA)
-        cmd_str.append(0x40+pin)
-        cmd_str.append(SET_REGISTER)
-        cmd_str.append(uK.ADMUX)
-        
-        cmd_str.append(SET_DATA)
-        cmd_str.append(0xC7)
-        cmd_str.append(SET_REGISTER)
-        cmd_str.append(uK.ADCSRA)
-        
-        cmd_str.append(WAIT_UNTIL_BIT_IS_CLEARED+6)
-        cmd_str.append(uK.ADCSRA)
-        cmd_str.append(READ_16_BIT_REGISTER_INCR_ADDR)
-        cmd_str.append(uK.ADCL)
+        channel = self.profile.adc_channel(pin)
+        self._flushInput()
         try:
-            self.sendAPICmd(cmd_str)
-            self.sr.flush()
+            self.sendAPICmd(self._analog_read(channel))
+            self._flushBatch()
+        except BufferError:
+            raise
         except:
             pass
-        rd= self.sr.readline(2)
+        rd= self._read(2)
         x = int.from_bytes(rd,byteorder='little', signed=False)
         try:
             return int(x)
@@ -487,6 +1148,437 @@ class Arduino:
         except:
             pass
 
+    """
+    ##############################################################
+    ##     Streaming FUNCTIONS
+    ##############################################################
+    """
+
+    @locked
+    def cmdStop(self):
+        """
+        Stops a running cmdDo/cmdLoop. A loop is only left by a firmware
+        reset: a lone byte makes the firmware time out and restart, which
+        also restores its default DDRB/DDRC/DDRD setup. Whatever the loop
+        has sent so far is dropped.
+        """
+        self._loop_open = False
+        self._write(bytes([PROCES_RESET]))
+        if self.reader is not None:
+            self.reader.drain(STOP_DRAIN_TIMEOUT)
+        else:
+            timeout = self.sr.timeout
+            self.sr.timeout = STOP_DRAIN_TIMEOUT
+            try:
+                while self.sr.read(4096):
+                    pass
+            finally:
+                self.sr.timeout = timeout
+        self.cmd_buffer_num = 0
+        self.cmd_do_buffer_num = 0
+        if self.flow is not None:
+            self.flow.reset()
+        if self.registers is not None:
+            self.registers.clear()
+
+    def analogStream(self, channel, n, loop=False):
+        """
+        Samples an analog channel n times as fast as the link allows.
+        inputs:
+            channel: analog channel 0.. or 'A0'.. of the board profile
+            n: number of samples
+            loop: see analogStreamIter
+        returns:
+            numpy.uint16 array (shorter if the board stopped answering)
+        """
+        import numpy as np
+        samples = np.empty(n, dtype=np.uint16)
+        pos = 0
+        for block in self.analogStreamIter(channel, n, loop=loop):
+            samples[pos:pos + len(block)] = block
+            pos += len(block)
+        return samples[:pos]
+
+    def analogStreamIter(self, channel, n=None, chunk=None, loop=False):
+        """
+        Generator form of analogStream: yields numpy.uint16 arrays of up to
+        `chunk` samples, n samples in total (endless if n is None).
+        ADMUX and ADCSRA are set once, then
+        loop=False: start/wait/read triplets are written STREAM_DEPTH
+            chunks ahead of the reads, so the firmware never idles waiting
+            for the host (~1.9k samples/s at 115200 baud).
+        loop=True: one triplet runs in a cmdDo/cmdLoop and the firmware
+            streams on its own (~4.4k samples/s in bench.py --emulator:
+            the conversion and the loop's commands take longer than the
+            2 bytes a sample sends).
+            The loop is stopped with cmdStop(), which resets the firmware.
+        """
+        import numpy as np
+        channel = self.profile.adc_channel(channel)
+        log.debug('analogStream: channel %d, %s samples', channel, n)
+        setup = adc_select(channel) + ADC_SETUP
+        for rd in self._stream(setup, ADC_CONVERSION, 2, n, chunk, loop):
+            yield np.frombuffer(rd, dtype='<u2').astype(np.uint16)
+
+    def analogScan(self, channels, n_frames, loop=False):
+        """
+        Samples several analog channels, one conversion per channel and
+        frame. ADMUX is rewritten before every conversion, the frames are
+        streamed like analogStream does.
+        inputs:
+            channels: list of analog channels of the board profile,
+                e.g. range(6) for A0..A5
+            n_frames: number of frames
+            loop: see analogStreamIter
+        returns:
+            (samples, timestamps): numpy.uint16 array of shape
+            (frames, len(channels)) and the host time.monotonic() of
+            every frame, interpolated over the frames of one read
+        """
+        import numpy as np
+        channels = [self.profile.adc_channel(channel) for channel in channels]
+        log.debug('analogScan: channels %s, %d frames', channels, n_frames)
+        samples = np.empty((n_frames, len(channels)), dtype=np.uint16)
+        timestamps = np.empty(n_frames)
+        pos = 0
+        t_prev = time.monotonic()
+        for rd in self._stream(ADC_SETUP, adc_scan_frame(channels),
+                               2 * len(channels), n_frames, None, loop):
+            t = time.monotonic()
+            block = np.frombuffer(rd, dtype='<u2').reshape(-1, len(channels))
+            samples[pos:pos + len(block)] = block
+            timestamps[pos:pos + len(block)] = np.linspace(t_prev, t, len(block) + 1)[1:]
+            pos += len(block)
+            t_prev = t
+        return samples[:pos], timestamps[:pos]
+
+    def captureLogic(self, ports=None, n_samples=1000):
+        """
+        Logic probe: a cmdDo/cmdLoop of READ_REGISTER commands on the PINx
+        registers of `ports`, the firmware streams port snapshots as fast
+        as the link allows (~11k snapshots/s of one port at 115200 baud).
+        Only pins set to INPUT follow external signals, the firmware's
+        reset makes PORTB an output.
+        inputs:
+            ports: 'B', 'C', 'D', 'PIND' or addresses, all ports of the
+                board profile if None
+            n_samples: snapshots per port
+        returns:
+            {pin number: numpy bool array of n_samples}
+        """
+        if ports is None:
+            registers = self._pinRegisters()
+        else:
+            registers = logic_registers(ports)
+        raw = self.captureLogicRaw(registers, n_samples)
+        return logic_bits(raw, registers, self.profile.pins)
+
+    def captureLogicRaw(self, ports, n_samples):
+        """
+        captureLogic without the split into pins.
+        returns:
+            numpy.uint8 array of shape (snapshots, len(ports))
+        """
+        import numpy as np
+        registers = logic_registers(ports)
+        raw = np.empty((n_samples, len(registers)), dtype=np.uint8)
+        pos = 0
+        for block in self.captureLogicIter(registers, n_samples):
+            raw[pos:pos + len(block)] = block
+            pos += len(block)
+        return raw[:pos]
+
+    def captureLogicIter(self, ports, n=None, chunk=None):
+        """
+        Generator form of captureLogicRaw: yields numpy.uint8 arrays of up
+        to `chunk` snapshots, n in total (endless if n is None).
+        """
+        import numpy as np
+        registers = logic_registers(ports)
+        body = b''.join(bytes([READ_REGISTER, reg]) for reg in registers)
+        log.debug('captureLogic: registers %s, %s samples', registers, n)
+        for rd in self._stream(b'', body, len(registers), n, chunk, loop=True):
+            yield np.frombuffer(rd, dtype=np.uint8).reshape(-1, len(registers))
+
+    def captureEdges(self, ports=None, n_samples=None, capture=None):
+        """
+        captureLogic into an edge compressed EdgeCapture (capture.py), for
+        long captures: only the snapshots where a port changed are kept.
+        inputs:
+            ports: see captureLogic
+            n_samples: snapshots per port, until Ctrl+C if None
+            capture: EdgeCapture to append to, a new one if None
+        returns:
+            the EdgeCapture
+        """
+        capture = self._edgeCapture(ports, capture)
+        try:
+            for block in self.captureLogicIter(capture.registers, n_samples):
+                capture.append(block)
+        except KeyboardInterrupt:
+            log.info('captureEdges: stopped after %d samples.', len(capture))
+        return capture
+
+    def _edgeCapture(self, ports, capture):
+        from Arduino.capture import EdgeCapture
+        if capture is None:
+            if ports is None:
+                registers = self._pinRegisters()
+            else:
+                registers = logic_registers(ports)
+            capture = EdgeCapture(registers, board=self.profile)
+        return capture
+
+    def sampleEvery(self, period_us, what, n, chunk=None):
+        """
+        Hardware paced sampling: Timer1 overflows every period_us and a
+        cmdDo/cmdLoop waits for TOV1, clears it and reads `what`, so the
+        sample clock is the AVR's crystal, not the host's scheduler.
+        Timer1 is taken over: a running syncClock() is stopped, its
+        stopwatch is read in the same write that starts the sampling, so
+        the timestamps are on its timebase (sync the clock again after).
+        inputs:
+            period_us: sample period in microseconds, longer than one
+                frame takes (~8us per command, ~110us per ADC channel) and
+                than its response takes on the wire
+            what: list of ADC channels (0..7, 'A0'..) and registers
+                ('PIND', uK.PINB, ..), see sample_frame()
+            n: number of frames (sampleEveryIter samples endlessly)
+        returns:
+            (samples, timestamps): numpy.uint16 array of shape
+            (frames, len(what)) and the device time of every frame in
+            seconds, since syncClock() if it ran (convert them with
+            device_time_to_host) or else since the sampling started
+        """
+        import numpy as np
+        what = list(what)
+        samples = np.empty((n, len(what)), dtype=np.uint16)
+        pos = 0
+        frames = self._sampleFrames(period_us, what, n, chunk)
+        try:
+            start, period = next(frames)
+            for block in frames:
+                samples[pos:pos + len(block)] = block
+                pos += len(block)
+        finally:
+            frames.close()
+        return samples[:pos], start + np.arange(1, pos + 1) * period
+
+    def sampleEveryIter(self, period_us, what, n=None, chunk=None):
+        """
+        Generator form of sampleEvery: yields numpy.uint16 arrays of up to
+        `chunk` frames (SAMPLE_READ_TIME worth by default).
+        """
+        frames = self._sampleFrames(period_us, what, n, chunk)
+        next(frames)
+        yield from frames
+
+    def _sampleFrames(self, period_us, what, n, chunk):
+        """
+        sampleEveryIter, but first yields (start, period): the device time
+        of the Timer1 reset the frames count from and the sample period,
+        both in seconds.
+        """
+        import numpy as np
+        setup, body, fields, chunk, head, timing = self._sampleSetup(period_us, what, chunk)
+        frame = np.dtype(fields)
+        stream = self._stream(setup, body, frame.itemsize, n, chunk, loop=True, head=head)
+        try:
+            yield self._sampleStart(next(stream) if head else b'', timing)
+            for rd in stream:
+                block = np.frombuffer(rd, dtype=frame)
+                yield np.column_stack([block[name] for name, size in fields]).astype(np.uint16)
+        finally:
+            stream.close()
+
+    def _sampleSetup(self, period_us, what, chunk):
+        """
+        Returns the stream's setup and body commands, the frame fields,
+        the chunk size, the size of the setup's response and the timing
+        _sampleStart() needs. The setup reads syncClock()'s stopwatch (if
+        it runs), sets the sample period and restarts Timer1.
+        """
+        body, fields = sample_frame(what, self.profile)
+        frame_size = sum(2 if size == '<u2' else 1 for name, size in fields)
+        chunk = chunk or max(1, min(LOOP_READ_SIZE // frame_size,
+                                    int(SAMPLE_READ_TIME * 1e6 / period_us)))
+        log.debug('sampleEvery: %s every %sus', what, period_us)
+        setup = bytearray()
+        head = 0
+        if self.clock is not None:
+            self.clock.stop()
+            setup += STOPWATCH_READ
+            head = STOPWATCH_READ_SIZE
+        icr1, prescaler = self.TimerOne._period(period_us)
+        setup += bytes([SET_DATA, icr1 >> 8, SET_REGISTER, uK.ICR1H,
+                        SET_DATA, icr1 & 0xFF, SET_REGISTER, uK.ICR1L,
+                        SET_DATA, self.TimerOne.tccr1b, SET_REGISTER, uK.TCCR1B])
+        if frame_size > len(fields):
+            setup += ADC_SETUP
+        setup += bytes([SET_DATA, 0, SET_REGISTER, uK.TCNT1H,
+                        SET_DATA, 0, SET_REGISTER, uK.TCNT1L])
+        # the commands run as their bytes arrive, the reset is this many
+        # byte times after the stopwatch's last TCNT1 read
+        reset_delay = (len(setup) - STOPWATCH_LATCH) * 10.0 / self.sr.baudrate
+        setup += bytes([SET_DATA, 1 << uK.TOV1, SET_REGISTER, uK.TIFR1])
+        period = 2 * icr1 * prescaler / (self.profile.f_cpu * 1e6)
+        return bytes(setup), body, fields, chunk, head, (reset_delay, period)
+
+    def _sampleStart(self, rd, timing):
+        """
+        returns: (start, period) of _sampleFrames from the setup's
+            response rd, start is nan if the stopwatch read failed
+        """
+        reset_delay, period = timing
+        if self.clock is None:
+            return 0.0, period
+        if len(rd) < STOPWATCH_READ_SIZE:
+            log.error('sampleEvery: %d of %d stopwatch bytes received.',
+                      len(rd), STOPWATCH_READ_SIZE)
+            return float('nan'), period
+        ticks = self.TimerOne._countTicks(rd[0] | rd[1] << 8, rd[2], rd[3] | rd[4] << 8)
+        return self.clock.device_time(ticks) + reset_delay, period
+
+    def measurePulses(self, n, edge='rising', prescaler=8, chunk=None):
+        """
+        Times n pulses on ICP1 (pin 8, PB0) with Timer1 input capture: the
+        timer copies TCNT1 into ICR1 on the edge, so the timestamps resolve
+        to one timer tick (0.5us at prescaler 8 and 16MHz) instead of the
+        USB latency. The capture sequence of pulse_frame() runs in a
+        cmdDo/cmdLoop (commands written ahead would arrive at only ~1.7ms
+        per pulse), so pulses must be longer than the ~350us their 4
+        response bytes take on the wire. Pin 8 is made an INPUT and Timer1
+        is taken over (see setAsStopWatch); the loop ends with cmdStop(),
+        the firmware reset makes pin 8 an output again.
+        inputs:
+            n: number of pulses
+            edge: 'rising' or 'falling', the edge that starts a pulse
+            prescaler: Timer1 prescaler, every HIGH and LOW phase must be
+                shorter than 65536 ticks (32.8ms at 8) and longer than the
+                ~20us the firmware needs to switch the edge
+            chunk: pulses per read (PULSE_CHUNK), a slow signal must
+                deliver them within the port's timeout
+        returns:
+            Pulses(timestamps, widths, period, frequency, duty), see
+            decode_pulses(); fewer pulses if the signal stopped
+        """
+        rising = edge == 'rising'
+        log.debug('measurePulses: %d %s edges, prescaler %d', n, edge, prescaler)
+        self.TimerOne.setAsInputCapture(prescaler, rising)
+        rd = b''.join(self._stream(b'', pulse_frame(rising), 4, n + 1,
+                                   chunk or PULSE_CHUNK, loop=True))
+        # the first pulse is dropped: its body still came over the wire
+        return decode_pulses(rd[4:], rising, prescaler / (self.F_CPU * 1e6))
+
+    """
+    ##############################################################
+    ##     clock (GetFclk/CalibrateFclk of the .NET DLL)
+    ##############################################################
+    """
+
+    def syncClock(self, prescaler=1024, window=32):
+        """
+        Starts correlating Timer1 with the host's clock, see clocksync.py.
+        Call board.clock.sample() (or board.clock.start()) at least once
+        per Timer1 overflow, 4.2s at prescaler 1024.
+        returns: the ClockSync
+        """
+        from Arduino.clocksync import ClockSync
+        if self.clock is not None:
+            self.clock.stop()
+        self.clock = ClockSync(self, prescaler, window)
+        self.clock.reset()
+        return self.clock
+
+    def device_time_to_host(self, t_device):
+        """
+        Converts device seconds since syncClock() into host
+        time.monotonic() seconds, corrected for the board's clock drift.
+        """
+        if self.clock is None:
+            raise ValueError('device_time_to_host needs syncClock() first.')
+        return self.clock.device_time_to_host(t_device)
+
+    def calibrateFclk(self, f_cpu=None):
+        """
+        Sets the F_CPU (MHz) Timer.setPeriod computes with: the given
+        value, or the clock measured by syncClock() (sample it over a few
+        seconds first, the fit improves with the time span).
+        returns: the new F_CPU
+        """
+        if f_cpu is None:
+            if self.clock is None or len(self.clock.samples) < 2:
+                raise ValueError('calibrateFclk needs a frequency or syncClock() samples.')
+            f_cpu = self.clock.f_cpu()
+        log.info('F_CPU calibrated to %.6f MHz.', f_cpu)
+        self.F_CPU = f_cpu
+        return f_cpu
+
+    def _stream(self, setup, body, response_size, n=None, chunk=None, loop=False,
+                head=0):
+        """
+        Sends setup once and then body n times (endlessly if n is None),
+        yielding the responses of up to `chunk` bodies at a time.
+        Only complete responses are yielded. The board's lock is held
+        until the stream ends. A loop stream whose setup answers `head`
+        bytes yields them on their own first.
+        """
+        with self.lock:
+            self._flushInput()
+            if loop:
+                chunk = chunk or max(1, LOOP_READ_SIZE // response_size)
+                with self.batch():
+                    self.sendAPICmd(setup)
+                    self.cmdDo()
+                    self.sendAPICmd(body)
+                    self.cmdLoop()
+                try:
+                    if head:
+                        yield self._read(head)
+                    done = 0
+                    while n is None or done < n:
+                        size = chunk if n is None else min(chunk, n - done)
+                        rd = self._read(response_size * size)
+                        if len(rd) < response_size * size:
+                            log.error('stream: %d of %d bytes received.', len(rd), response_size * size)
+                            yield rd[:len(rd) - len(rd) % response_size]
+                            return
+                        yield rd
+                        done += size
+                finally:
+                    self.cmdStop()
+            else:
+                chunk = chunk or max(1, STREAM_WRITE_SIZE // len(body))
+                bodies = memoryview(body * chunk)   # encoded once, sliced per write
+                pending = deque()
+                queued = 0
+                try:
+                    while True:
+                        while len(pending) < STREAM_DEPTH and (n is None or queued < n):
+                            size = chunk if n is None else min(chunk, n - queued)
+                            if setup:
+                                self.sendAPICmd(setup + body * size)
+                                setup = b''
+                            else:
+                                self.sendAPICmd(bodies[:len(body) * size])
+                            pending.append(size)
+                            queued += size
+                        if not pending:
+                            return
+                        size = pending.popleft()
+                        rd = self._read(response_size * size)
+                        if len(rd) < response_size * size:
+                            log.error('stream: %d of %d bytes received.', len(rd), response_size * size)
+                            pending.clear()
+                            self._flushInput()
+                            yield rd[:len(rd) - len(rd) % response_size]
+                            return
+                        yield rd
+                finally:
+                    if pending:
+                        # the consumer stopped early, keep responses in step
+                        self._read(response_size * sum(pending))
+
     def test():
         def init():
             log.debug('initialize..')
@@ -500,7 +1592,10 @@ class Timer:
         self.parent = parent
         self.TIMER_RESOLUTION = 65536   
         self.prescaler_clock_select_bits = 0
-        self.tccr1b = uK.WGM13
+        self.stopwatch_prescaler = 1
+        self._overflow_ticks = 0
+        self._tov1_counted = False
+        self.tccr1b = encode('TCCR1B', WGM13=1)
         self.parent.setRegister(uK.TCCR1B,self.tccr1b) #set WGM13 -> set mode as phase and frequency correct pwm, stop the timer
         self.tccr1a = 0x00
         self.parent.setRegister(uK.TCCR1A,self.tccr1a) # clear
@@ -513,40 +1608,38 @@ class Timer:
         """
         Set period of TimerOne to micreseconds
         """
-        cycles = (self.parent.F_CPU / 2) * microseconds
-        pwmPeriod = int(cycles)
-        cmd_str = bytearray()
-        if cycles < self.TIMER_RESOLUTION:
-            self.prescaler_clock_select_bits = 1<<uK.CS10
-            pwmPeriod = cycles
-        elif cycles < (self.TIMER_RESOLUTION * 8):
-            self.prescaler_clock_select_bits = 1<<uK.CS11
-            pwmPeriod = cycles / 8;
-        elif cycles < (self.TIMER_RESOLUTION * 64):
-            self.prescaler_clock_select_bits = 1<<uK.CS11 | 1<<uK.CS10
-            pwmPeriod = cycles / 64;
-        elif cycles < (self.TIMER_RESOLUTION * 256):
-            self.prescaler_clock_select_bits = 1<<uK.CS12
-            pwmPeriod = cycles / 256
-        elif cycles < (self.TIMER_RESOLUTION * 1024):
-            self.prescaler_clock_select_bits = 1<<uK.CS12 | 1<<uK.CS10
-            pwmPeriod = cycles / 1024
-        else:
-            self.prescaler_clock_select_bits = 1<<uK.CS12 | 1<<uK.CS10
-            log.error("Timer One period time is to long. Max value is 8.39s = 8388608us")
-            pwmPeriod = self.TIMER_RESOLUTION - 1
+        pwmPeriod, prescaler = self._period(microseconds)
         
         #ICR1 = pwmPeriod;
         pwmPeriod_in_bytes = int(pwmPeriod).to_bytes(16, "little", signed=False)
         self.parent.setRegister(uK.ICR1H, pwmPeriod_in_bytes[1])
-        log.debug('wrifying ICR1H ... = ' + str(self.parent.readRegister(uK.ICR1H)))
         self.parent.setRegister(uK.ICR1L, pwmPeriod_in_bytes[0])
-        log.debug('wrifying ICR1L ... = ' + str(self.parent.readRegister(uK.ICR1L)))
+        if log.isEnabledFor(logging.DEBUG):
+            # verification costs two round trips, so only when debugging
+            log.debug('wrifying ICR1 ... = %s', self.parent.read16bRegister(uK.ICR1L))
                 
         #timer1 Start
-        self.tccr1b = 1<<uK.WGM13 | self.prescaler_clock_select_bits
         self.parent.setRegister(uK.TCCR1B, self.tccr1b)
 
+    def _period(self, microseconds):
+        """
+        Selects the prescaler for a period of microseconds, without
+        writing it to the board.
+        returns: ICR1 and the prescaler, TCCR1B is kept in self.tccr1b
+        """
+        cycles = (self.parent.F_CPU / 2) * microseconds
+        for prescaler, clock_select in T1_PRESCALERS:
+            if cycles < self.TIMER_RESOLUTION * prescaler:
+                pwmPeriod = int(cycles / prescaler)
+                break
+        else:
+            prescaler, clock_select = T1_PRESCALERS[-1]
+            log.error("Timer One period time is to long. Max value is 8.39s = 8388608us")
+            pwmPeriod = self.TIMER_RESOLUTION - 1
+        self.prescaler_clock_select_bits = encode('TCCR1B', CS1=clock_select)
+        self.tccr1b = encode('TCCR1B', WGM13=1) | self.prescaler_clock_select_bits
+        return pwmPeriod, prescaler
+
         
     def start(self):
         self.parent.setRegister(uK.TCCR1B,self.tccr1b)
@@ -561,3 +1654,112 @@ class Timer:
         self.setPeriod(delay_microseconds)
         self.parent.waitUntilBitIsSet(uK.TOV1, uK.TIFR1)
         
+
+    """
+    ##############################################################
+    ##     StopWatch (SetTimer1AsStopWatch.. of the .NET DLL)
+    ##############################################################
+    """
+
+    def setAsStopWatch(self, prescaler=1):
+        """
+        Configures Timer1 as a free running 16 bit counter (normal mode),
+        stopped and cleared. Start it with startStopWatch().
+        inputs:
+            prescaler: 1, 8, 64, 256 or 1024 - one tick is prescaler/F_CPU,
+                TCNT1 overflows after 65536 ticks (4.1ms at 1, 4.2s at 1024)
+        """
+        clock_select = dict(T1_PRESCALERS).get(prescaler)
+        if clock_select is None:
+            raise ValueError('Timer1 prescaler must be one of %s.'
+                             % ', '.join(str(p) for p, cs in T1_PRESCALERS))
+        self.stopwatch_prescaler = prescaler
+        self.prescaler_clock_select_bits = encode('TCCR1B', CS1=clock_select)
+        self.tccr1b = self.prescaler_clock_select_bits
+        self.tccr1a = 0x00
+        with self.parent.batch():
+            self.parent.setRegister(uK.TCCR1B, 0x00)      # stop
+            self.parent.setRegister(uK.TCCR1A, self.tccr1a)
+            self.parent.setRegister(uK.TCCR1C, 0x00)
+            self.parent.setRegister(uK.TIMSK1, 0x00)
+            self.resetStopWatch()
+
+    def setAsInputCapture(self, prescaler=8, rising=True):
+        """
+        Timer1 as a free running counter that captures TCNT1 into ICR1 on
+        the rising (or falling) edges of ICP1 (pin 8), which is made an
+        INPUT. See measurePulses.
+        """
+        self.setAsStopWatch(prescaler)
+        if rising:
+            self.tccr1b |= 1 << uK.ICES1
+        with self.parent.batch():
+            self.parent.writeRegisterBit(uK.DDB0, uK.DDRB, 0)
+            self.startStopWatch()
+            self.parent.setRegister(uK.TIFR1, 1 << uK.ICF1)   # edge changed: clear ICF1
+
+    def startStopWatch(self):
+        self.parent.setRegister(uK.TCCR1B, self.tccr1b)
+
+    def stopStopWatch(self):
+        self.parent.setRegister(uK.TCCR1B, 0x00)
+
+    def resetStopWatch(self):
+        """
+        Clears TCNT1 and the overflow flag.
+        """
+        self._overflow_ticks = 0
+        self._tov1_counted = False
+        with self.parent.batch():
+            self.parent.setRegister(uK.TCNT1H, 0x00)      # high byte first
+            self.parent.setRegister(uK.TCNT1L, 0x00)
+            self.parent.setRegister(uK.TIFR1, 0xFF)       # writing 1 clears all flags
+
+    def readStopWatchTicks(self):
+        """
+        Timer1 ticks since the stopwatch was reset. TCNT1 is read before
+        and after TOV1, which is cleared only if it was read as set (see
+        STOPWATCH_READ); every overflow adds 65536 ticks once - so read
+        at least once per overflow period. Inside a batch the read is
+        queued behind the commands before it, e.g.
+            with board.batch():
+                board.TimerOne.startStopWatch()
+                board.waitUntilBitIsSet(8)
+                board.TimerOne.stopStopWatch()
+                ticks = board.TimerOne.readStopWatchTicks()
+        returns:
+            ticks, None if the board did not answer
+        """
+        parent = self.parent
+        with parent.lock:
+            parent._flushInput()
+            parent.sendAPICmd(STOPWATCH_READ)
+            rd = parent._read(STOPWATCH_READ_SIZE)
+        if len(rd) < STOPWATCH_READ_SIZE:
+            if parent._recording is None:
+                log.error('readStopWatch: %d of %d bytes received.', len(rd),
+                          STOPWATCH_READ_SIZE)
+            return None
+        return self._countTicks(rd[0] | rd[1] << 8, rd[2], rd[3] | rd[4] << 8)
+
+    def _countTicks(self, before, overflow, ticks):
+        """
+        Adds the overflows seen by a STOPWATCH_READ to its TCNT1. TCNT1
+        wrapped after TOV1 was read if it went down with no flag: that
+        overflow is counted now and its flag, still set, by the next read.
+        """
+        if overflow and not self._tov1_counted:
+            self._overflow_ticks += self.TIMER_RESOLUTION
+        self._tov1_counted = ticks < before and not overflow
+        if self._tov1_counted:
+            self._overflow_ticks += self.TIMER_RESOLUTION
+        return self._overflow_ticks + ticks
+
+    def readStopWatch(self):
+        """
+        returns: microseconds since the stopwatch was reset
+        """
+        ticks = self.readStopWatchTicks()
+        if ticks is None:
+            return None
+        return ticks * self.stopwatch_prescaler / self.parent.F_CPU
@@ -0,0 +1,594 @@
+#!/usr/bin/env python
+"""
+asyncio client for the Arduino API firmware.
+
+AsyncArduino has the same methods as Arduino. Commands that only write
+(pinMode, digitalWrite, setRegister, cmdDo, ...) are sent immediately and
+need not be awaited. Commands that read return awaitables: the command is
+written when the coroutine starts and resolves when its response bytes
+arrive. The firmware answers in order, so every read queues a (size,
+future) pair and incoming bytes are handed to the futures first in, first
+out. Any number of reads - of one or several boards - can be outstanding:
+
+    async def main():
+        board = AsyncArduino('/dev/ttyUSB0')
+        board.pinMode(13, 'OUTPUT')
+        a0, a1, pins = await asyncio.gather(board.analogRead(0),
+                                            board.analogRead(1),
+                                            board.readRegister(uK.PIND))
+        async for block in board.analogStreamIter(0, 6000, loop=True):
+            print(block.mean())
+
+Wrap an endless stream in contextlib.aclosing() when leaving it with
+break, so the loop is stopped right away and not when the generator is
+garbage collected.
+
+The serial port is watched with loop.add_reader() and written through
+a non-blocking queue drained by loop.add_writer(), so this needs a port
+with a file descriptor (POSIX). The constructor waits until the power-on
+version byte of a freshly reset board has arrived, it would otherwise
+be taken for the first response.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+import serial
+from Arduino.arduino import (Arduino, Timer, find_port, decode_response,
+                             RESPONSE_SIZE, PROCES_RESET, ADC_SETUP,
+                             ADC_CONVERSION, STREAM_WRITE_SIZE, STREAM_DEPTH,
+                             LOOP_READ_SIZE, STOP_DRAIN_TIMEOUT, READ_REGISTER,
+                             PULSE_CHUNK, adc_select, adc_scan_frame,
+                             logic_registers, logic_bits, pulse_frame,
+                             decode_pulses)
+from Arduino.program import Recorder
+
+log = logging.getLogger(__name__)
+
+SYNC_QUIET = 0.1            # s of silence that end the power-on drain
+
+
+class AsyncArduino(Arduino):
+
+    def __init__(self, port=None, baud=115200, timeout=2, sr=None, board='uno',
+                 metrics=False):
+        """
+        port: serial port name, searched for if not given
+        timeout: seconds a read waits for its response
+        sr: an already opened pyserial port (it is switched to
+            non-blocking reads)
+        board, metrics: see Arduino
+        """
+        if not sr:
+            if not port:
+                sr = find_port(baud, timeout)
+                if not sr:
+                    raise ValueError("Could not find port.")
+            else:
+                sr = serial.Serial(port, baud, timeout=0)
+        self.timeout = timeout
+        self._sync(sr)
+        sr.timeout = 0
+        os.set_blocking(sr.fileno(), False)
+        self._rx = bytearray()
+        self._tx = bytearray()          # written when the port takes it
+        self._writing = False
+        self._pending = deque()         # [size, future] in request order
+        self._streaming = False
+        self._draining = False
+        self._last_rx = 0
+        self._loop = None
+        self._recorder = Recorder()     # reused by every request
+        Arduino.__init__(self, sr=sr, board=board, metrics=metrics)
+
+    def _newTimer(self):
+        return AsyncTimer(self)
+
+    def _sync(self, sr):
+        """
+        Asks for the version and reads until the port is quiet, so that
+        the power-on version byte can not arrive after the first request.
+        """
+        sr.timeout = SYNC_QUIET
+        sr.write(bytes([PROCES_RESET]))
+        deadline = time.monotonic() + self.timeout
+        received = b''
+        while True:
+            rd = sr.read(64)
+            if rd:
+                received += rd
+            elif received or time.monotonic() >= deadline:
+                break
+        if not received:
+            log.error('AsyncArduino: the board did not answer the version request.')
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.remove_reader(self.sr.fileno())
+            if self._writing:
+                self._loop.remove_writer(self.sr.fileno())
+                self._writing = False
+            self._loop = None
+        if self._tx:
+            os.set_blocking(self.sr.fileno(), True)
+            self.sr.write(bytes(self._tx))
+            del self._tx[:]
+        self.sr.close()
+
+    """
+    ##############################################################
+    ##     transport
+    ##############################################################
+    """
+
+    def _attach(self):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._loop.add_reader(self.sr.fileno(), self._onReadable)
+
+    def _onReadable(self):
+        try:
+            data = self.sr.read(self.sr.in_waiting or 1)
+        except serial.SerialException as e:
+            log.error('AsyncArduino: %s', e)
+            return
+        if data:
+            self._last_rx = self._loop.time()
+            self._received(data)
+
+    def _write(self, cmd_str):
+        """
+        Queues cmd_str and writes as much of it as the port takes without
+        blocking; the rest is written when the port becomes writable.
+        """
+        if self.metrics is not None:
+            self.metrics.written(cmd_str)
+        self._tx += cmd_str
+        self._onWritable()
+        return True
+
+    def _onWritable(self):
+        fd = self.sr.fileno()
+        try:
+            del self._tx[:os.write(fd, self._tx)]
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            log.error('AsyncArduino: %s', e)
+            return
+        if self._tx and not self._writing:
+            try:
+                self._attach()
+            except RuntimeError:
+                # no event loop yet, e.g. the constructor's commands
+                os.set_blocking(fd, True)
+                self.sr.write(bytes(self._tx))
+                os.set_blocking(fd, False)
+                del self._tx[:]
+                return
+            self._loop.add_writer(fd, self._onWritable)
+            self._writing = True
+        elif not self._tx and self._writing:
+            self._loop.remove_writer(fd)
+            self._writing = False
+
+    def _received(self, data):
+        if self._draining:
+            return
+        self._rx += data
+        while self._pending and len(self._rx) >= self._pending[0][0]:
+            size, future = self._pending.popleft()
+            rd = bytes(self._rx[:size])
+            del self._rx[:size]
+            if not future.done():
+                future.set_result(rd)
+
+    def _flushInput(self):
+        """
+        Stale bytes are dropped when a new read finds nothing pending.
+        """
+        if not self._pending and not self._streaming:
+            del self._rx[:]
+            if self.sr.in_waiting:
+                self.sr.reset_input_buffer()
+
+    def _expect(self, size):
+        """
+        Queues a future for the next `size` response bytes. Must be called
+        before the command is written.
+        """
+        self._attach()
+        self._flushInput()
+        future = self._loop.create_future()
+        if size == 0:
+            future.set_result(b'')
+        else:
+            self._pending.append([size, future])
+        return future
+
+    async def _response(self, future, size):
+        started = time.perf_counter()
+        try:
+            rd = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            # the entry stays queued, late bytes are still matched to it
+            log.error('AsyncArduino: no response in %s s (%d bytes).', self.timeout, size)
+            rd = b''
+        if self.metrics is not None:
+            self.metrics.read(size, rd, started)
+        return rd
+
+    def _capture(self, method, *args):
+        """
+        Encodes the commands of an Arduino method without sending them.
+        """
+        self._recorder.clear()
+        self._recording = self._recorder
+        try:
+            method(self, *args)
+        finally:
+            rec, self._recording = self._recording, None
+        return rec
+
+    async def _request(self, method, *args):
+        """
+        Sends the commands of an Arduino read method and returns the
+        decoded responses as a list.
+        """
+        rec = self._capture(method, *args)
+        reads = rec.reads           # the recorder is reused by the next request
+        size = sum(RESPONSE_SIZE[cmd] for cmd in reads)
+        future = self._expect(size)
+        self._send(rec.code)
+        rd = await self._response(future, size)
+        values = []
+        pos = 0
+        for cmd in reads:
+            if pos + RESPONSE_SIZE[cmd] <= len(rd):
+                values.append(decode_response(cmd, rd[pos:pos + RESPONSE_SIZE[cmd]]))
+            else:
+                values.append(None)
+            pos += RESPONSE_SIZE[cmd]
+        return values
+
+    def _send(self, cmd_str):
+        """
+        Writes already counted commands, after an open batch.
+        """
+        if self._batch is not None:
+            self._batch += cmd_str
+            self._flushBatch()
+        else:
+            self._write(cmd_str)
+
+    """
+    ##############################################################
+    ##     reads
+    ##############################################################
+    """
+
+    async def version(self):
+        self._flushBatch()
+        future = self._expect(1)
+        self._write(bytes([PROCES_RESET]))
+        rd = await self._response(future, 1)
+        self.cmd_buffer_num = 0
+        return int.from_bytes(rd, byteorder='big')
+
+    async def softwareReset(self):
+        return 0 if await self.version() else -1
+
+    async def readRegister(self, reg_name):
+        return (await self._request(Arduino.readRegister, reg_name))[0]
+
+    async def readRegisterBit(self, bit_name, reg_name):
+        return (await self._request(Arduino.readRegisterBit, bit_name, reg_name))[0]
+
+    async def read16bRegister(self, reg_name):
+        return (await self._request(Arduino.read16bRegister, reg_name))[0]
+
+    async def readMany(self, requests):
+        return await self._request(Arduino.readMany, requests)
+
+    async def readADC(self):
+        return (await self._request(Arduino.readADC))[0]
+
+    async def digitalRead(self, pin):
+        return (await self._request(Arduino.digitalRead, pin))[0]
+
+    async def analogRead(self, pin):
+        return (await self._request(Arduino.analogRead, pin))[0]
+
+    async def readPorts(self, as_array=False, capture=None):
+        registers = self._pinRegisters()
+        return self._ports(registers, await self.readMany(registers), as_array, capture)
+
+    """
+    ##############################################################
+    ##     programs
+    ##############################################################
+    """
+
+    def compile(self, builder, *args, **kwargs):
+        """
+        Arduino.compile; the builder gets the blocking methods, so its
+        reads are recorded instead of returning coroutines.
+        """
+        return Arduino.compile(_Blocking(self), builder, *args, **kwargs)
+
+    async def run(self, program):
+        if program.loops:
+            self._loop_open = False
+        if not program.reads or program.loops:
+            self.sendAPICmd(program.code)
+            return None
+        size = program.response_size
+        future = self._expect(size)
+        self.sendAPICmd(program.code)
+        self._flushBatch()
+        return program.decode(await self._response(future, size))
+
+    """
+    ##############################################################
+    ##     streaming
+    ##############################################################
+    """
+
+    async def cmdStop(self):
+        """
+        Resets the firmware to stop a running cmdDo/cmdLoop and waits until
+        the port is silent. Reads still waiting are cancelled.
+        """
+        self._attach()
+        self._loop_open = False
+        self._draining = True
+        self._last_rx = self._loop.time()
+        self._write(bytes([PROCES_RESET]))
+        try:
+            while self._loop.time() - self._last_rx < STOP_DRAIN_TIMEOUT:
+                await asyncio.sleep(STOP_DRAIN_TIMEOUT / 4)
+        finally:
+            self._draining = False
+            self._streaming = False
+            del self._rx[:]
+            while self._pending:
+                self._pending.popleft()[1].cancel()
+            self.cmd_buffer_num = 0
+            self.cmd_do_buffer_num = 0
+
+    async def analogStream(self, channel, n, loop=False):
+        import numpy as np
+        samples = np.empty(n, dtype=np.uint16)
+        pos = 0
+        blocks = self.analogStreamIter(channel, n, loop=loop)
+        try:
+            async for block in blocks:
+                samples[pos:pos + len(block)] = block
+                pos += len(block)
+        finally:
+            await blocks.aclose()
+        return samples[:pos]
+
+    async def analogStreamIter(self, channel, n=None, chunk=None, loop=False):
+        import numpy as np
+        setup = adc_select(self.profile.adc_channel(channel)) + ADC_SETUP
+        stream = self._stream(setup, ADC_CONVERSION, 2, n, chunk, loop)
+        try:
+            async for rd in stream:
+                yield np.frombuffer(rd, dtype='<u2').astype(np.uint16)
+        finally:
+            await stream.aclose()
+
+    async def analogScan(self, channels, n_frames, loop=False):
+        import numpy as np
+        channels = [self.profile.adc_channel(channel) for channel in channels]
+        samples = np.empty((n_frames, len(channels)), dtype=np.uint16)
+        timestamps = np.empty(n_frames)
+        pos = 0
+        t_prev = self._now()
+        stream = self._stream(ADC_SETUP, adc_scan_frame(channels),
+                              2 * len(channels), n_frames, None, loop)
+        try:
+            async for rd in stream:
+                t = self._now()
+                block = np.frombuffer(rd, dtype='<u2').reshape(-1, len(channels))
+                samples[pos:pos + len(block)] = block
+                timestamps[pos:pos + len(block)] = np.linspace(t_prev, t, len(block) + 1)[1:]
+                pos += len(block)
+                t_prev = t
+        finally:
+            await stream.aclose()
+        return samples[:pos], timestamps[:pos]
+
+    async def captureLogic(self, ports=None, n_samples=1000):
+        if ports is None:
+            registers = self._pinRegisters()
+        else:
+            registers = logic_registers(ports)
+        raw = await self.captureLogicRaw(registers, n_samples)
+        return logic_bits(raw, registers, self.profile.pins)
+
+    async def captureLogicRaw(self, ports, n_samples):
+        import numpy as np
+        registers = logic_registers(ports)
+        raw = np.empty((n_samples, len(registers)), dtype=np.uint8)
+        pos = 0
+        blocks = self.captureLogicIter(registers, n_samples)
+        try:
+            async for block in blocks:
+                raw[pos:pos + len(block)] = block
+                pos += len(block)
+        finally:
+            await blocks.aclose()
+        return raw[:pos]
+
+    async def captureLogicIter(self, ports, n=None, chunk=None):
+        import numpy as np
+        registers = logic_registers(ports)
+        body = b''.join(bytes([READ_REGISTER, reg]) for reg in registers)
+        stream = self._stream(b'', body, len(registers), n, chunk, loop=True)
+        try:
+            async for rd in stream:
+                yield np.frombuffer(rd, dtype=np.uint8).reshape(-1, len(registers))
+        finally:
+            await stream.aclose()
+
+    async def captureEdges(self, ports=None, n_samples=None, capture=None):
+        capture = self._edgeCapture(ports, capture)
+        blocks = self.captureLogicIter(capture.registers, n_samples)
+        try:
+            async for block in blocks:
+                capture.append(block)
+        except asyncio.CancelledError:
+            log.info('captureEdges: stopped after %d samples.', len(capture))
+            raise
+        finally:
+            await blocks.aclose()
+        return capture
+
+    async def sampleEvery(self, period_us, what, n, chunk=None):
+        import numpy as np
+        what = list(what)
+        samples = np.empty((n, len(what)), dtype=np.uint16)
+        pos = 0
+        frames = self._sampleFrames(period_us, what, n, chunk)
+        try:
+            start, period = await frames.__anext__()
+            async for block in frames:
+                samples[pos:pos + len(block)] = block
+                pos += len(block)
+        finally:
+            await frames.aclose()
+        return samples[:pos], start + np.arange(1, pos + 1) * period
+
+    async def sampleEveryIter(self, period_us, what, n=None, chunk=None):
+        frames = self._sampleFrames(period_us, what, n, chunk)
+        try:
+            await frames.__anext__()
+            async for block in frames:
+                yield block
+        finally:
+            await frames.aclose()
+
+    async def _sampleFrames(self, period_us, what, n, chunk):
+        import numpy as np
+        setup, body, fields, chunk, head, timing = self._sampleSetup(period_us, what, chunk)
+        frame = np.dtype(fields)
+        stream = self._stream(setup, body, frame.itemsize, n, chunk, loop=True, head=head)
+        try:
+            yield self._sampleStart(await stream.__anext__() if head else b'', timing)
+            async for rd in stream:
+                block = np.frombuffer(rd, dtype=frame)
+                yield np.column_stack([block[name] for name, size in fields]).astype(np.uint16)
+        finally:
+            await stream.aclose()
+
+    async def measurePulses(self, n, edge='rising', prescaler=8, chunk=None):
+        rising = edge == 'rising'
+        self.TimerOne.setAsInputCapture(prescaler, rising)
+        rd = b''
+        stream = self._stream(b'', pulse_frame(rising), 4, n + 1,
+                              chunk or PULSE_CHUNK, loop=True)
+        try:
+            async for block in stream:
+                rd += block
+        finally:
+            await stream.aclose()
+        return decode_pulses(rd[4:], rising, prescaler / (self.F_CPU * 1e6))
+
+    async def syncClock(self, prescaler=1024, window=32):
+        from Arduino.clocksync import ClockSync
+        if self.clock is not None:
+            self.clock.stop()
+        self.clock = ClockSync(self, prescaler, window)
+        await self.clock.resetAsync()
+        return self.clock
+
+    def _now(self):
+        self._attach()
+        return self._loop.time()
+
+    async def _stream(self, setup, body, response_size, n=None, chunk=None, loop=False,
+                      head=0):
+        """
+        async version of Arduino._stream
+        """
+        self._attach()
+        if loop:
+            chunk = chunk or max(1, LOOP_READ_SIZE // response_size)
+            self._flushInput()
+            with self.batch():
+                self.sendAPICmd(setup)
+                self.cmdDo()
+                self.sendAPICmd(body)
+                self.cmdLoop()
+            self._streaming = True
+            try:
+                if head:
+                    yield await self._response(self._expect(head), head)
+                done = 0
+                while n is None or done < n:
+                    size = response_size * (chunk if n is None else min(chunk, n - done))
+                    rd = await self._response(self._expect(size), size)
+                    if len(rd) < size:
+                        return
+                    yield rd
+                    done += size // response_size
+            finally:
+                await self.cmdStop()
+        else:
+            chunk = chunk or max(1, STREAM_WRITE_SIZE // len(body))
+            bodies = memoryview(body * chunk)
+            pending = deque()
+            queued = 0
+            while True:
+                while len(pending) < STREAM_DEPTH and (n is None or queued < n):
+                    size = chunk if n is None else min(chunk, n - queued)
+                    pending.append((self._expect(response_size * size), response_size * size))
+                    if setup:
+                        self.sendAPICmd(setup + body * size)
+                        setup = b''
+                    else:
+                        self.sendAPICmd(bodies[:len(body) * size])
+                    queued += size
+                if not pending:
+                    return
+                future, size = pending.popleft()
+                rd = await self._response(future, size)
+                if len(rd) < size:
+                    return
+                yield rd
+
+
+class _Blocking:
+    """
+    An AsyncArduino seen through the methods of Arduino, for recording.
+    """
+    def __init__(self, board):
+        self._board = board
+
+    def __getattr__(self, name):
+        method = getattr(Arduino, name, None)
+        if callable(method):
+            return method.__get__(self._board)
+        return getattr(self._board, name)
+
+
+class AsyncTimer(Timer):
+    """
+    TimerOne of an AsyncArduino: the stopwatch reads are awaitable.
+    """
+
+    async def readStopWatchTicks(self):
+        values = await self.parent._request(lambda board: Timer.readStopWatchTicks(self))
+        if None in values:
+            log.error('readStopWatch: no response.')
+            return None
+        return self._countTicks(*values)
+
+    async def readStopWatch(self):
+        ticks = await self.readStopWatchTicks()
+        if ticks is None:
+            return None
+        return ticks * self.stopwatch_prescaler / self.parent.F_CPU
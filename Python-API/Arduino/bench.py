@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the serial protocol.
+
+    python -m Arduino.bench --emulator                  # modelled 115200 baud wire
+    python -m Arduino.bench --port /dev/ttyUSB0 --save baseline.json
+    python -m Arduino.bench --port /dev/ttyUSB0 --compare baseline.json
+
+Every benchmark is repeated and reported as JSON with the p50/p95/p99 of
+its repetitions:
+    latency         - one readRegister round trip (us)
+    write           - digitalWrite commands/s, one write call each
+    pipelined_read  - readMany reads/s, 64 requests per write
+    adc_stream      - analogStream samples/s
+    adc_stream_loop - analogStream(loop=True) samples/s
+    cmd_loop        - cmdLoop iterations/s of a one-register read body
+On the emulator the times are the emulator's virtual seconds, so the
+numbers show the protocol and the wire, not the speed of this computer.
+
+--compare exits with 1 when a p50 is worse than the baseline's by more
+than the tolerance.
+"""
+import argparse
+import json
+import logging
+import math
+import sys
+import time
+from Arduino import Arduino
+from Arduino import m328p as uK
+from Arduino.arduino import READ_REGISTER
+
+log = logging.getLogger(__name__)
+
+TOLERANCE = 0.1             # p50 may be 10% worse than the baseline
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, q):
+    """
+    Nearest rank percentile of a non empty list.
+    """
+    values = sorted(values)
+    rank = max(1, math.ceil(q / 100.0 * len(values)))
+    return values[min(rank, len(values)) - 1]
+
+
+def summary(values, unit, higher_is_better):
+    result = {'unit': unit, 'higher_is_better': higher_is_better, 'n': len(values),
+              'mean': sum(values) / len(values)}
+    for q in PERCENTILES:
+        result['p%d' % q] = percentile(values, q)
+    return result
+
+
+class Bench:
+
+    def __init__(self, board, clock=time.perf_counter, repeat=50):
+        """
+        board: connected Arduino
+        clock: seconds, e.g. an Emulator's seconds()
+        repeat: repetitions of every benchmark
+        """
+        self.board = board
+        self.clock = clock
+        self.repeat = repeat
+
+    def _rates(self, run, count):
+        """
+        Calls run() `repeat` times, returns count/duration of each call.
+        """
+        rates = []
+        for i in range(self.repeat):
+            t1 = self.clock()
+            run()
+            t2 = self.clock()
+            rates.append(count / (t2 - t1))
+        return rates
+
+    """
+    ##############################################################
+    ##     benchmarks
+    ##############################################################
+    """
+
+    def latency(self):
+        board = self.board
+        times = []
+        for i in range(self.repeat * 10):
+            t1 = self.clock()
+            board.readRegister(uK.PINB)
+            t2 = self.clock()
+            times.append((t2 - t1) * 1e6)
+        return summary(times, 'us', False)
+
+    def write(self, count=100):
+        board = self.board
+        board.pinMode(13, 'OUTPUT')
+
+        def run():
+            for i in range(count // 2):
+                board.digitalWrite(13, 'HIGH')
+                board.digitalWrite(13, 'LOW')
+            board.readRegister(uK.PINB)     # all writes executed
+        return summary(self._rates(run, count), 'commands/s', True)
+
+    def pipelined_read(self, count=64):
+        board = self.board
+        requests = [uK.PINB, uK.PINC, uK.PIND, uK.PORTB] * (count // 4)
+        return summary(self._rates(lambda: board.readMany(requests), len(requests)),
+                       'reads/s', True)
+
+    def adc_stream(self, count=1000):
+        board = self.board
+        return summary(self._rates(lambda: board.analogStream(0, count), count),
+                       'samples/s', True)
+
+    def adc_stream_loop(self, count=2000):
+        board = self.board
+        return summary(self._rates(lambda: board.analogStream(0, count, loop=True), count),
+                       'samples/s', True)
+
+    def cmd_loop(self, count=2000):
+        board = self.board
+        body = bytes([READ_REGISTER, uK.PINB])
+
+        def run():
+            for rd in board._stream(b'', body, 1, count, None, loop=True):
+                pass
+        return summary(self._rates(run, count), 'iterations/s', True)
+
+    BENCHMARKS = ('latency', 'write', 'pipelined_read', 'adc_stream',
+                  'adc_stream_loop', 'cmd_loop')
+
+    def run(self, names=BENCHMARKS):
+        results = {}
+        for name in names:
+            log.info('benchmark %s', name)
+            results[name] = getattr(self, name)()
+        return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    returns: list of messages, one per p50 that got worse than
+        the baseline by more than `tolerance`
+    """
+    regressions = []
+    for name, old in baseline.items():
+        new = results.get(name)
+        if new is None:
+            continue
+        if old['higher_is_better']:
+            worse = new['p50'] < old['p50'] * (1 - tolerance)
+        else:
+            worse = new['p50'] > old['p50'] * (1 + tolerance)
+        if worse:
+            regressions.append('%s: p50 %.1f %s, baseline %.1f %s'
+                               % (name, new['p50'], new['unit'], old['p50'], old['unit']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Arduino serial API benchmarks')
+    parser.add_argument('--port', help='serial port, searched for if not given')
+    parser.add_argument('--emulator', action='store_true',
+                        help='run against the firmware emulator')
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='emulated USB latency in seconds')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--only', nargs='+', choices=Bench.BENCHMARKS)
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--compare', help='baseline file, exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    if args.emulator:
+        from Arduino.emulator import Emulator
+        sr = Emulator(baudrate=args.baud, latency=args.latency)
+        board = Arduino(sr=sr)
+        clock = sr.seconds
+    else:
+        board = Arduino(baud=args.baud, port=args.port)
+        clock = time.perf_counter
+    results = Bench(board, clock, args.repeat).run(args.only or Bench.BENCHMARKS)
+    board.close()
+
+    print(json.dumps(results, indent=2))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print('REGRESSION ' + message, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Board profiles.
+
+A profile describes which port and bit every Arduino pin number is wired
+to. When a profile is created the commands of every pin are encoded once,
+so digitalWrite, digitalRead and pinMode only pick ready-made byte pairs:
+
+    board = Arduino(board='nano168')
+    board.profile.pins[13].high         # b'\x35\x25' = SET_REGISTER_BIT+5, PORTB
+
+The same OnLineCom firmware runs on the ATmega328P and the ATmega168,
+both have the register addresses of m328p.py. The Nano's TQFP package
+wires two more ADC channels to pins A6 and A7, the analog methods reject
+channels the board has no pin for.
+"""
+import numbers
+from collections import namedtuple
+from Arduino.arduino import (SET_REGISTER_BIT, CLR_REGISTER_BIT,
+                             READ_REGISTER_BIT, WAIT_UNTIL_BIT_IS_SET,
+                             WAIT_UNTIL_BIT_IS_CLEARED, pin_name, pin_port)
+
+"""
+Digital pins 0..19 of the Uno and Nano: PORTD 0-7, PORTB 0-5, PORTC 0-5
+(A0..A5), the pin_name/pin_port tables of arduino.py
+"""
+ARDUINO_PINS = list(zip(pin_port, pin_name))
+
+
+class PinCodes(namedtuple('PinCodes', ('port', 'bit', 'high', 'low', 'read',
+                                       'wait_set', 'wait_cleared', 'modes'))):
+    """
+    port, bit: PORTx address and bit number of the pin
+    high, low: digitalWrite commands
+    read: digitalRead command (PINx)
+    wait_set, wait_cleared: waitUntilBitIsSet/Cleared commands
+    modes: pinMode commands by mode name
+    """
+    __slots__ = ()
+
+    @property
+    def ddr(self):
+        return self.port - 1            # ddrX = portx - 1
+
+    @property
+    def pin(self):
+        return self.port - 2            # pinX = portx - 2
+
+
+def encode_pin(port, bit):
+    ddr = port - 1
+    pin = port - 2
+    input_ = bytes([CLR_REGISTER_BIT + bit, ddr])
+    return PinCodes(port, bit,
+                    high=bytes([SET_REGISTER_BIT + bit, port]),
+                    low=bytes([CLR_REGISTER_BIT + bit, port]),
+                    read=bytes([READ_REGISTER_BIT + bit, pin]),
+                    wait_set=bytes([WAIT_UNTIL_BIT_IS_SET + bit, pin]),
+                    wait_cleared=bytes([WAIT_UNTIL_BIT_IS_CLEARED + bit, pin]),
+                    modes={"OUTPUT": bytes([SET_REGISTER_BIT + bit, ddr]),
+                           "INPUT": input_,
+                           "INPUT_PULLUP": input_ + bytes([SET_REGISTER_BIT + bit, port])})
+
+
+class BoardProfile:
+
+    def __init__(self, name, mcu, pins=ARDUINO_PINS, analog_inputs=6, f_cpu=16):
+        """
+        name: profile name
+        mcu: avrdude part name the firmware is flashed with, e.g.
+            'atmega328p' (see Linux-UPLOAD-FW-scripts)
+        pins: (PORTx address, bit) of every digital pin, by pin number
+        analog_inputs: number of ADC channels wired to pins (A0..)
+        f_cpu: clock in MHz
+        """
+        self.name = name
+        self.mcu = mcu
+        self.analog_inputs = analog_inputs
+        self.f_cpu = f_cpu
+        self.pins = tuple(encode_pin(port, bit) for port, bit in pins)
+
+    def __repr__(self):
+        return 'BoardProfile(%r, %r)' % (self.name, self.mcu)
+
+    def adc_channel(self, channel):
+        """
+        inputs:
+            channel: 0.. or 'A0'..
+        returns:
+            the ADC channel number, ValueError if no pin is wired to it
+        """
+        if isinstance(channel, str) and channel[:1] == 'A' and channel[1:].isdigit():
+            channel = int(channel[1:])
+        if not isinstance(channel, numbers.Integral) or \
+                not 0 <= channel < self.analog_inputs:
+            raise ValueError('The %s has analog inputs A0..A%d, not %r.'
+                             % (self.name, self.analog_inputs - 1, channel))
+        return int(channel)
+
+
+UNO = BoardProfile('uno', 'atmega328p')
+NANO328 = BoardProfile('nano328', 'atmega328p', analog_inputs=8)   # + A6, A7
+NANO168 = BoardProfile('nano168', 'atmega168', analog_inputs=8)
+
+PROFILES = {profile.name: profile for profile in (UNO, NANO328, NANO168)}
+
+
+def get_profile(board):
+    """
+    Accepts a profile or its name.
+    """
+    if isinstance(board, BoardProfile):
+        return board
+    try:
+        return PROFILES[board.lower()]
+    except KeyError:
+        raise ValueError('Unknown board %r, known boards: %s'
+                         % (board, ', '.join(sorted(PROFILES))))
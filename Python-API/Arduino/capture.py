@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""
+Edge compressed logic captures.
+
+A digital capture changes rarely, so EdgeCapture keeps only the samples
+where a port changed: the sample index and the new values of all ports.
+
+    capture = board.captureEdges(['B', 'D'], 1000000)  # or EdgeCapture(registers)
+    capture.append(raw)                 # numpy.uint8 snapshots, (samples, ports)
+    capture.pinAt(8, [0, 500, 1000])    # pin values at sample indices
+    capture.edges(8, 0, 5000, 'rising') # sample indices of the edges
+    capture.dutyCycle(8), capture.frequency(8)
+    capture.save('run1')                # directory of .npy files
+    capture = EdgeCapture.load('run1')  # memory mapped, nothing read yet
+
+Pins are pin numbers of the board profile or (PINx address, bit) pairs.
+Without sample_period frequencies are per sample, with it in Hz.
+"""
+import json
+import os
+from Arduino.boards import get_profile
+
+GROW_SIZE = 4096            # transitions the arrays grow by at least
+META = 'capture.json'
+INDEX = 'index.npy'
+VALUES = 'values.npy'
+
+
+class EdgeCapture:
+
+    def __init__(self, registers, sample_period=None, board='uno'):
+        """
+        registers: PINx address of every column of the snapshots
+        sample_period: seconds between snapshots, if known
+        board: profile (or its name) that maps pin numbers to ports
+        """
+        import numpy as np
+        self.registers = list(registers)
+        self.sample_period = sample_period
+        self.profile = get_profile(board)
+        self.length = 0                                 # samples appended
+        self._index = np.empty(0, dtype=np.int64)
+        self._values = np.empty((0, len(self.registers)), dtype=np.uint8)
+        self._n = 0                                     # transitions used
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return 'EdgeCapture(%d samples, %d transitions)' % (self.length, self._n)
+
+    @property
+    def index(self):
+        """
+        Sample index of every transition, the first is always 0.
+        """
+        return self._index[:self._n]
+
+    @property
+    def values(self):
+        """
+        Port values from the sample of each transition on.
+        """
+        return self._values[:self._n]
+
+    """
+    ##############################################################
+    ##     appending
+    ##############################################################
+    """
+
+    def _grow(self, size):
+        import numpy as np
+        capacity = max(self._n + size, 2 * len(self._index), GROW_SIZE)
+        index = np.empty(capacity, dtype=np.int64)
+        values = np.empty((capacity, len(self.registers)), dtype=np.uint8)
+        index[:self._n] = self._index[:self._n]         # also copies loaded memory maps
+        values[:self._n] = self._values[:self._n]
+        self._index = index
+        self._values = values
+
+    def append(self, raw):
+        """
+        Appends snapshots.
+        inputs:
+            raw: numpy.uint8 array of shape (samples, len(registers)),
+                or one snapshot of shape (len(registers),)
+        """
+        import numpy as np
+        raw = np.asarray(raw, dtype=np.uint8).reshape(-1, len(self.registers))
+        if not len(raw):
+            return
+        changed = np.empty(len(raw), dtype=bool)
+        if self._n:
+            changed[0] = (raw[0] != self._values[self._n - 1]).any()
+        else:
+            changed[0] = True
+        changed[1:] = (raw[1:] != raw[:-1]).any(axis=1)
+        rows = np.flatnonzero(changed)
+        if self._n + len(rows) > len(self._index):
+            self._grow(len(rows))
+        self._index[self._n:self._n + len(rows)] = rows + self.length
+        self._values[self._n:self._n + len(rows)] = raw[rows]
+        self._n += len(rows)
+        self.length += len(raw)
+
+    """
+    ##############################################################
+    ##     queries
+    ##############################################################
+    """
+
+    def _pin(self, pin):
+        """
+        returns: (column, bit) of a pin number or (PINx address, bit)
+        """
+        if isinstance(pin, tuple):
+            register, bit = pin
+        else:
+            codes = self.profile.pins[pin]
+            register, bit = codes.pin, codes.bit
+        if register not in self.registers:
+            raise ValueError('Port of pin %r was not captured.' % (pin,))
+        return self.registers.index(register), bit
+
+    def _window(self, start, stop):
+        stop = self.length if stop is None else min(stop, self.length)
+        return max(0, start), stop
+
+    def valueAt(self, samples):
+        """
+        returns: port values at the sample indices, shape (len(samples), ports)
+        """
+        import numpy as np
+        rows = np.searchsorted(self.index, samples, side='right') - 1
+        return self.values[np.maximum(rows, 0)]
+
+    def pinAt(self, pin, samples):
+        column, bit = self._pin(pin)
+        return (self.valueAt(samples)[..., column] >> bit & 1).astype(bool)
+
+    def _levels(self, pin, start, stop):
+        """
+        Runs of one pin within [start, stop): (first sample of every run, level)
+        """
+        import numpy as np
+        column, bit = self._pin(pin)
+        start, stop = self._window(start, stop)
+        first = max(0, np.searchsorted(self.index, start, side='right') - 1)
+        last = np.searchsorted(self.index, stop, side='left')
+        index = self.index[first:last].copy()
+        levels = self.values[first:last, column] >> bit & 1
+        if len(index):
+            index[0] = start
+        keep = np.ones(len(levels), dtype=bool)
+        keep[1:] = levels[1:] != levels[:-1]    # drop transitions of other pins
+        return index[keep], levels[keep], stop
+
+    def edges(self, pin, start=0, stop=None, edge='both'):
+        """
+        inputs:
+            edge: 'rising', 'falling' or 'both'
+        returns: sample indices of the pin's edges in [start, stop), an
+            edge at start counts (compared with the sample before it)
+        """
+        index, levels, stop = self._levels(pin, max(0, start - 1), stop)
+        index, levels = index[1:], levels[1:]
+        if edge == 'rising':
+            return index[levels == 1]
+        if edge == 'falling':
+            return index[levels == 0]
+        return index
+
+    def dutyCycle(self, pin, start=0, stop=None):
+        """
+        returns: fraction of the samples in [start, stop) the pin was high
+        """
+        import numpy as np
+        index, levels, stop = self._levels(pin, start, stop)
+        if not len(index) or stop <= index[0]:
+            return float('nan')
+        runs = np.diff(np.append(index, stop))
+        return float(runs[levels == 1].sum()) / (stop - index[0])
+
+    def frequency(self, pin, start=0, stop=None):
+        """
+        returns: rising edges per sample between the first and the last
+            rising edge (Hz with sample_period), nan with less than two
+        """
+        rising = self.edges(pin, start, stop, 'rising')
+        if len(rising) < 2:
+            return float('nan')
+        per_sample = (len(rising) - 1) / float(rising[-1] - rising[0])
+        if self.sample_period:
+            return per_sample / self.sample_period
+        return per_sample
+
+    def expand(self, start=0, stop=None):
+        """
+        returns: the snapshots of [start, stop) as numpy.uint8 array
+        """
+        import numpy as np
+        start, stop = self._window(start, stop)
+        return self.valueAt(np.arange(start, stop))
+
+    """
+    ##############################################################
+    ##     files
+    ##############################################################
+    """
+
+    def save(self, path):
+        """
+        Writes a directory with the transitions as .npy files.
+        """
+        import numpy as np
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, INDEX), self.index)
+        np.save(os.path.join(path, VALUES), self.values)
+        with open(os.path.join(path, META), 'w') as f:
+            json.dump({'registers': self.registers, 'length': self.length,
+                       'sample_period': self.sample_period,
+                       'board': self.profile.name}, f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Opens a saved capture with memory mapped, read only arrays; an
+        append copies them into memory first.
+        """
+        import numpy as np
+        with open(os.path.join(path, META)) as f:
+            meta = json.load(f)
+        capture = cls(meta['registers'], meta['sample_period'], meta['board'])
+        capture._index = np.load(os.path.join(path, INDEX), mmap_mode='r')
+        capture._values = np.load(os.path.join(path, VALUES), mmap_mode='r')
+        capture._n = len(capture._index)
+        capture.length = meta['length']
+        return capture
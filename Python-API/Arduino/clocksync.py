@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""
+Host/device clock correlation.
+
+Timer1 runs as a stopwatch at a known prescaler. Every sample() reads its
+count once and pairs it with the middle of the round trip on the host's
+time.monotonic_ns(). A linear fit over the last `window` pairs gives the
+offset and the drift of the board's crystal:
+
+    clock = board.syncClock()           # Timer1 counts at 64us per tick
+    clock.start(1.0)                    # sample every second, or call
+    ...                                 # clock.sample() yourself
+    t_host = board.device_time_to_host(t_device)
+    board.calibrateFclk()               # F_CPU of the fit, for setPeriod
+
+On an AsyncArduino syncClock() and readStopWatchTicks() are awaited,
+sample with `await clock.sampleAsync()`; start() then runs a task.
+
+Device time is Timer1 ticks * prescaler / nominal F_CPU, in seconds since
+syncClock(). Timer1 is shared with setPeriod and sampleEvery: start those
+after calibrating. sampleEvery reads the stopwatch a last time in the
+write that takes Timer1 over, so its timestamps are device times that
+device_time_to_host() converts; call syncClock() again after it.
+
+The sampling thread holds board.lock for a sample, so its round trip never
+interleaves with requests of other threads; a long stream or batch delays
+the next sample until it ends.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+PRESCALER = 1024            # 64us per tick at 16MHz, TCNT1 overflows after 4.2s
+WINDOW = 32                 # pairs in the sliding fit
+MIN_SAMPLES = 2
+
+
+class ClockSync:
+
+    def __init__(self, board, prescaler=PRESCALER, window=WINDOW):
+        """
+        board: Arduino, its Timer1 is taken over
+        prescaler: Timer1 prescaler, 1, 8, 64, 256 or 1024
+        window: number of (host, ticks) pairs the fit is made of
+        """
+        self.board = board
+        self.prescaler = prescaler
+        self.f_nominal = board.profile.f_cpu
+        self.samples = deque(maxlen=window)     # (host ns, ticks, round trip ns)
+        self.offset_ns = None                   # host ns at tick 0
+        self.ns_per_tick = prescaler * 1e3 / self.f_nominal
+        self._thread = None
+        self._task = None
+        self._stop = threading.Event()
+
+    def reset(self):
+        """
+        Restarts Timer1 from 0 and forgets all pairs.
+        """
+        self._restart()
+        self.sample()
+
+    async def resetAsync(self):
+        """
+        reset() of an AsyncArduino.
+        """
+        self._restart()
+        await self.sampleAsync()
+
+    def _restart(self):
+        self.samples.clear()
+        self.offset_ns = None
+        timer = self.board.TimerOne
+        timer.setAsStopWatch(self.prescaler)
+        timer.startStopWatch()
+
+    def sample(self):
+        """
+        One round trip. Has to be called at least once per TCNT1 overflow
+        (65536 ticks) for the overflows to be counted.
+        returns: the (host ns, ticks, round trip ns) pair, None on timeout
+        """
+        with self.board.lock:       # not timing the wait for other threads
+            t0 = time.monotonic_ns()
+            ticks = self.board.TimerOne.readStopWatchTicks()
+            t1 = time.monotonic_ns()
+        return self._add(t0, ticks, t1)
+
+    async def sampleAsync(self):
+        """
+        sample() of an AsyncArduino.
+        """
+        t0 = time.monotonic_ns()
+        ticks = await self.board.TimerOne.readStopWatchTicks()
+        t1 = time.monotonic_ns()
+        return self._add(t0, ticks, t1)
+
+    def _add(self, t0, ticks, t1):
+        if ticks is None:
+            return None
+        pair = ((t0 + t1) // 2, ticks, t1 - t0)
+        self.samples.append(pair)
+        self._fit()
+        return pair
+
+    def _fit(self):
+        """
+        Least squares host_ns = offset_ns + ns_per_tick * ticks over the
+        pairs with the shorter round trips (their midpoint is off by at
+        most half of it), relative to the first pair to keep sums small.
+        """
+        n = len(self.samples)
+        if n < MIN_SAMPLES:
+            if n:
+                host, ticks, rtt = self.samples[0]
+                self.offset_ns = host - ticks * self.ns_per_tick
+            return
+        rtt_limit = sorted(rtt for host, ticks, rtt in self.samples)[(n - 1) // 2]
+        pairs = [(host, ticks) for host, ticks, rtt in self.samples if rtt <= rtt_limit]
+        host0, ticks0 = pairs[0]
+        xs = [ticks - ticks0 for host, ticks in pairs]
+        ys = [host - host0 for host, ticks in pairs]
+        mean_x = sum(xs) / len(pairs)
+        mean_y = sum(ys) / len(pairs)
+        sxx = sum((x - mean_x) ** 2 for x in xs)
+        if sxx == 0:
+            return
+        sxy = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+        self.ns_per_tick = sxy / sxx
+        self.offset_ns = host0 + mean_y - self.ns_per_tick * (mean_x + ticks0)
+
+    """
+    ##############################################################
+    ##     results
+    ##############################################################
+    """
+
+    def device_time(self, ticks):
+        """
+        returns: device seconds of a Timer1 count since reset()
+        """
+        return ticks * self.prescaler / (self.f_nominal * 1e6)
+
+    def device_time_to_host(self, t_device):
+        """
+        inputs:
+            t_device: device seconds since reset(), a number or numpy array
+        returns:
+            host time.monotonic() seconds
+        """
+        if self.offset_ns is None:
+            raise ValueError('Clock not sampled yet.')
+        ticks = t_device * (self.f_nominal * 1e6 / self.prescaler)
+        return (self.offset_ns + ticks * self.ns_per_tick) / 1e9
+
+    def drift(self):
+        """
+        returns: how much faster the board's clock runs than the host's,
+            as a fraction (1e-6 = 1 ppm)
+        """
+        return self.prescaler * 1e3 / self.f_nominal / self.ns_per_tick - 1
+
+    def f_cpu(self):
+        """
+        returns: the board's clock in MHz, measured against the host
+        """
+        return self.prescaler * 1e3 / self.ns_per_tick
+
+    """
+    ##############################################################
+    ##     background sampling
+    ##############################################################
+    """
+
+    def start(self, interval=1.0):
+        """
+        Samples every `interval` seconds in a thread, or in a task of the
+        running event loop for an AsyncArduino.
+        """
+        if interval * self.f_nominal * 1e6 / self.prescaler >= self.board.TimerOne.TIMER_RESOLUTION:
+            raise ValueError('Sample interval longer than one Timer1 overflow.')
+        self.stop()
+        if asyncio.iscoroutinefunction(self.board.TimerOne.readStopWatchTicks):
+            self._task = asyncio.ensure_future(self._runAsync(interval))
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,),
+                                        name='Arduino clock sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            if self.sample() is None:
+                log.error('Clock sync: no response.')
+
+    async def _runAsync(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            if await self.sampleAsync() is None:
+                log.error('Clock sync: no response.')
@@ -0,0 +1,790 @@
+#!/usr/bin/env python
+"""
+Pure-Python emulator of the OnLineCom_v06 firmware.
+
+The Emulator behaves like a pyserial port, so it can be handed to
+Arduino(sr=Emulator()). It models:
+    - the ATmega328p data space (registers, I/O and extended I/O) with the
+      addresses from m328p,
+    - the 256 byte SRAM command ring buffer (r21 write / r22 read pointers)
+      including overruns when the host writes faster than the firmware
+      executes,
+    - every firmware command from PROCES_RESET to SET_DATA,
+    - the Timer0 watchdog that resets the firmware when only one byte of a
+      command arrives (this is how get_version and softwareReset work),
+    - GPIO ports B, C and D, Timer1 (all WGM modes, TOV1/OCF1A/OCF1B/ICF1
+      and input capture on ICP1), the ADC and the UART wire at the
+      configured baud rate.
+
+Time is virtual and counted in CPU cycles. It advances only while bytes
+travel over the emulated wire or while the host waits in read(), so the
+results do not depend on the speed of the host computer. The port and
+test bench methods hold a lock, so a ReaderThread may read while another
+thread writes.
+
+PtyBridge exposes an Emulator on a Linux pseudo terminal, so the real
+pyserial path can be exercised:
+
+    bridge = PtyBridge(Emulator())
+    board = Arduino(port=bridge.port)
+"""
+import logging
+import math
+import os
+import select
+import threading
+import time
+from bisect import bisect_right
+from Arduino import m328p as uK
+from Arduino.arduino import (locked, pin_name, pin_port,
+                             READ_REGISTER, SET_REGISTER,
+                             SET_REGISTER_BIT, CLR_REGISTER_BIT,
+                             READ_REGISTER_BIT, WAIT_UNTIL_BIT_IS_SET,
+                             WAIT_UNTIL_BIT_IS_CLEARED,
+                             READ_16_BIT_REGISTER_INCR_ADDR,
+                             READ_16_BIT_REGISTER_DECR_ADDR,
+                             REPEAT_CMD_BUFFER, SET_DATA)
+
+log = logging.getLogger(__name__)
+
+FIRMWARE_VERSION = 6
+RING_SIZE = 256
+R16 = 0x10                          # SET_DATA register, mapped into data space
+CMD_CYCLES = 128                    # ~8us per executed command (see README)
+T0_TIMEOUT_CYCLES = 1024 * 256      # Timer0, prescale 1024, one overflow
+ADC_PRESCALERS = (2, 2, 4, 8, 16, 32, 64, 128)
+T1_PRESCALERS = (0, 1, 8, 64, 256, 1024, 0, 0)   # external clock not emulated
+T1_DUAL_SLOPE = (1, 2, 3, 8, 9, 10, 11)
+T1_ICR1_TOP = (8, 10, 12, 14)
+T1_FAST_PWM = (5, 6, 7, 14, 15)
+W1C_REGISTERS = (uK.TIFR0, uK.TIFR1, uK.TIFR2, uK.PCIFR, uK.EIFR)
+PORTS = {uK.PINB: (uK.DDRB, uK.PORTB),
+         uK.PINC: (uK.DDRC, uK.PORTC),
+         uK.PIND: (uK.DDRD, uK.PORTD)}
+ICP1 = (uK.PINB, uK.PINB0)
+
+
+def _bit_mask(bit_num, fill, carry):
+    """
+    Mirrors the Set_bit_mask routine: r18 is rotated through carry until
+    the bit counter equals the requested bit number, so bit numbers above
+    7 continue through the carry (9 -> bit 0, 10 -> bit 1, ...).
+    """
+    r18 = fill
+    counter = 0xFF
+    while True:
+        counter = (counter + 1) & 0xFF
+        carry, r18 = r18 >> 7, ((r18 << 1) | carry) & 0xFF
+        if counter == bit_num:
+            return r18
+
+SET_MASKS = tuple(_bit_mask(b, 0x00, 1) for b in range(16))
+CLR_MASKS = tuple(_bit_mask(b, 0xFF, 0) for b in range(16))
+
+
+class Square:
+    """
+    Periodic square wave that can drive an emulated input pin.
+    inputs:
+        frequency: in Hz
+        duty: part of the period the signal is HIGH (0..1)
+        phase: part of the period already elapsed at t=0 (0..1)
+    """
+    def __init__(self, frequency, duty=0.5, phase=0.0):
+        self.frequency = float(frequency)
+        self.duty = duty
+        self.phase = phase
+
+    def level(self, t):
+        return 1 if (t * self.frequency + self.phase) % 1.0 < self.duty else 0
+
+    def nextEdge(self, t):
+        cycles = t * self.frequency + self.phase
+        frac = cycles % 1.0
+        if frac < self.duty:
+            step = self.duty - frac
+        else:
+            step = 1.0 - frac
+        return t + step / self.frequency
+
+
+class _Timer1:
+    """
+    16 bit Timer/Counter1. The counter is evaluated lazily: advance()
+    applies all timer clock ticks between two CPU cycle stamps at once.
+    """
+    def __init__(self, emu):
+        self.emu = emu
+        self.last = 0
+        self.down = False
+
+    def prescaler(self):
+        return T1_PRESCALERS[self.emu.mem[uK.TCCR1B] & 0x07]
+
+    def mode(self):
+        mem = self.emu.mem
+        return ((mem[uK.TCCR1B] >> 3) & 0x03) << 2 | (mem[uK.TCCR1A] & 0x03)
+
+    def top(self, mode):
+        if mode in (4, 9, 11, 15):
+            return self.emu.word(uK.OCR1AL)
+        if mode in T1_ICR1_TOP:
+            return self.emu.word(uK.ICR1L)
+        if mode in (1, 5):
+            return 0xFF
+        if mode in (2, 6):
+            return 0x1FF
+        if mode in (3, 7):
+            return 0x3FF
+        return 0xFFFF
+
+    def _events(self, mode, top):
+        """
+        Returns ([(target, flag_mask), ...], period, position) in the
+        phase space of the current mode.
+        """
+        ocra = self.emu.word(uK.OCR1AL)
+        ocrb = self.emu.word(uK.OCR1BL)
+        count = self.emu.word(uK.TCNT1L)
+        events = []
+        if mode in T1_DUAL_SLOPE:
+            period = 2 * top
+            count = min(count, top)
+            pos = (period - count) % period if self.down else count
+            events.append((0, 1 << uK.TOV1))
+            if mode in T1_ICR1_TOP:
+                events.append((top, 1 << uK.ICF1))
+            for ocr, flag in ((ocra, uK.OCF1A), (ocrb, uK.OCF1B)):
+                if ocr <= top:
+                    events.append((ocr, 1 << flag))
+                    events.append(((period - ocr) % period, 1 << flag))
+        else:
+            period = top + 1
+            pos = count
+            if mode in T1_FAST_PWM:
+                events.append((top, 1 << uK.TOV1))
+            elif top == 0xFFFF:
+                events.append((0, 1 << uK.TOV1))
+            if mode in T1_ICR1_TOP:
+                events.append((top, 1 << uK.ICF1))
+            for ocr, flag in ((ocra, uK.OCF1A), (ocrb, uK.OCF1B)):
+                if ocr <= top:
+                    events.append((ocr, 1 << flag))
+        return events, period, pos
+
+    def advance(self, now):
+        presc = self.prescaler()
+        if presc and now > self.last:
+            ticks = now // presc - self.last // presc
+            if ticks:
+                self._tick(ticks)
+        self.last = max(self.last, now)
+
+    def _tick(self, ticks):
+        mem = self.emu.mem
+        mode = self.mode()
+        top = self.top(mode)
+        count = self.emu.word(uK.TCNT1L)
+        if top == 0:
+            self.emu.setWord(uK.TCNT1L, 0)
+            mem[uK.TIFR1] |= 1 << uK.TOV1
+            return
+        if mode not in T1_DUAL_SLOPE and count > top:
+            # TOP was moved below the counter: count up to MAX and wrap
+            to_wrap = 0x10000 - count
+            if ticks < to_wrap:
+                self.emu.setWord(uK.TCNT1L, count + ticks)
+                return
+            ticks -= to_wrap
+            mem[uK.TIFR1] |= 1 << uK.TOV1
+            self.emu.setWord(uK.TCNT1L, 0)
+            if not ticks:
+                return
+        events, period, pos = self._events(mode, top)
+        for target, flag in events:
+            if (target - pos - 1) % period < ticks:
+                mem[uK.TIFR1] |= flag
+        pos = (pos + ticks) % period
+        if mode in T1_DUAL_SLOPE:
+            self.down = pos > top
+            count = period - pos if self.down else pos
+        else:
+            count = pos
+        self.emu.setWord(uK.TCNT1L, count)
+
+    def nextEvent(self, now):
+        """
+        CPU cycle of the next timer clock tick that sets a TIFR1 flag
+        which is cleared now, or None when the timer is stopped.
+        """
+        presc = self.prescaler()
+        if not presc:
+            return None
+        mode = self.mode()
+        top = self.top(mode)
+        if top == 0:
+            return (now // presc + 1) * presc
+        flags = self.emu.mem[uK.TIFR1]
+        count = self.emu.word(uK.TCNT1L)
+        if mode not in T1_DUAL_SLOPE and count > top:
+            return (now // presc + 0x10000 - count) * presc
+        events, period, pos = self._events(mode, top)
+        ticks = [(target - pos - 1) % period + 1
+                 for target, flag in events if not flags & flag]
+        if not ticks:
+            return None
+        return (now // presc + min(ticks)) * presc
+
+    def capture(self, level):
+        mem = self.emu.mem
+        if self.mode() in T1_ICR1_TOP or not self.prescaler():
+            return
+        rising = (mem[uK.TCCR1B] >> uK.ICES1) & 1
+        if level == rising:
+            self.emu.setWord(uK.ICR1L, self.emu.word(uK.TCNT1L))
+            mem[uK.TIFR1] |= 1 << uK.ICF1
+
+
+class _Adc:
+    """
+    Successive approximation ADC: a conversion takes 13 ADC clocks
+    (25 for the first one after ADEN is set).
+    """
+    def __init__(self, emu):
+        self.emu = emu
+        self.done_at = None
+        self.first = True
+
+    def write(self, value, now):
+        mem = self.emu.mem
+        adif = 1 << uK.ADIF
+        if value & adif:
+            mem[uK.ADCSRA] &= ~adif & 0xFF
+        value = (value & ~adif) | (mem[uK.ADCSRA] & adif)
+        if not value & (1 << uK.ADEN):
+            self.first = True
+            self.done_at = None
+            value &= ~(1 << uK.ADSC) & 0xFF
+        elif value & (1 << uK.ADSC) and self.done_at is None:
+            clocks = 25 if self.first else 13
+            self.first = False
+            self.done_at = now + clocks * ADC_PRESCALERS[value & 0x07]
+        mem[uK.ADCSRA] = value
+
+    def advance(self, now):
+        if self.done_at is None or now < self.done_at:
+            return
+        mem = self.emu.mem
+        channel = mem[uK.ADMUX] & 0x0F
+        value = self.emu.analogValue(channel, self.done_at) & 0x3FF
+        if mem[uK.ADMUX] & (1 << uK.ADLAR):
+            value <<= 6
+        mem[uK.ADCL] = value & 0xFF
+        mem[uK.ADCH] = value >> 8
+        mem[uK.ADCSRA] = (mem[uK.ADCSRA] & ~(1 << uK.ADSC)) | (1 << uK.ADIF)
+        self.done_at = None
+
+
+class Emulator:
+    """
+    Serial-port-like stand-in for an Arduino running OnLineCom_v06.
+    inputs:
+        baudrate: UART speed used to model the wire (115200)
+        timeout: read timeout in (virtual) seconds, like pyserial
+        f_cpu: CPU clock in Hz
+        latency: extra delay in seconds before a sent byte is visible to
+            the host (USB latency)
+        banner: print the version byte after power-on, like the real board
+    """
+    def __init__(self, baudrate=115200, timeout=2, f_cpu=16000000,
+                 latency=0.0, banner=True):
+        self.port = 'emulator'
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.f_cpu = f_cpu
+        self.byte_cycles = int(round(f_cpu * 10.0 / baudrate))
+        self.latency_cycles = int(latency * f_cpu)
+        self.is_open = True
+        self.cycles = 0
+        self.overruns = 0
+        self.commands = 0
+        self.mem = bytearray(256)
+        self.ring = bytearray(RING_SIZE)
+        self.inputs = {}
+        self.analog = [0] * 16
+        self.timer1 = _Timer1(self)
+        self.adc = _Adc(self)
+        self._rx_free = 0
+        self._tx_busy = 0
+        self._out = bytearray()
+        self._out_t = []
+        self._head = 0
+        self._icp_level = 0
+        self.lock = threading.RLock()
+        self._boot(banner)
+        self.cycles = self._tx_busy         # the banner is already waiting
+
+    """
+    ##############################################################
+    ##     pyserial interface
+    ##############################################################
+    """
+
+    @locked
+    def write(self, data):
+        for byte in bytes(data):
+            arrival = max(self._rx_free, self.cycles) + self.byte_cycles
+            self._rx_free = arrival
+            self._run(arrival)
+            self._store_uart_data(byte)
+        return len(data)
+
+    @locked
+    def read(self, size=1):
+        deadline = self._deadline()
+        while self._visible() < size and self.cycles < deadline:
+            target = self._head + size
+            if len(self._out_t) >= target:
+                self._run(min(self._out_t[target - 1], deadline))
+            elif not self._run(deadline, need=target):
+                break
+        return self._take(min(size, self._visible()))
+
+    @locked
+    def readline(self, size=-1):
+        line = bytearray()
+        while size < 0 or len(line) < size:
+            c = self.read(1)
+            if not c:
+                break
+            line += c
+            if c == b'\n':
+                break
+        return bytes(line)
+
+    @property
+    @locked
+    def in_waiting(self):
+        return self._visible()
+
+    @locked
+    def inWaiting(self):
+        return self._visible()
+
+    @locked
+    def reset_input_buffer(self):
+        self._take(self._visible())
+
+    def flushInput(self):
+        self.reset_input_buffer()
+
+    def reset_output_buffer(self):
+        pass
+
+    def flushOutput(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    """
+    ##############################################################
+    ##     Test bench
+    ##############################################################
+    """
+
+    @locked
+    def advance(self, seconds):
+        """
+        Let the emulated board run for a while (virtual time).
+        """
+        self._run(self.cycles + int(seconds * self.f_cpu))
+
+    def seconds(self):
+        """
+        Virtual time since power-on in seconds.
+        """
+        return self.cycles / float(self.f_cpu)
+
+    @locked
+    def setInput(self, pin, signal):
+        """
+        Drive an input pin from outside.
+        inputs:
+            pin: Arduino pin number (0..19)
+            signal: 0, 1, None (floating), Square(...) or any callable
+                f(t_seconds) -> 0/1
+        """
+        key = (pin_port[pin] - 2, pin_name[pin])
+        self._sync(self.cycles)
+        if signal is None:
+            self.inputs.pop(key, None)
+        else:
+            self.inputs[key] = signal
+        if key == ICP1:
+            self._icp_level = self._input_level(key, self.cycles)
+
+    def setAnalog(self, channel, value):
+        """
+        Set the value (0..1023) or a callable f(t_seconds) of ADC channel.
+        """
+        self.analog[channel] = value
+
+    def analogValue(self, channel, cycle):
+        value = self.analog[channel]
+        if callable(value):
+            value = value(cycle / float(self.f_cpu))
+        return int(value)
+
+    def word(self, addr):
+        return self.mem[addr] | self.mem[addr + 1] << 8
+
+    def setWord(self, addr, value):
+        self.mem[addr] = value & 0xFF
+        self.mem[addr + 1] = (value >> 8) & 0xFF
+
+    @locked
+    def pending(self):
+        """
+        Number of received bytes not yet executed by the firmware.
+        """
+        return (self.r21 - self.r22) & 0xFF
+
+    """
+    ##############################################################
+    ##     Firmware
+    ##############################################################
+    """
+
+    def _boot(self, banner):
+        """
+        Power-on: all I/O registers are cleared, then the BASCOM program
+        runs from address 0.
+        """
+        self.mem[:] = bytes(256)
+        self.timer1 = _Timer1(self)
+        self.timer1.last = self.cycles
+        self.adc = _Adc(self)
+        self._jump_zero(banner)
+
+    def _jump_zero(self, banner=True):
+        """
+        The program at address 0: UART and port configuration followed by
+        Process_reset. I/O registers keep their values otherwise.
+        """
+        mem = self.mem
+        mem[uK.UCSR0A] = 1 << uK.U2X0 | 1 << uK.UDRE0
+        mem[uK.UCSR0B] = 0x98
+        mem[uK.UCSR0C] = 0x06
+        mem[uK.UBRR0H] = 0
+        mem[uK.UBRR0L] = 16
+        mem[uK.DDRB] = 0xFF                     # Config Portb = Output
+        mem[uK.DDRD] = 0x02                     # Config Portd = &B0000_0010
+        mem[uK.DDRC] = 0x00                     # Config Portc = Input
+        mem[uK.TCCR0B] = 0
+        mem[uK.TCNT0] = 0
+        self._process_reset(banner)
+
+    def _process_reset(self, banner=True):
+        self.r21 = 0xFF
+        self.r22 = 0xFF
+        if banner:
+            self._send(FIRMWARE_VERSION)
+        self.mem[R16] = 0
+        self._wait = None
+        self._half_deadline = None
+
+    def _store_uart_data(self, byte):
+        """
+        USART RX interrupt: store the byte into the SRAM ring.
+        """
+        self.r21 = (self.r21 + 1) & 0xFF
+        if self.r21 == self.r22:
+            self.overruns += 1
+            log.warning('Command buffer overrun at %d.', self.r21)
+        self.ring[self.r21] = byte
+        if self.r21 & 1:
+            self._half_deadline = None
+        else:
+            self._half_deadline = self.cycles + T0_TIMEOUT_CYCLES
+
+    def _ready(self):
+        return self.r21 & 1 and self.r21 != self.r22
+
+    def _run(self, until, need=None):
+        """
+        Execute firmware until CPU cycle `until` or until `need` bytes have
+        been sent in total. Returns False when the firmware went idle with
+        nothing left to do.
+        """
+        while True:
+            if need is not None and len(self._out_t) >= need:
+                return True
+            if self._half_deadline is not None and \
+                    self._half_deadline <= min(self.cycles, until):
+                self.cycles = max(self.cycles, self._half_deadline)
+                self._sync(self.cycles)
+                log.debug('Incomplete command, firmware reset.')
+                self._jump_zero()
+                continue
+            if self.cycles >= until:
+                return True
+            self._sync(self.cycles)
+            if self._wait is not None:
+                addr, mask, want = self._wait
+                if ((self._load(addr) & mask) == mask) == want:
+                    self.mem[R16] = mask if want else 0
+                    self._wait = None
+                    self.cycles += 4
+                    continue
+                t = self._next_event(addr)
+                if t is None and self._half_deadline is None \
+                        and math.isinf(until):
+                    return False
+                self.cycles = max(self.cycles + 1, min(
+                    until, t if t is not None else until,
+                    self._half_deadline if self._half_deadline
+                    is not None else until))
+                continue
+            if self._ready():
+                self._read_next_cmd()
+                continue
+            if self._half_deadline is not None:
+                self.cycles = min(until, self._half_deadline)
+                continue
+            if math.isinf(until):
+                return False
+            self.cycles = until
+            self._sync(self.cycles)
+            return need is None
+
+    def _next_event(self, addr):
+        events = []
+        if addr in (uK.TCNT1L, uK.TCNT1H):
+            presc = self.timer1.prescaler()
+            if presc:
+                events.append((self.cycles // presc + 1) * presc)
+        t = self.timer1.nextEvent(self.cycles)
+        if t is not None:
+            events.append(t)
+        if self.adc.done_at is not None:
+            events.append(self.adc.done_at)
+        if addr in PORTS or addr == uK.TIFR1:
+            t = self._next_edge(self.cycles)
+            if t is not None:
+                events.append(t)
+        return min(events) if events else None
+
+    def _next_edge(self, now):
+        t_now = now / float(self.f_cpu)
+        edges = []
+        for signal in self.inputs.values():
+            if hasattr(signal, 'nextEdge'):
+                edges.append(signal.nextEdge(t_now))
+            elif callable(signal):
+                edges.append(t_now + 1e-6)
+        if not edges:
+            return None
+        return max(now + 1, int(math.ceil(min(edges) * self.f_cpu)))
+
+    def _sync(self, now):
+        """
+        Bring peripherals up to CPU cycle `now`.
+        """
+        icp = self.inputs.get(ICP1)
+        if icp is not None and not isinstance(icp, int) \
+                and self.timer1.prescaler():
+            t = self.timer1.last
+            while True:
+                edge = self._next_edge_of(icp, t)
+                if edge is None or edge > now:
+                    break
+                self.timer1.advance(edge)
+                self.adc.advance(edge)
+                level = self._input_level(ICP1, edge)
+                if level != self._icp_level:
+                    self._icp_level = level
+                    self.timer1.capture(level)
+                t = edge
+        self.timer1.advance(now)
+        self.adc.advance(now)
+
+    def _next_edge_of(self, signal, now):
+        t_now = now / float(self.f_cpu)
+        if hasattr(signal, 'nextEdge'):
+            t = signal.nextEdge(t_now)
+        else:
+            t = t_now + 1e-6
+        return max(now + 1, int(math.ceil(t * self.f_cpu)))
+
+    def _input_level(self, key, cycle):
+        signal = self.inputs.get(key)
+        if signal is None:
+            return None
+        if hasattr(signal, 'level'):
+            return signal.level(cycle / float(self.f_cpu))
+        if callable(signal):
+            return 1 if signal(cycle / float(self.f_cpu)) else 0
+        return 1 if signal else 0
+
+    def _load(self, addr):
+        if addr in PORTS:
+            ddr, port = PORTS[addr]
+            value = self.mem[port] & self.mem[ddr]
+            for bit in range(8):
+                mask = 1 << bit
+                if self.mem[ddr] & mask:
+                    continue
+                level = self._input_level((addr, bit), self.cycles)
+                if level is None:
+                    level = self.mem[port] & mask       # pull-up or floating
+                if level:
+                    value |= mask
+            return value
+        return self.mem[addr]
+
+    def _store(self, addr, value):
+        value &= 0xFF
+        if addr in PORTS:
+            port = PORTS[addr][1]
+            self.mem[port] ^= value             # writing PINx toggles PORTx
+        elif addr in W1C_REGISTERS:
+            self.mem[addr] &= ~value & 0xFF
+        elif addr == uK.ADCSRA:
+            self.adc.write(value, self.cycles)
+        elif addr == uK.UDR0:
+            self._send(value)
+        elif addr == uK.UCSR0A:
+            self.mem[addr] = (value & 0xFC) | (1 << uK.UDRE0)
+        else:
+            self.mem[addr] = value
+
+    def _send(self, byte):
+        """
+        Send_out_r16: wait for UDRE0, then put the byte into UDR0. Every
+        response goes through r16, so it keeps the last byte sent.
+        """
+        self.mem[R16] = byte & 0xFF
+        if self._tx_busy - self.cycles > self.byte_cycles:
+            self.cycles = self._tx_busy - self.byte_cycles
+        self._tx_busy = max(self._tx_busy, self.cycles) + self.byte_cycles
+        self._out.append(byte & 0xFF)
+        self._out_t.append(self._tx_busy + self.latency_cycles)
+
+    def _read_next_cmd(self):
+        self.r22 = (self.r22 + 1) & 0xFF
+        cmd = self.ring[self.r22]
+        self.r22 = (self.r22 + 1) & 0xFF
+        arg = self.ring[self.r22]
+        self.cycles += CMD_CYCLES
+        self.commands += 1
+        self._sync(self.cycles)
+        self._execute(cmd & 0xF0, cmd & 0x0F, arg)
+
+    def _execute(self, op, bit_num, arg):
+        if op == READ_REGISTER:
+            self._send(self._load(arg))
+        elif op == SET_REGISTER:
+            self._store(arg, self.mem[R16])
+        elif op == SET_REGISTER_BIT:
+            self._store(arg, self._load(arg) | SET_MASKS[bit_num])
+        elif op == CLR_REGISTER_BIT:
+            self._store(arg, self._load(arg) & CLR_MASKS[bit_num])
+        elif op == READ_REGISTER_BIT:
+            mask = SET_MASKS[bit_num]
+            self._send(1 if self._load(arg) & mask == mask else 0)
+        elif op == WAIT_UNTIL_BIT_IS_SET:
+            self._wait = (arg, SET_MASKS[bit_num], True)
+        elif op == WAIT_UNTIL_BIT_IS_CLEARED:
+            self._wait = (arg, SET_MASKS[bit_num], False)
+        elif op == READ_16_BIT_REGISTER_INCR_ADDR:
+            self._send(self._load(arg))
+            self._send(self._load((arg + 1) & 0xFF))
+        elif op == READ_16_BIT_REGISTER_DECR_ADDR:
+            self._send(self._load(arg))
+            self._send(self._load((arg - 1) & 0xFF))
+        elif op == REPEAT_CMD_BUFFER:
+            self.r22 = (self.r22 - arg - 2) & 0xFF
+        elif op == SET_DATA:
+            self.mem[R16] = arg
+        else:
+            # PROCES_RESET and the reserved commands 0xC0..0xF0
+            self._process_reset()
+
+    """
+    ##############################################################
+    ##     host side of the wire
+    ##############################################################
+    """
+
+    def _deadline(self):
+        if self.timeout is None:
+            return float('inf')
+        return self.cycles + int(self.timeout * self.f_cpu)
+
+    def _visible(self):
+        return bisect_right(self._out_t, self.cycles, self._head) - self._head
+
+    def _take(self, n):
+        data = bytes(self._out[self._head:self._head + n])
+        self._head += n
+        if self._head > 4096:
+            del self._out[:self._head]
+            del self._out_t[:self._head]
+            self._head = 0
+        return data
+
+
+class PtyBridge:
+    """
+    Serves an Emulator on a Linux pseudo terminal. Virtual time follows
+    the wall clock, so waits on timers and the reset timeout behave like
+    on a real board.
+        bridge = PtyBridge(Emulator())
+        sr = serial.Serial(bridge.port, 115200, timeout=2)
+    """
+    def __init__(self, emulator=None):
+        import pty
+        import tty
+        self.emulator = emulator if emulator is not None else Emulator()
+        self.emulator.timeout = 0
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        emu = self.emulator
+        t0 = time.monotonic()
+        c0 = emu.cycles
+        while self._running:
+            try:
+                ready = select.select([self._master], [], [], 0.0005)[0]
+                if ready:
+                    emu.write(os.read(self._master, 4096))
+            except OSError:
+                break
+            now = c0 + int((time.monotonic() - t0) * emu.f_cpu)
+            with emu.lock:
+                if now > emu.cycles:
+                    emu._run(now)
+            out = emu.read(emu.in_waiting)
+            if out:
+                os.write(self._master, out)
+
+    def close(self):
+        self._running = False
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
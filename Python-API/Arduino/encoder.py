@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+Command encoder.
+
+Single commands come from lookup tables of ready-made immutable bytes,
+filled on first use, so the hot paths allocate nothing per call:
+
+    command(SET_REGISTER_BIT + 5, uK.PORTB)     # b'\x35\x25', cached
+    set_register(uK.DDRB, 0xFF)                 # SET_DATA + SET_REGISTER
+
+Longer sequences are encoded into one preallocated buffer that is reused
+for every call:
+
+    enc = CommandEncoder()
+    enc.clear().setRegister(uK.DDRB, 0xFF).setBit(5, uK.PORTB)
+    board.sendAPICmd(enc.view())        # memoryview, no copy
+    enc.encode_into(buf, offset)        # or copy into another buffer
+
+The opcode|bit bytes come from CMD_BIT, a table built once at import.
+view() is only valid until the next clear(); everything that keeps
+commands (batch, Recorder, FlowControl) copies them.
+"""
+from Arduino.arduino import (READ_REGISTER, SET_REGISTER, SET_REGISTER_BIT,
+                             CLR_REGISTER_BIT, READ_REGISTER_BIT,
+                             WAIT_UNTIL_BIT_IS_SET, WAIT_UNTIL_BIT_IS_CLEARED,
+                             READ_16_BIT_REGISTER_INCR_ADDR,
+                             READ_16_BIT_REGISTER_DECR_ADDR, REPEAT_CMD_BUFFER,
+                             SET_DATA)
+from Arduino import m328p as uK
+
+"""
+First command byte by opcode >> 4 and bit: CMD_BIT[SET_REGISTER_BIT >> 4][5]
+"""
+CMD_BIT = tuple(tuple(op << 4 | bit for bit in range(16)) for op in range(16))
+SET_BIT = CMD_BIT[SET_REGISTER_BIT >> 4]
+CLR_BIT = CMD_BIT[CLR_REGISTER_BIT >> 4]
+READ_BIT = CMD_BIT[READ_REGISTER_BIT >> 4]
+WAIT_SET = CMD_BIT[WAIT_UNTIL_BIT_IS_SET >> 4]
+WAIT_CLEARED = CMD_BIT[WAIT_UNTIL_BIT_IS_CLEARED >> 4]
+BUFFER_SIZE = 256           # one firmware ring, grown if ever needed
+
+_commands = {}              # cmd << 8 | arg: 2 bytes
+_set_registers = {}         # reg << 8 | value: 4 bytes
+_analog_reads = {}          # pin: analogRead sequence
+
+
+def command(cmd, arg):
+    """
+    One 2 byte command, cmd already holds the bit (e.g. READ_BIT[3]).
+    """
+    key = cmd << 8 | arg
+    cmd_str = _commands.get(key)
+    if cmd_str is None:
+        cmd_str = _commands[key] = bytes((cmd, arg))
+    return cmd_str
+
+
+def set_register(reg, value):
+    key = reg << 8 | value
+    cmd_str = _set_registers.get(key)
+    if cmd_str is None:
+        cmd_str = _set_registers[key] = bytes((SET_DATA, value, SET_REGISTER, reg))
+    return cmd_str
+
+
+def analog_read(pin):
+    """
+    analogRead: select the channel, start, wait, read ADCL/ADCH.
+    """
+    cmd_str = _analog_reads.get(pin)
+    if cmd_str is None:
+        cmd_str = _analog_reads[pin] = bytes(
+            CommandEncoder(16)
+            .setRegister(uK.ADMUX, 0x40 + pin)
+            .setRegister(uK.ADCSRA, 0xC7)            # enable and start, clk/128
+            .waitCleared(uK.ADSC, uK.ADCSRA)
+            .read16(uK.ADCL).view())
+    return cmd_str
+
+
+class CommandEncoder:
+
+    def __init__(self, size=BUFFER_SIZE):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self.pos = 0
+
+    def clear(self):
+        self.pos = 0
+        return self
+
+    def __len__(self):
+        return self.pos
+
+    def view(self):
+        """
+        returns: memoryview of the commands encoded since clear()
+        """
+        return self._view[:self.pos]
+
+    def encode_into(self, buf, offset=0):
+        """
+        Copies the encoded commands into buf (a bytearray grows if needed).
+        returns: offset after the copied bytes
+        """
+        end = offset + self.pos
+        buf[offset:end] = self._view[:self.pos]
+        return end
+
+    def _grow(self, size):
+        # a new buffer, views handed out earlier keep the old one
+        buf = bytearray(len(self._buf) + max(size, len(self._buf)))
+        buf[:self.pos] = self._view[:self.pos]
+        self._buf = buf
+        self._view = memoryview(buf)
+
+    def _put(self, cmd, arg):
+        pos = self.pos
+        if pos + 2 > len(self._buf):
+            self._grow(2)
+        self._buf[pos] = cmd
+        self._buf[pos + 1] = arg
+        self.pos = pos + 2
+        return self
+
+    """
+    ##############################################################
+    ##     commands
+    ##############################################################
+    """
+
+    def raw(self, cmd_str):
+        """
+        Appends already encoded commands, e.g. ADC_CONVERSION or pin codes.
+        """
+        pos = self.pos
+        end = pos + len(cmd_str)
+        if end > len(self._buf):
+            self._grow(end - len(self._buf))
+        self._buf[pos:end] = cmd_str
+        self.pos = end
+        return self
+
+    def setData(self, value):
+        return self._put(SET_DATA, value)
+
+    def setRegister(self, reg, value):
+        return self.raw(set_register(reg, value))
+
+    def setBit(self, bit, reg):
+        return self._put(SET_BIT[bit], reg)
+
+    def clearBit(self, bit, reg):
+        return self._put(CLR_BIT[bit], reg)
+
+    def readRegister(self, reg):
+        return self._put(READ_REGISTER, reg)
+
+    def readBit(self, bit, reg):
+        return self._put(READ_BIT[bit], reg)
+
+    def read16(self, reg_low):
+        return self._put(READ_16_BIT_REGISTER_INCR_ADDR, reg_low)
+
+    def read16Decr(self, reg_high):
+        return self._put(READ_16_BIT_REGISTER_DECR_ADDR, reg_high)
+
+    def waitSet(self, bit, reg):
+        return self._put(WAIT_SET[bit], reg)
+
+    def waitCleared(self, bit, reg):
+        return self._put(WAIT_CLEARED[bit], reg)
+
+    def repeat(self, size):
+        return self._put(REPEAT_CMD_BUFFER, size)
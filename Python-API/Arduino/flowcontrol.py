@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+"""
+Host-side flow control for the firmware's 256 byte command ring.
+
+The firmware stores every received byte into Uart_buffer and executes the
+commands much faster (~8us) than the UART delivers them (~87us per byte),
+so the ring only fills up behind commands that do not finish on their
+own: WAIT_UNTIL_BIT_IS_SET/CLEARED and a running REPEAT_CMD_BUFFER loop.
+FlowControl counts the bytes written behind the first such command that
+is not known to be executed. A command is known to be executed when a
+response of that command or of any later command arrives. When the next
+write would not fit, a sync marker (a cheap READ_REGISTER) is queued and
+the write blocks until a response proves that the firmware got past the
+blocking command. If it does not within wait_timeout seconds, the write
+raises BufferError.
+"""
+import logging
+import time
+from collections import deque
+from Arduino import m328p as uK
+from Arduino.arduino import (RESPONSE_SIZE, PROCES_RESET, READ_REGISTER,
+                             WAIT_UNTIL_BIT_IS_SET, WAIT_UNTIL_BIT_IS_CLEARED,
+                             REPEAT_CMD_BUFFER)
+
+log = logging.getLogger(__name__)
+
+"""
+r21 must never catch up with r22, and the marker must always fit
+"""
+RING_CAPACITY = 254
+SYNC_SIZE = 2
+WAIT_TIMEOUT = 10.0         # s a write may wait for the firmware
+
+
+class FlowControl:
+
+    def __init__(self, board, capacity=RING_CAPACITY, sync_register=uK.GPIOR0,
+                 wait_timeout=WAIT_TIMEOUT):
+        self.board = board
+        self.sr = board.sr
+        self.capacity = capacity
+        self.sync_register = sync_register
+        self.wait_timeout = wait_timeout
+        self.stalls = 0
+        self.sync_markers = 0
+        self.reset()
+        if self.sr.inWaiting():
+            self.sr.flushInput()
+
+    def reset(self):
+        """
+        The firmware was reset: the ring is empty and nothing is expected.
+        """
+        self.written = 0
+        self.executed = 0
+        self.stash = bytearray()       # responses of our commands
+        self.stray = bytearray()       # bytes nobody asked for (banner)
+        self._expect = deque()      # [end position, bytes missing, is_sync]
+        self._waits = deque()       # end positions of pending WAIT commands
+        self._loop_start = None
+
+    def fill(self):
+        """
+        Estimated number of unexecuted bytes in the firmware's ring.
+        """
+        blockers = []
+        if self._waits:
+            blockers.append(self._waits[0])
+        if self._loop_start is not None:
+            blockers.append(self._loop_start)
+        if not blockers:
+            return 0
+        return max(0, self.written - min(blockers))
+
+    def free(self):
+        return self.capacity - SYNC_SIZE - self.fill()
+
+    """
+    ##############################################################
+    ##     writing
+    ##############################################################
+    """
+
+    def write(self, cmd_str):
+        """
+        Writes cmd_str, blocking whenever the ring would overflow.
+        """
+        data = bytes(cmd_str)
+        while data:
+            n = self._splitPoint(data, self.free())
+            if n == 0:
+                self._makeRoom(self._atomicSize(data))
+                continue
+            self._send(data[:n])
+            data = data[n:]
+
+    def _send(self, chunk):
+        self.sr.write(chunk)
+        self.sr.flush()
+        self.sent(chunk)
+
+    def sent(self, chunk):
+        """
+        Tracks the commands of a chunk that was written to the port.
+        """
+        for i in range(0, len(chunk) - 1, 2):
+            cmd = chunk[i] & 0xF0
+            arg = chunk[i + 1]
+            self.written += 2
+            if cmd in RESPONSE_SIZE:
+                self._expect.append([self.written, RESPONSE_SIZE[cmd], False])
+            elif cmd in (WAIT_UNTIL_BIT_IS_SET, WAIT_UNTIL_BIT_IS_CLEARED):
+                self._waits.append(self.written)
+            elif cmd == REPEAT_CMD_BUFFER:
+                if self._loop_start is None:
+                    self._loop_start = self.written - 2 - arg
+            elif cmd == PROCES_RESET:
+                # Process_reset empties the ring and prints the version
+                self.reset()
+                self._expect.append([0, 1, True])
+        if len(chunk) % 2:
+            # a lone byte: Timer0 resets the firmware, which then prints
+            # the version for the caller (softwareReset)
+            self.reset()
+            self._expect.append([0, 1, False])
+
+    def _atomicSize(self, data):
+        """
+        Bytes at the start of data that must be written in one piece.
+        """
+        size = SYNC_SIZE
+        for i in range(0, len(data) - 1, 2):
+            if data[i] & 0xF0 == REPEAT_CMD_BUFFER and i - data[i + 1] <= 0:
+                size = max(size, i + 2)
+        return size
+
+    def _splitPoint(self, data, free):
+        """
+        Largest even prefix of data that fits into `free` bytes and does not
+        split an already encoded cmdDo/cmdLoop body (a sync marker inserted
+        into it would be repeated by the loop).
+        """
+        n = min(len(data), max(0, free))
+        if n == len(data):
+            return n
+        n &= ~1
+        for i in range(0, len(data) - 1, 2):
+            if data[i] & 0xF0 == REPEAT_CMD_BUFFER:
+                start = i - data[i + 1]
+                if start < n <= i + 1:
+                    n = max(0, start)
+        return n
+
+    def _makeRoom(self, size):
+        """
+        Blocks until `size` bytes fit into the ring.
+        """
+        if self._waits and (self._loop_start is None or
+                            self._waits[0] < self._loop_start):
+            blocker = self._waits[0]
+        else:
+            raise BufferError('Command buffer is held by a running cmdLoop, '
+                              'reset the board before sending more commands.')
+        if size > self.capacity - SYNC_SIZE:
+            raise BufferError('%d bytes can not be kept in the command buffer.' % size)
+        self.stalls += 1
+        if not any(e[0] > blocker for e in self._expect):
+            if getattr(self.board, '_loop_open', False):
+                raise BufferError('Command buffer is full inside cmdDo/cmdLoop.')
+            self._sendSyncMarker()
+        log.debug('Command buffer full (%d bytes), waiting for the firmware.', self.fill())
+        deadline = time.monotonic() + self.wait_timeout
+        while self.free() < size:
+            if not self._receive(self._bytesUntil(blocker)):
+                if time.monotonic() >= deadline:
+                    raise BufferError('Firmware still waiting after %g s, %d bytes '
+                                      'in the command buffer.' % (self.wait_timeout, self.fill()))
+                log.warning('Firmware is still waiting, %d bytes in buffer.', self.fill())
+
+    def _sendSyncMarker(self):
+        marker = bytes([READ_REGISTER, self.sync_register])
+        self.sr.write(marker)
+        self.sr.flush()
+        self.sent(marker)
+        self._expect[-1][2] = True
+        self.sync_markers += 1
+        self.board.cmd_buffer_num = (self.board.cmd_buffer_num + SYNC_SIZE) % 256
+        metrics = getattr(self.board, 'metrics', None)
+        if metrics is not None:
+            metrics.written(marker)
+
+    """
+    ##############################################################
+    ##     reading
+    ##############################################################
+    """
+
+    def read(self, size=1):
+        """
+        Returns `size` response bytes; sync marker responses are dropped.
+        """
+        if len(self.stash) < size:
+            self._receive(self._bytesFor(size - len(self.stash)))
+        rd = bytes(self.stash[:size])
+        del self.stash[:size]
+        if len(rd) < size and self.stray:
+            extra = bytes(self.stray[:size - len(rd)])
+            del self.stray[:len(extra)]
+            rd += extra
+        return rd
+
+    def flushInput(self):
+        """
+        Drops stale bytes. Responses of sent commands are kept, they
+        are matched in order.
+        """
+        waiting = self.sr.inWaiting()
+        if waiting:
+            self._receive(waiting)
+        del self.stray[:]
+
+    def _bytesFor(self, user_bytes):
+        total = 0
+        for end, missing, is_sync in self._expect:
+            if is_sync:
+                total += missing
+                continue
+            take = min(missing, user_bytes)
+            total += take
+            user_bytes -= take
+            if user_bytes == 0:
+                return total
+        return total + user_bytes
+
+    def _bytesUntil(self, position):
+        total = 0
+        for end, missing, is_sync in self._expect:
+            total += missing
+            if end > position:
+                break
+        return max(1, total)
+
+    def _receive(self, size):
+        rd = self.sr.read(size)
+        for byte in rd:
+            if not self._expect:
+                self.stray.append(byte)
+                continue
+            entry = self._expect[0]
+            if not entry[2]:
+                self.stash.append(byte)
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._expect.popleft()
+                self._executed(entry[0])
+        return len(rd)
+
+    def _executed(self, position):
+        if position > self.executed:
+            self.executed = position
+        while self._waits and self._waits[0] <= self.executed:
+            self._waits.popleft()
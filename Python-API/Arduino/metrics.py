@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+Protocol metrics.
+
+    board = Arduino(metrics=True)
+    ...
+    board.metrics.snapshot()
+    {'commands': {'SET_REGISTER': 12, 'READ_REGISTER': 3, ..},
+     'bytes_written': 42, 'bytes_read': 3, 'write_calls': 5, 'read_calls': 3,
+     'latency_us': {'buckets': [[100, 0], [200, 2], .., ['+Inf', 3]],
+                    'count': 3, 'sum': 612.0},
+     'ring_fill': {'last': 0, 'max': 16}, ..}
+
+Without metrics=True the board only pays for one `is None` test per write
+and read. Hooks are called with every event, e.g. to feed an exporter:
+
+    board.metrics.addHook(lambda event, value: print(event, value))
+
+events: 'write' (bytes written), 'read' (bytes read) and 'latency'
+(seconds from the first unanswered write to the end of the read).
+Latency buckets are cumulative like Prometheus histograms.
+
+The ring fill is FlowControl's estimate with flow_control=True, otherwise
+the bytes written since the last completed read - an upper bound, the
+firmware executes most commands long before the next byte arrives.
+"""
+import time
+from Arduino import arduino
+
+"""
+Opcode names by command (high nibble)
+"""
+OPCODE_NAMES = {getattr(arduino, name): name for name in (
+    'PROCES_RESET', 'READ_REGISTER', 'SET_REGISTER', 'SET_REGISTER_BIT',
+    'CLR_REGISTER_BIT', 'READ_REGISTER_BIT', 'WAIT_UNTIL_BIT_IS_SET',
+    'WAIT_UNTIL_BIT_IS_CLEARED', 'READ_16_BIT_REGISTER_INCR_ADDR',
+    'READ_16_BIT_REGISTER_DECR_ADDR', 'REPEAT_CMD_BUFFER', 'SET_DATA')}
+LATENCY_BUCKETS = (100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000,
+                   100000, 200000, 500000)      # us, upper bounds
+
+
+class Metrics:
+
+    def __init__(self, board=None):
+        self.board = board
+        self.hooks = []
+        self.reset()
+
+    def reset(self):
+        self.commands = [0] * 16                # by opcode >> 4
+        self.lone_bytes = 0                     # firmware resets
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.write_calls = 0
+        self.read_calls = 0
+        self.short_reads = 0                    # timeouts
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.ring_fill = 0
+        self.ring_fill_max = 0
+        self._first_write = None                # perf_counter of the first unanswered write
+
+    def addHook(self, hook):
+        """
+        hook(event, value), called for every event
+        """
+        self.hooks.append(hook)
+
+    def removeHook(self, hook):
+        self.hooks.remove(hook)
+
+    """
+    ##############################################################
+    ##     events (called by Arduino)
+    ##############################################################
+    """
+
+    def written(self, cmd_str):
+        commands = self.commands
+        for cmd in cmd_str[0:len(cmd_str) - 1:2]:
+            commands[cmd >> 4] += 1
+        if len(cmd_str) % 2:
+            self.lone_bytes += 1
+        self.bytes_written += len(cmd_str)
+        self.write_calls += 1
+        if self._first_write is None:
+            self._first_write = time.perf_counter()
+        flow = self.board.flow if self.board is not None else None
+        if flow is not None:
+            self.ring_fill = flow.fill()
+        else:
+            self.ring_fill += len(cmd_str)
+        if self.ring_fill > self.ring_fill_max:
+            self.ring_fill_max = self.ring_fill
+        for hook in self.hooks:
+            hook('write', len(cmd_str))
+
+    def read(self, size, rd, started):
+        """
+        size: bytes asked for, rd: bytes received
+        started: perf_counter when the read began
+        """
+        now = time.perf_counter()
+        self.bytes_read += len(rd)
+        self.read_calls += 1
+        if len(rd) < size:
+            self.short_reads += 1
+        if self._first_write is not None and self._first_write < started:
+            started = self._first_write
+        self._first_write = None
+        seconds = now - started
+        us = seconds * 1e6
+        i = 0
+        while i < len(LATENCY_BUCKETS) and us > LATENCY_BUCKETS[i]:
+            i += 1
+        self.latency[i] += 1
+        self.latency_sum += us
+        if self.board is None or self.board.flow is None:
+            self.ring_fill = 0                  # everything before the read ran
+        for hook in self.hooks:
+            hook('read', len(rd))
+            hook('latency', seconds)
+
+    """
+    ##############################################################
+    ##     snapshot
+    ##############################################################
+    """
+
+    def snapshot(self):
+        """
+        returns: a dict of plain numbers, lists and strings
+        """
+        buckets = []
+        total = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), self.latency):
+            total += count
+            buckets.append([bound, total])
+        return {
+            'commands': {OPCODE_NAMES.get(i << 4, hex(i << 4)): count
+                         for i, count in enumerate(self.commands) if count},
+            'lone_bytes': self.lone_bytes,
+            'bytes_written': self.bytes_written,
+            'bytes_read': self.bytes_read,
+            'write_calls': self.write_calls,
+            'read_calls': self.read_calls,
+            'short_reads': self.short_reads,
+            'latency_us': {'buckets': buckets, 'count': total, 'sum': self.latency_sum},
+            'ring_fill': {'last': self.ring_fill, 'max': self.ring_fill_max},
+        }
+
+    def __repr__(self):
+        return 'Metrics(%d commands, %d bytes out, %d bytes in)' % (
+            sum(self.commands), self.bytes_written, self.bytes_read)
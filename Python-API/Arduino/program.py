@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""
+Precompiled command programs.
+
+A Program is the immutable, already encoded byte string of a sequence of
+Arduino API calls. It is recorded once by running the calls against the
+board in record mode, and can then be sent again and again with a single
+write:
+
+    def blink(board, pin):
+        board.pinMode(pin, 'OUTPUT')
+        board.cmdDo()
+        board.digitalWrite(pin, 'HIGH')
+        board.digitalWrite(pin, 'LOW')
+        board.cmdLoop()
+
+    program = board.compile(blink, 13)    # recorded once, then cached
+    board.run(program)
+"""
+import logging
+from collections import namedtuple, OrderedDict
+from Arduino.arduino import (RESPONSE_SIZE, REPEAT_CMD_BUFFER,
+                             decode_response)
+from Arduino.encoder import CommandEncoder
+
+log = logging.getLogger(__name__)
+
+"""
+A running loop must stay in the firmware's 256 byte command buffer
+"""
+MAX_LOOP_SIZE = 254
+MAX_REPEAT_COUNT = 0xFF
+
+
+class Program(namedtuple('Program', ('code', 'reads', 'loop_start'))):
+    """
+    code: encoded commands (bytes)
+    reads: the read commands of the program, in order
+    loop_start: offset of the cmdDo/cmdLoop body in code, or None
+    """
+    __slots__ = ()
+
+    def __len__(self):
+        return len(self.code)
+
+    @property
+    def loops(self):
+        return self.loop_start is not None
+
+    @property
+    def response_size(self):
+        """
+        Bytes the firmware sends back for one pass of the program.
+        """
+        return sum(RESPONSE_SIZE[cmd] for cmd in self.reads)
+
+    def decode(self, rd):
+        """
+        Converts the response of one pass into a list of integers.
+        """
+        values = []
+        pos = 0
+        for cmd in self.reads:
+            size = RESPONSE_SIZE[cmd]
+            if pos + size <= len(rd):
+                values.append(decode_response(cmd, rd[pos:pos + size]))
+            else:
+                values.append(None)
+            pos += size
+        return values
+
+
+class Recorder:
+    """
+    Collects the commands the board encodes while recording.
+    """
+    def __init__(self):
+        self.encoder = CommandEncoder()
+        self.reads = []
+        self.do_start = 0           # cmd_do_buffer_num starts at 0 too
+        self.program = None
+
+    @property
+    def code(self):
+        """
+        The commands recorded so far (a view, valid while recording).
+        """
+        return self.encoder.view()
+
+    def append(self, cmd_str):
+        for i in range(0, len(cmd_str) - 1, 2):
+            if cmd_str[i] & 0xF0 in RESPONSE_SIZE:
+                self.reads.append(cmd_str[i] & 0xF0)
+        self.encoder.raw(cmd_str)
+
+    def clear(self):
+        """
+        Empties the recorder so it can be used again.
+        """
+        self.encoder.clear()
+        self.reads = []
+        self.do_start = 0
+        self.program = None
+
+    def mark(self):
+        self.do_start = len(self.encoder)
+
+    def finish(self):
+        self.program = build_program(bytes(self.code), self.do_start)
+        return self.program
+
+
+def build_program(code, do_start=None):
+    """
+    Validates an encoded command string and returns it as a Program.
+    do_start is the offset where cmdDo was called, if known.
+    """
+    if len(code) % 2:
+        raise ValueError('A program must consist of whole 2 byte commands.')
+    reads = []
+    loop_start = None
+    for i in range(0, len(code), 2):
+        cmd = code[i] & 0xF0
+        if cmd in RESPONSE_SIZE:
+            reads.append(cmd)
+        elif cmd == REPEAT_CMD_BUFFER:
+            loop_start = i - code[i + 1]
+            if do_start is not None and loop_start != do_start:
+                raise ValueError('cmdLoop body of %d bytes does not fit '
+                                 'REPEAT_CMD_BUFFER\'s one byte count (max %d).'
+                                 % (i - do_start, MAX_REPEAT_COUNT))
+            if loop_start < 0:
+                raise ValueError('cmdLoop repeats commands outside the program.')
+            if i + 2 - loop_start > MAX_LOOP_SIZE:
+                raise ValueError('cmdDo/cmdLoop body of %d bytes does not fit '
+                                 'into the firmware command buffer (max %d).'
+                                 % (i - loop_start, MAX_LOOP_SIZE - 2))
+            if i + 2 != len(code):
+                raise ValueError('Commands after cmdLoop are never executed.')
+    return Program(bytes(code), tuple(reads), loop_start)
+
+
+class ProgramCache:
+    """
+    LRU cache of compiled programs keyed by builder and its parameters.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._programs = OrderedDict()
+
+    def get(self, key):
+        program = self._programs.get(key)
+        if program is not None:
+            self._programs.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+        return program
+
+    def put(self, key, program):
+        self._programs[key] = program
+        self._programs.move_to_end(key)
+        while len(self._programs) > self.maxsize:
+            self._programs.popitem(last=False)
+
+    def clear(self):
+        self._programs.clear()
+
+    def __len__(self):
+        return len(self._programs)
+
+
+program_cache = ProgramCache()
+
+
+def program_key(builder, args, kwargs, profile=None, f_cpu=None):
+    """
+    Cache key of a builder call. Lists, tuples, dicts and sets among the
+    parameters are frozen, e.g. a list of pins; returns None if a
+    parameter still is not hashable (compile then skips the cache).
+    """
+    try:
+        key = (builder, _frozen(tuple(args)), _frozen(kwargs), profile, f_cpu)
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _frozen(value):
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(_frozen(item) for item in value)
+    if isinstance(value, dict):
+        return ('dict', frozenset((key, _frozen(item)) for key, item in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return ('set', frozenset(_frozen(item) for item in value))
+    return value
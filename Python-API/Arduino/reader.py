@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+"""
+Background reader for the serial port.
+
+One thread drains the port into a buffer as soon as bytes arrive. Every
+read command written to the board first registers the length of its
+response and a future in a FIFO, so the incoming bytes are matched to the
+commands in order - nothing has to be flushed before a read and several
+reads can be in flight at once:
+
+    board = Arduino(reader=True)
+    board.sendAPICmd(cmds)          # e.g. three READ_REGISTER commands
+    rd = board._read(3)             # the futures of those three commands
+
+read() waits on the futures of the commands sent before it, in order. If
+it times out, the responses it gave up on are dropped when they arrive
+late, later reads still get their own bytes. Bytes nobody asked for (the
+version printed after a reset) are kept in `stray`, nothing is thrown
+away. While a cmdDo/cmdLoop runs, its output is passed to the caller as
+it arrives.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from Arduino.arduino import RESPONSE_SIZE, PROCES_RESET, REPEAT_CMD_BUFFER
+
+log = logging.getLogger(__name__)
+
+POLL_TIMEOUT = 0.01         # s, how long one port read may block
+
+
+class ReaderThread(threading.Thread):
+
+    def __init__(self, sr, timeout=None):
+        """
+        sr: opened pyserial port, the thread becomes its only reader
+        timeout: seconds read() waits, the port's timeout by default
+        """
+        threading.Thread.__init__(self, name='Arduino reader', daemon=True)
+        self.sr = sr
+        self.timeout = sr.timeout if timeout is None else timeout
+        self.received = 0
+        self._cond = threading.Condition()
+        self.stray = bytearray()        # bytes no command asked for
+        self._buffer = bytearray()      # received, not matched yet
+        self._ready = bytearray()       # claimed responses not read yet
+        self._expect = deque()          # [size, future, is_sync]
+        self._claims = deque()          # (size, future) read() waits on
+        self._looping = False
+        self._discard = False
+        self._last_rx = time.monotonic()
+        self._running = True
+        sr.timeout = POLL_TIMEOUT
+        if sr.inWaiting():
+            self.stray += sr.read(sr.inWaiting())
+        self.start()
+
+    def run(self):
+        while self._running:
+            try:
+                data = self.sr.read(self.sr.in_waiting or 1)
+            except Exception as e:
+                if self._running:
+                    log.error('Reader thread stopped: %s', e)
+                break
+            if data:
+                with self._cond:
+                    self._received(data)
+                    self._cond.notify_all()
+
+    def close(self):
+        self._running = False
+        if self is not threading.current_thread():
+            self.join()
+        self.sr.timeout = self.timeout
+
+    def _received(self, data):
+        self.received += len(data)
+        self._last_rx = time.monotonic()
+        if self._discard:
+            self.stray += data
+            return
+        self._buffer += data
+        while self._expect and len(self._buffer) >= self._expect[0][0]:
+            size, future, is_sync = self._expect.popleft()
+            rd = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            future.set_result(rd)
+        if not self._expect and self._buffer:
+            if self._looping:
+                self._ready += self._buffer
+            else:
+                self.stray += self._buffer
+            del self._buffer[:]
+
+    """
+    ##############################################################
+    ##     expectations
+    ##############################################################
+    """
+
+    def expect(self, size, is_sync=False):
+        """
+        Registers the next `size` response bytes. Call it before the
+        command is written. returns: a Future resolved with the bytes
+        """
+        future = Future()
+        with self._cond:
+            self._expect.append([size, future, is_sync])
+            if not is_sync:
+                self._claims.append((size, future))
+        return future
+
+    def sent(self, chunk):
+        """
+        Registers the responses of the commands in chunk, to be called just
+        before chunk is written to the port.
+        """
+        futures = []
+        for i in range(0, len(chunk) - 1, 2):
+            cmd = chunk[i] & 0xF0
+            if cmd in RESPONSE_SIZE:
+                futures.append(self.expect(RESPONSE_SIZE[cmd]))
+            elif cmd == REPEAT_CMD_BUFFER:
+                with self._cond:
+                    self._looping = True
+            elif cmd == PROCES_RESET:
+                # Process_reset empties the ring and prints the version
+                self.reset()
+                futures = [self.expect(1, is_sync=True)]
+        if len(chunk) % 2:
+            # a lone byte resets the firmware, the version is for the caller
+            self.reset()
+            futures = [self.expect(1)]
+        return futures
+
+    def reset(self):
+        """
+        The firmware was reset: responses still pending will never come.
+        """
+        with self._cond:
+            while self._expect:
+                self._expect.popleft()[1].cancel()
+            self._claims.clear()
+            self.stray += self._ready + self._buffer
+            del self._buffer[:]
+            del self._ready[:]
+            self._looping = False
+
+    """
+    ##############################################################
+    ##     reading
+    ##############################################################
+    """
+
+    def read(self, size=1):
+        """
+        Returns the next `size` response bytes, fewer after timeout.
+        They are taken from the futures of the read commands in the
+        order they were sent; the futures given up on at a timeout are
+        left to absorb their late bytes.
+        """
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while len(self._ready) < size:
+                if self._claims:
+                    claim_size, future = self._claims[0]
+                    if future.done():
+                        self._claims.popleft()
+                        if not future.cancelled():
+                            self._ready += future.result()
+                        continue
+                elif not self._looping:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._running:
+                    self._abandon(size - len(self._ready))
+                    break
+                self._cond.wait(remaining)
+            rd = bytes(self._ready[:size])
+            del self._ready[:len(rd)]
+        return rd
+
+    def _abandon(self, size):
+        """
+        Gives up the claims of the next `size` response bytes.
+        """
+        while size > 0 and self._claims:
+            size -= self._claims.popleft()[0]
+
+    def inWaiting(self):
+        with self._cond:
+            return len(self._ready) + sum(len(future.result()) for size, future
+                                          in self._claims if future.done()
+                                          and not future.cancelled())
+
+    def flushInput(self):
+        """
+        Nothing to flush: responses are matched to their commands and
+        bytes nobody asked for are kept in `stray`.
+        """
+
+    def drain(self, quiet):
+        """
+        Sets everything aside into `stray` until the port was silent for
+        `quiet` seconds, e.g. the rest of a stopped cmdLoop and the
+        version after reset.
+        """
+        with self._cond:
+            self._discard = True
+            self._last_rx = time.monotonic()
+        try:
+            while True:
+                idle = time.monotonic() - self._last_rx
+                if idle >= quiet or not self._running:
+                    break
+                time.sleep(quiet - idle)
+        finally:
+            self.reset()
+            with self._cond:
+                self._discard = False
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Register database of the ATmega328P.
+
+Built from the register and bit definitions of the m328p module (plus the
+aliases of m328) the first time it is used, so importing Arduino stays
+cheap:
+
+    from Arduino.registerdb import database, encode
+    db = database()
+    db['TCCR1B'].address                # 0x81, also db[0x81].name
+    db['TCCR1B'].fields['CS1']          # Field('CS1', shift=0, width=3)
+    encode('TCCR1B', WGM13=1, CS1=2)    # 0x12, computed once then cached
+
+Bits whose names only differ in a trailing 0, 1, 2.. at consecutive bit
+positions form a field: CS10..CS12 -> CS1, ADPS0..ADPS2 -> ADPS,
+MUX0..MUX3 -> MUX, COM1A0..COM1A1 -> COM1A. Every bit is also a field of
+width 1 under its own name.
+"""
+from collections import namedtuple
+
+MIN_ADDRESS = 0x20          # registers are data space addresses, bits are 0..7
+END_OF_REGISTERS = 'SPM_PAGESIZE'   # m328p's memory size constants follow
+
+
+class Field(namedtuple('Field', ('name', 'shift', 'width'))):
+    __slots__ = ()
+
+    @property
+    def mask(self):
+        return ((1 << self.width) - 1) << self.shift
+
+    def encode(self, value):
+        if not 0 <= value < 1 << self.width:
+            raise ValueError('%s is %d bit wide, %r does not fit.'
+                             % (self.name, self.width, value))
+        return value << self.shift
+
+
+class Register:
+
+    def __init__(self, name, address):
+        self.name = name
+        self.address = address
+        self.aliases = []
+        self.bits = {}              # bit name: bit number
+        self.fields = {}            # field name: Field
+
+    def _addFields(self):
+        for name, bit in self.bits.items():
+            self.fields[name] = Field(name, bit, 1)
+        groups = {}
+        for name, bit in self.bits.items():
+            if name[-1].isdigit():
+                groups.setdefault(name[:-1].rstrip('_'), []).append((int(name[-1]), bit))
+        for prefix, members in groups.items():
+            members.sort()
+            shift = members[0][1]
+            if len(members) > 1 and prefix not in self.fields and \
+                    all(k == i and bit == shift + i for i, (k, bit) in enumerate(members)):
+                self.fields[prefix] = Field(prefix, shift, len(members))
+
+    def __repr__(self):
+        return 'Register(%s, 0x%02X)' % (self.name, self.address)
+
+
+class RegisterDatabase:
+
+    def __init__(self):
+        self._by_name = {}
+        self._by_address = {}
+        self._encoded = {}
+
+    def _load(self, module, aliases_only=False):
+        """
+        Walks the module's NAME = value definitions in order: a value of
+        at least MIN_ADDRESS starts a register, small values are its bits.
+        A name defined twice keeps its first place, so bits repeated under
+        a later register (OCR2_0.. of OCR2B) belong to the first one only.
+        """
+        register = None
+        for name, value in vars(module).items():
+            if name == END_OF_REGISTERS:
+                break
+            if name.startswith('_') or not isinstance(value, int):
+                continue
+            if value >= MIN_ADDRESS:
+                register = self._by_address.get(value)
+                if register is None and not aliases_only:
+                    register = Register(name, value)
+                    self._by_address[value] = register
+                if register is not None and name not in self._by_name:
+                    self._by_name[name] = register
+                    if name != register.name:
+                        register.aliases.append(name)
+            elif register is not None and not aliases_only:
+                register.bits[name] = value
+
+    def __getitem__(self, key):
+        """
+        Register by name or address.
+        """
+        if isinstance(key, Register):
+            return key
+        if isinstance(key, str):
+            return self._by_name[key]
+        return self._by_address[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __iter__(self):
+        return iter(sorted(self._by_address.values(), key=lambda r: r.address))
+
+    def address(self, reg):
+        return self[reg].address
+
+    def name(self, address):
+        return self[address].name
+
+    def encode(self, reg, **fields):
+        """
+        Register value with the given fields set and all others 0, e.g.
+        encode('ADCSRA', ADEN=1, ADPS=7). Results are cached.
+        """
+        key = (reg, tuple(sorted(fields.items())))
+        value = self._encoded.get(key)
+        if value is None:
+            register = self[reg]
+            value = 0
+            for name, field_value in fields.items():
+                try:
+                    field = register.fields[name]
+                except KeyError:
+                    raise KeyError('%s has no field %s.' % (register.name, name))
+                value |= field.encode(field_value)
+            self._encoded[key] = value
+        return value
+
+    def decode(self, reg, value):
+        """
+        {field name: value} of the multi bit fields and of the bits that
+        are not part of one.
+        """
+        register = self[reg]
+        grouped = set()
+        result = {}
+        for field in register.fields.values():
+            if field.width > 1:
+                result[field.name] = (value & field.mask) >> field.shift
+                grouped.update(range(field.shift, field.shift + field.width))
+        for name, bit in register.bits.items():
+            if bit not in grouped:
+                result[name] = value >> bit & 1
+        return result
+
+
+_database = None
+
+
+def database():
+    """
+    The register database, built on first use.
+    """
+    global _database
+    if _database is None:
+        from Arduino import m328p, m328
+        db = RegisterDatabase()
+        db._load(m328p)
+        db._load(m328, aliases_only=True)
+        for register in db._by_address.values():
+            register._addFields()
+        _database = db
+    return _database
+
+
+def encode(reg, **fields):
+    return database().encode(reg, **fields)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+Shadow register file.
+
+Mirrors the values the host has written into the microcontroller's
+registers, bit by bit, as far as they are known:
+
+    board = Arduino(shadow=True)
+    board.pinMode(13, 'OUTPUT')
+    board.digitalWrite(13, 'HIGH')
+    board.digitalWrite(13, 'HIGH')      # not sent, PORTB.5 is already 1
+    board.readRegister(uK.DDRB)         # no round trip if DDRB is known
+    board.registers['PORTB']            # value, None while a bit is unknown
+
+Registers the hardware changes on its own (PINx, interrupt flags, ADC,
+counters, UART) are volatile: they are never cached and writes to them
+are always sent. Inside cmdDo/cmdLoop and after a reset nothing is known.
+"""
+import logging
+from Arduino import m328p as uK
+from Arduino.registerdb import database
+from Arduino.arduino import (PROCES_RESET, SET_REGISTER, SET_REGISTER_BIT,
+                             CLR_REGISTER_BIT, REPEAT_CMD_BUFFER, SET_DATA,
+                             WAIT_UNTIL_BIT_IS_SET, WAIT_UNTIL_BIT_IS_CLEARED,
+                             RESPONSE_SIZE)
+
+log = logging.getLogger(__name__)
+
+CACHEABLE = 'cacheable'
+VOLATILE = 'volatile'
+
+"""
+Registers changed by the hardware
+"""
+VOLATILE_REGISTERS = (uK.PINB, uK.PINC, uK.PIND,
+                      uK.TIFR0, uK.TIFR1, uK.TIFR2, uK.EIFR, uK.PCIFR,
+                      uK.TCNT0, uK.TCNT1L, uK.TCNT1H, uK.TCNT2,
+                      uK.ICR1L, uK.ICR1H,
+                      uK.ADCL, uK.ADCH, uK.ADCSRA,
+                      uK.UCSR0A, uK.UDR0, uK.SPSR, uK.SPDR,
+                      uK.TWCR, uK.TWSR, uK.TWDR, uK.EECR, uK.EEDR,
+                      uK.SPMCSR, uK.MCUSR, uK.ACSR)
+"""
+Writing a PINx register toggles PORTx
+"""
+PIN_PORT = {uK.PINB: uK.PORTB, uK.PINC: uK.PORTC, uK.PIND: uK.PORTD}
+
+
+def register_address(reg):
+    """
+    Accepts an address or a register name (see registerdb.py).
+    """
+    if isinstance(reg, str):
+        return database().address(reg)
+    return reg
+
+
+class ShadowRegisters:
+
+    def __init__(self):
+        self.policy = dict.fromkeys(VOLATILE_REGISTERS, VOLATILE)
+        self.elided = 0             # bytes not sent
+        self.hits = 0               # reads served from the mirror
+        self.clear()
+
+    def clear(self):
+        """
+        Forgets everything, e.g. after a firmware reset.
+        """
+        self._value = {}
+        self._known = {}            # mask of the known bits
+        self.loop_running = False
+
+    def save(self):
+        """
+        returns: the mirror's state, for restore()
+        """
+        return dict(self._value), dict(self._known), self.loop_running
+
+    def restore(self, state):
+        """
+        Goes back to a saved state, e.g. when a batch is dropped unsent.
+        """
+        value, known, self.loop_running = state
+        self._value = dict(value)
+        self._known = dict(known)
+
+    def setPolicy(self, reg, policy):
+        reg = register_address(reg)
+        self.policy[reg] = policy
+        if policy == VOLATILE:
+            self.invalidate(reg)
+
+    def cacheable(self, reg):
+        return self.policy.get(reg, CACHEABLE) == CACHEABLE
+
+    """
+    ##############################################################
+    ##     the mirror
+    ##############################################################
+    """
+
+    def get(self, reg):
+        """
+        returns: the register value if all its bits are known, else None
+        """
+        reg = register_address(reg)
+        if self._known.get(reg) == 0xFF:
+            return self._value[reg]
+        return None
+
+    def getBit(self, bit, reg):
+        if bit > 7 or not self._known.get(reg, 0) & 1 << bit:
+            return None
+        return self._value[reg] >> bit & 1
+
+    def learn(self, reg, value):
+        """
+        Stores a value read from the board.
+        """
+        if value is not None and self.cacheable(reg) and not self.loop_running:
+            self._value[reg] = value
+            self._known[reg] = 0xFF
+
+    def invalidate(self, reg):
+        self._value.pop(reg, None)
+        self._known.pop(reg, None)
+
+    def _store(self, reg, value):
+        if value is None or not self.cacheable(reg) or self.loop_running:
+            self.invalidate(reg)
+        else:
+            self._value[reg] = value
+            self._known[reg] = 0xFF
+        if reg in PIN_PORT:
+            self.invalidate(PIN_PORT[reg])
+
+    def _storeBit(self, reg, bit, value):
+        if bit > 7 or not self.cacheable(reg) or self.loop_running:
+            self.invalidate(reg)
+        else:
+            mask = 1 << bit
+            self._value[reg] = self._value.get(reg, 0) & ~mask | (mask if value else 0)
+            self._known[reg] = self._known.get(reg, 0) | mask
+        if reg in PIN_PORT:
+            self.invalidate(PIN_PORT[reg])
+
+    def filter(self, cmd_str, looping=False):
+        """
+        Updates the mirror with the commands in cmd_str and returns the
+        commands that still have to be sent. Nothing is left out while a
+        cmdDo/cmdLoop is open (looping), the body runs more than once.
+        """
+        if len(cmd_str) % 2:
+            self.clear()                # lone byte: firmware reset
+            return cmd_str
+        elide = not looping
+        for i in range(0, len(cmd_str), 2):
+            if cmd_str[i] & 0xF0 == REPEAT_CMD_BUFFER:
+                elide = False
+        out = bytearray()
+        data = None
+        for i in range(0, len(cmd_str), 2):
+            cmd = cmd_str[i] & 0xF0
+            bit = cmd_str[i] & 0x0F
+            arg = cmd_str[i + 1]
+            if cmd == SET_DATA:
+                data = arg
+            elif cmd == SET_REGISTER:
+                if elide and data is not None and self.get(arg) == data and \
+                        out[-2:] == bytes([SET_DATA, data]):
+                    del out[-2:]
+                    self.elided += 4
+                    continue
+                self._store(arg, data if elide else None)
+            elif cmd in (SET_REGISTER_BIT, CLR_REGISTER_BIT):
+                value = cmd == SET_REGISTER_BIT
+                if elide and self.getBit(bit, arg) == value:
+                    self.elided += 2
+                    continue
+                if elide:
+                    self._storeBit(arg, bit, value)
+                else:
+                    self._store(arg, None)
+            elif cmd in RESPONSE_SIZE or cmd in (WAIT_UNTIL_BIT_IS_SET,
+                                                 WAIT_UNTIL_BIT_IS_CLEARED):
+                data = None                 # reads and waits go through r16
+            elif cmd == REPEAT_CMD_BUFFER:
+                self.loop_running = True    # until the next reset
+            elif cmd == PROCES_RESET:
+                self.clear()
+            out += cmd_str[i:i + 2]
+        return bytes(out)
+
+    """
+    ##############################################################
+    ##     board.registers view
+    ##############################################################
+    """
+
+    def __getitem__(self, reg):
+        return self.get(reg)
+
+    def __contains__(self, reg):
+        return self.get(reg) is not None
+
+    def items(self):
+        """
+        (address, value, known bits mask) of every register with a known bit
+        """
+        return sorted((reg, self._value[reg], self._known[reg]) for reg in self._known)
+
+    def __repr__(self):
+        return 'ShadowRegisters(%s)' % ', '.join(
+            '0x%02X=0x%02X/%02X' % item for item in self.items())
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+"""
+Protocol trace decoder.
+
+Turns the bytes sent to the firmware - a wire log of wirelog.py or a raw
+byte dump - into typed command records and follows the firmware's state:
+
+    trace = Trace.fromLog('session.wire')       # or Trace.fromBytes(data)
+    for command in trace.commands:
+        print(command)                          # 0.012358  26 SET_REGISTER GPIOR0
+    trace.spans                                 # cmdDo/cmdLoop bodies
+    trace.fill                                  # (t_ns, ring fill) after every event
+    print(trace.report())                       # idle link, stalls behind WAITs
+
+    python -m Arduino.trace session.wire [--commands] [--raw]
+
+Commands are 2 bytes, &B_kkkk_xbit plus an address or data byte (see the
+README). cmd_buffer_num is the ring position the host keeps, it restarts
+at 0 after a reset. The ring fill is estimated by FlowControl, fed with
+the logged writes and reads: bytes behind a WAIT_UNTIL_BIT command or a
+running loop that no later response has proven executed.
+"""
+import argparse
+import sys
+from collections import namedtuple
+from Arduino.arduino import (PROCES_RESET, SET_DATA, REPEAT_CMD_BUFFER,
+                             SET_REGISTER_BIT, CLR_REGISTER_BIT,
+                             READ_REGISTER_BIT, WAIT_UNTIL_BIT_IS_SET,
+                             WAIT_UNTIL_BIT_IS_CLEARED)
+from Arduino.flowcontrol import FlowControl
+from Arduino.metrics import OPCODE_NAMES
+from Arduino.registerdb import database
+
+IDLE_GAP = 0.005            # s without traffic reported as idle
+STALL_TIME = 0.005          # s a WAIT may block before it is reported
+BIT_COMMANDS = (SET_REGISTER_BIT, CLR_REGISTER_BIT, READ_REGISTER_BIT,
+                WAIT_UNTIL_BIT_IS_SET, WAIT_UNTIL_BIT_IS_CLEARED)
+WAIT_COMMANDS = (WAIT_UNTIL_BIT_IS_SET, WAIT_UNTIL_BIT_IS_CLEARED)
+
+
+class Command(namedtuple('Command', ('t_ns', 'offset', 'buffer_num', 'cmd',
+                                     'bit', 'arg', 'register', 'bit_name'))):
+    """
+    t_ns: time of the write since the session start (None for raw bytes)
+    offset: position in the written byte stream
+    buffer_num: cmd_buffer_num before the command
+    cmd, bit, arg: the decoded bytes (arg is data for SET_DATA and the
+        body size for REPEAT_CMD_BUFFER)
+    register, bit_name: names from m328p, None if not a register command
+    """
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return OPCODE_NAMES.get(self.cmd, hex(self.cmd))
+
+    def __str__(self):
+        if self.cmd in (SET_DATA, REPEAT_CMD_BUFFER):
+            operand = '0x%02X' % self.arg
+        elif self.cmd == PROCES_RESET:
+            operand = ''
+        elif self.bit_name is not None:
+            operand = '%s.%s' % (self.register, self.bit_name)
+        elif self.cmd in BIT_COMMANDS:
+            operand = '%s.%d' % (self.register, self.bit)
+        else:
+            operand = self.register
+        t = '' if self.t_ns is None else '%.6f ' % (self.t_ns / 1e9)
+        return '%s%3d %s %s' % (t, self.buffer_num, self.name, operand)
+
+
+"""
+body_start, end: indexes into Trace.commands of the first command of the
+body and of the REPEAT_CMD_BUFFER; size: body bytes
+"""
+LoopSpan = namedtuple('LoopSpan', ('body_start', 'end', 'size', 't_ns'))
+
+
+class _Feed:
+    """
+    Serial stand-in that hands the logged reads to FlowControl.
+    """
+    def __init__(self):
+        self.data = bytearray()
+
+    def read(self, size=1):
+        rd = bytes(self.data[:size])
+        del self.data[:size]
+        return rd
+
+    def inWaiting(self):
+        return len(self.data)
+
+    def flushInput(self):
+        del self.data[:]
+
+
+class _Board:
+    def __init__(self, sr):
+        self.sr = sr
+        self.cmd_buffer_num = 0
+
+
+class Trace:
+
+    def __init__(self):
+        self.commands = []
+        self.spans = []
+        self.fill = []              # (t_ns, estimated ring fill)
+        self.idle = []              # (t_ns, seconds) of gaps in the traffic
+        self.stalls = []            # (Command, seconds) of blocking WAITs
+        self.resets = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self._feed = _Feed()
+        self._flow = FlowControl(_Board(self._feed))
+        self._db = database()
+        self._buffer_num = 0
+        self._waits = []            # (FlowControl position after the WAIT, Command)
+        self._last_t = None
+
+    @classmethod
+    def fromLog(cls, path):
+        from Arduino.wirelog import read_log, WRITE, READ
+        trace = cls()
+        t_start = None
+        for t_ns, kind, data in read_log(path):
+            if t_start is None:
+                t_start = t_ns
+            t_ns -= t_start                 # session time, as in wirelog dump
+            if kind == WRITE:
+                trace.written(data, t_ns)
+            elif kind == READ and data:
+                trace.read(data, t_ns)
+        return trace
+
+    @classmethod
+    def fromBytes(cls, data):
+        """
+        Bytes sent to the board without timing, e.g. a pyserial log.
+        The write boundaries are lost, only a lone byte at the end is
+        recognised as a reset.
+        """
+        trace = cls()
+        trace.written(data)
+        return trace
+
+    """
+    ##############################################################
+    ##     events
+    ##############################################################
+    """
+
+    def _tick(self, t_ns):
+        if t_ns is None:
+            return
+        if self._last_t is not None and t_ns - self._last_t > IDLE_GAP * 1e9:
+            self.idle.append((self._last_t, (t_ns - self._last_t) / 1e9))
+        self._last_t = t_ns
+
+    def written(self, data, t_ns=None):
+        """
+        One write to the port (the firmware sees a lone byte at its end
+        as an incomplete command and resets).
+        """
+        self._tick(t_ns)
+        for i in range(0, len(data) - 1, 2):
+            self._decode(data[i], data[i + 1], t_ns)
+        if len(data) % 2:
+            self.commands.append(Command(t_ns, self.bytes_written, self._buffer_num,
+                                         PROCES_RESET, 0, None, None, None))
+            self._reset(data[-1:])
+        self.fill.append((t_ns, self._flow.fill()))
+
+    def _reset(self, cmd_str):
+        self._flow.sent(cmd_str)
+        self.bytes_written += len(cmd_str)
+        self.resets += 1
+        self._buffer_num = 0
+        self._waits = []
+
+    def _decode(self, first, arg, t_ns):
+        cmd = first & 0xF0
+        bit = first & 0x0F
+        register = bit_name = None
+        if cmd not in (PROCES_RESET, SET_DATA, REPEAT_CMD_BUFFER):
+            reg = self._db.get(arg)
+            register = reg.name if reg is not None else '0x%02X' % arg
+            if cmd in BIT_COMMANDS and reg is not None:
+                for name, number in reg.bits.items():
+                    if number == bit:
+                        bit_name = name
+                        break
+        command = Command(t_ns, self.bytes_written, self._buffer_num,
+                          cmd, bit, arg, register, bit_name)
+        self.commands.append(command)
+        if cmd == PROCES_RESET:
+            self._reset(bytes((first, arg)))
+            return
+        self._flow.sent(bytes((first, arg)))
+        self.bytes_written += 2
+        self._buffer_num = (self._buffer_num + 2) % 256
+        if cmd == REPEAT_CMD_BUFFER:
+            end = len(self.commands) - 1
+            self.spans.append(LoopSpan(max(0, end - arg // 2), end, arg, t_ns))
+        elif cmd in WAIT_COMMANDS:
+            self._waits.append((self._flow.written, command))
+
+    def read(self, data, t_ns=None):
+        """
+        Response bytes: everything up to their commands has run.
+        """
+        self._tick(t_ns)
+        self.bytes_read += len(data)
+        self._feed.data += data
+        self._flow._receive(len(data))
+        executed = self._flow.executed
+        while self._waits and self._waits[0][0] <= executed:
+            position, command = self._waits.pop(0)
+            if t_ns is not None and command.t_ns is not None:
+                seconds = (t_ns - command.t_ns) / 1e9
+                if seconds >= STALL_TIME:
+                    self.stalls.append((command, seconds))
+        self.fill.append((t_ns, self._flow.fill()))
+
+    """
+    ##############################################################
+    ##     report
+    ##############################################################
+    """
+
+    def duration(self):
+        times = [t for t, fill in self.fill if t is not None]
+        return times[-1] / 1e9 if times else 0.0
+
+    def report(self, top=10):
+        lines = ['%d commands, %d bytes written, %d bytes read, %d resets, %d loops'
+                 % (len(self.commands), self.bytes_written, self.bytes_read,
+                    self.resets, len(self.spans))]
+        if self.fill:
+            lines.append('ring fill: max %d bytes' % max(fill for t, fill in self.fill))
+        duration = self.duration()
+        if duration:
+            idle = sum(seconds for t, seconds in self.idle)
+            lines.append('%.3f s traced, link idle %.3f s (%.0f%%) in %d gaps > %g ms'
+                         % (duration, idle, 100 * idle / duration, len(self.idle),
+                            IDLE_GAP * 1e3))
+            for t, seconds in sorted(self.idle, key=lambda gap: -gap[1])[:top]:
+                lines.append('  idle  %.6f  %.3f ms' % (t / 1e9, seconds * 1e3))
+            lines.append('%d WAIT commands blocked > %g ms, %.3f s in total'
+                         % (len(self.stalls), STALL_TIME * 1e3,
+                            sum(seconds for command, seconds in self.stalls)))
+            if self._waits:
+                lines.append('%d WAIT commands never proven executed' % len(self._waits))
+            for command, seconds in sorted(self.stalls, key=lambda stall: -stall[1])[:top]:
+                lines.append('  stall %.6f  %.3f ms  %s %s.%s'
+                             % (command.t_ns / 1e9, seconds * 1e3, command.name,
+                                command.register, command.bit_name or command.bit))
+        for span in self.spans:
+            commands = self.commands[span.body_start:span.end + 1]
+            lines.append('loop of %d bytes: %s' % (span.size, ', '.join(
+                '%s %s' % (c.name, c.register or '') for c in commands[:-1])))
+        return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Arduino serial API trace decoder')
+    parser.add_argument('path', help='wire log (wirelog.py) or raw bytes with --raw')
+    parser.add_argument('--raw', action='store_true', help='path holds the bytes sent')
+    parser.add_argument('--commands', action='store_true', help='list every command')
+    args = parser.parse_args(argv)
+    if args.raw:
+        with open(args.path, 'rb') as f:
+            trace = Trace.fromBytes(f.read())
+    else:
+        trace = Trace.fromLog(args.path)
+    if args.commands:
+        for command in trace.commands:
+            print(command)
+    print(trace.report())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
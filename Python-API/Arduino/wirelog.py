@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+"""
+Wire-level session log.
+
+WireRecorder wraps the serial port of an Arduino and appends every write
+and read chunk, with its time.monotonic_ns(), to a binary log:
+
+    board = Arduino(wire_log='session.wire')
+    ...
+    board.close()
+
+The log is written through a memory mapped file that is grown in steps
+of GROW_SIZE. When it reaches max_bytes it is rotated like a
+logging.handlers.RotatingFileHandler: session.wire becomes session.wire.1
+and so on, backup_count old files are kept. A log left by an earlier
+process is rotated the same way before the new one is opened.
+
+A recorded session can be played back:
+
+    board = Arduino(sr=ReplaySerial('session.wire'))   # the host side: reads
+                                                      # return what the board sent
+    python -m Arduino.wirelog replay session.wire --emulator   # the board side:
+    python -m Arduino.wirelog replay session.wire --port /dev/ttyUSB0
+    python -m Arduino.wirelog dump session.wire
+
+replay writes the recorded commands at their original pace (or as fast as
+possible with --max-speed) and reports responses that differ.
+
+File format: MAGIC, then records of RECORD (t_ns, kind, length) followed by
+length data bytes. kind is WRITE, READ or FLUSH (input dropped, length 0).
+A record of kind 0 or the end of the file ends the log.
+"""
+import argparse
+import glob
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from Arduino.reader import POLL_TIMEOUT
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'ARDWIRE1'
+RECORD = struct.Struct('<qBI')      # t_ns, kind, length
+WRITE = ord('W')
+READ = ord('R')
+FLUSH = ord('F')
+GROW_SIZE = 1 << 20                 # bytes the mapping grows by
+MAX_BYTES = 64 << 20                # file size before rotation
+BACKUP_COUNT = 4
+
+
+class WireLog:
+    """
+    Appends records to a memory mapped, size rotated file.
+    """
+    def __init__(self, path, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.records = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path) and os.path.getsize(path):
+            self._shift()                   # keep the previous session
+        self._open()
+
+    def _open(self):
+        self._file = open(self.path, 'w+b')
+        self._file.truncate(GROW_SIZE)
+        self._map = mmap.mmap(self._file.fileno(), GROW_SIZE)
+        self._map[:len(MAGIC)] = MAGIC
+        self._pos = len(MAGIC)
+
+    def _close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.truncate(self._pos)      # cut the unused, zeroed tail
+        self._file.close()
+
+    def _rotate(self):
+        self._close()
+        self._shift()
+        self._open()
+
+    def _shift(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            src = '%s.%d' % (self.path, i)
+            if os.path.exists(src):
+                os.replace(src, '%s.%d' % (self.path, i + 1))
+        if self.backup_count:
+            os.replace(self.path, self.path + '.1')
+
+    def append(self, kind, data=b''):
+        t_ns = time.monotonic_ns()
+        size = RECORD.size + len(data)
+        with self._lock:
+            if self._pos + size > self.max_bytes and self._pos > len(MAGIC):
+                self._rotate()
+            end = self._pos + size
+            if end > len(self._map):
+                self._map.resize(max(end, len(self._map) + GROW_SIZE))
+            RECORD.pack_into(self._map, self._pos, t_ns, kind, len(data))
+            self._map[self._pos + RECORD.size:end] = data
+            self._pos = end
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._close()
+                self._map = None
+
+
+class WireRecorder:
+    """
+    Serial port wrapper that logs the traffic. Everything else is passed
+    through to the port.
+    """
+    def __init__(self, sr, path, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+        self.sr = sr
+        self.log = WireLog(path, max_bytes, backup_count)
+
+    def __getattr__(self, name):
+        return getattr(self.sr, name)
+
+    @property
+    def timeout(self):
+        return self.sr.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.sr.timeout = value
+
+    def write(self, data):
+        n = self.sr.write(data)
+        self.log.append(WRITE, data)
+        return n
+
+    def read(self, size=1):
+        data = self.sr.read(size)
+        if data or self._blocking():
+            self.log.append(READ, data)     # empty reads too: timeouts
+        return data
+
+    def _blocking(self):
+        """
+        Empty polls (the reader thread, AsyncArduino) are not logged,
+        only reads that timed out waiting for a response.
+        """
+        timeout = self.sr.timeout
+        return timeout is None or timeout > POLL_TIMEOUT
+
+    def reset_input_buffer(self):
+        self.sr.reset_input_buffer()
+        self.log.append(FLUSH)
+
+    def flushInput(self):
+        self.sr.flushInput()
+        self.log.append(FLUSH)
+
+    def close(self):
+        self.sr.close()
+        self.log.close()
+
+
+"""
+##############################################################
+##     reading a log
+##############################################################
+"""
+
+def log_files(path):
+    """
+    The files of a session, oldest first: path.N .. path.1, path.
+    """
+    rotated = []
+    for name in glob.glob(glob.escape(path) + '.*'):
+        suffix = name[len(path) + 1:]
+        if suffix.isdigit():
+            rotated.append((int(suffix), name))
+    return [name for i, name in sorted(rotated, reverse=True)] + [path]
+
+
+def read_log(path):
+    """
+    Yields (t_ns, kind, data) of every record of a session.
+    """
+    for name in log_files(path):
+        with open(name, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                continue
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                if m[:len(MAGIC)] != MAGIC:
+                    raise ValueError('%s is not a wire log.' % name)
+                pos = len(MAGIC)
+                while pos + RECORD.size <= len(m):
+                    t_ns, kind, length = RECORD.unpack_from(m, pos)
+                    if kind == 0:
+                        break
+                    pos += RECORD.size
+                    yield t_ns, kind, bytes(m[pos:pos + length])
+                    pos += length
+
+
+class ReplaySerial:
+    """
+    Serial port stand-in that answers every read call with the chunk the
+    same call got in the recorded session (cut to the size asked for).
+    realtime=True delays a read until as much time has passed since the
+    previous write as in the recording; otherwise reads return at once.
+    Writes are compared with the recorded ones.
+    """
+    def __init__(self, path, realtime=False, timeout=2):
+        self.port = path
+        self.timeout = timeout
+        self.baudrate = 115200
+        self.is_open = True
+        self.realtime = realtime
+        self.mismatches = 0
+        self._reads = []            # (t_ns, data) not consumed yet
+        self._writes = []           # recorded write data
+        self._write_times = []
+        for t_ns, kind, data in read_log(path):
+            if kind == READ:
+                self._reads.append((t_ns, data))
+            elif kind == WRITE:
+                self._writes.append(data)
+                self._write_times.append(t_ns)
+        self._reads.reverse()       # pop() from the end
+        self._written = 0
+        self._last_write = None     # (recorded t_ns, replay monotonic_ns)
+
+    def write(self, data):
+        data = bytes(data)
+        if self._written < len(self._writes):
+            if data != self._writes[self._written]:
+                self.mismatches += 1
+                log.warning('Replay: write %d differs from the recording.', self._written)
+            self._last_write = (self._write_times[self._written], time.monotonic_ns())
+        self._written += 1
+        return len(data)
+
+    def read(self, size=1):
+        if not self._reads:
+            return b''
+        t_ns, data = self._reads.pop()
+        if self.realtime and self._last_write is not None:
+            recorded, replayed = self._last_write
+            wait = (t_ns - recorded) - (time.monotonic_ns() - replayed)
+            if wait > 0:
+                time.sleep(wait / 1e9)
+        if len(data) > size:
+            log.warning('Replay: read of %d bytes, %d were recorded.', size, len(data))
+        return data[:size]
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def inWaiting(self):
+        return 0
+
+    def reset_input_buffer(self):
+        pass
+
+    def flushInput(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+"""
+##############################################################
+##     tools
+##############################################################
+"""
+
+def replay(path, sr, max_speed=False):
+    """
+    Writes the recorded commands to sr at their recorded pace (as fast as
+    possible with max_speed) and reads as many bytes as the recording
+    read after each write.
+    returns: (records, differing reads)
+    """
+    if hasattr(sr, 'advance'):
+        clock, sleep = sr.seconds, sr.advance       # the emulator's clock
+    else:
+        clock, sleep = time.monotonic, time.sleep
+    t_start = None
+    replay_start = clock()
+    records = differing = 0
+    for t_ns, kind, data in read_log(path):
+        records += 1
+        if t_start is None:
+            t_start = t_ns
+        if kind == WRITE:
+            if not max_speed:
+                wait = (t_ns - t_start) / 1e9 - (clock() - replay_start)
+                if wait > 0:
+                    sleep(wait)
+            sr.write(data)
+        elif kind == READ and data:
+            rd = sr.read(len(data))
+            if rd != data:
+                differing += 1
+                log.warning('Replay: read of %d bytes at %.6f s differs: %s != %s',
+                            len(data), (t_ns - t_start) / 1e9, rd.hex(), data.hex())
+    return records, differing
+
+
+def dump(path, out=sys.stdout):
+    t_start = None
+    for t_ns, kind, data in read_log(path):
+        if t_start is None:
+            t_start = t_ns
+        print('%12.6f %s %4d %s' % ((t_ns - t_start) / 1e9, chr(kind), len(data),
+                                    data.hex(' ') if data else ''), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Arduino serial API wire log tool')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('dump', help='print the records')
+    p.add_argument('path')
+    p = sub.add_parser('replay', help='send a session to a board or the emulator')
+    p.add_argument('path')
+    p.add_argument('--port')
+    p.add_argument('--emulator', action='store_true')
+    p.add_argument('--baud', type=int, default=115200)
+    p.add_argument('--max-speed', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.command == 'dump':
+        dump(args.path)
+        return 0
+    if args.emulator:
+        from Arduino.emulator import Emulator
+        sr = Emulator(baudrate=args.baud)
+    else:
+        import serial
+        sr = serial.Serial(args.port, args.baud, timeout=2)
+        time.sleep(2)                   # the board resets when the port opens
+    sr.read(sr.in_waiting)              # the version after reset
+    records, differing = replay(args.path, sr, args.max_speed)
+    sr.close()
+    print('%d records replayed, %d reads differ' % (records, differing))
+    return 1 if differing else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -21,32 +21,38 @@ def Read():
     board.pinMode(14,'INPUT_PULLUP')
     print(board.digitalRead(14)) # pin A0
     
-def FastRead():
-    t1=time.time()
-    for x in range(1, 100):
+def FastRead(n=100):
+    t1=time.perf_counter()
+    for x in range(n):
         #print (board.digitalRead(14)) # pin A0
         board.digitalRead(14)
-    t2=time.time()
-    print(str(x/(t2-t1)) + ' Hz')
+    t2=time.perf_counter()
+    print(str(n/(t2-t1)) + ' Hz')
     
 def ReadChannel():
     print(board.analogRead(0))
     
-def ReadFastADCChannel():
-    t1=time.time()
-    for x in range(1, 100):
+def ReadFastADCChannel(n=100):
+    t1=time.perf_counter()
+    for x in range(n):
         #print (board.digitalRead(14)) # pin A0
         board.analogRead(0)
-    t2=time.time()
-    print(str(x/(t2-t1)) + ' Hz')
+    t2=time.perf_counter()
+    print(str(n/(t2-t1)) + ' Hz')
 
-def ReadADCreg():
+def StreamADCChannel():
     t1=time.time()
-    for x in range(1, 100):
+    samples = board.analogStream(0, 6000, loop=True)
+    t2=time.time()
+    print(str(len(samples)/(t2-t1)) + ' Hz')
+
+def ReadADCreg(n=100):
+    t1=time.perf_counter()
+    for x in range(n):
         #print (board.digitalRead(14)) # pin A0
         board.analogRead(0)
-    t2=time.time()
-    print(str(x/(t2-t1)) + ' Hz')
+    t2=time.perf_counter()
+    print(str(n/(t2-t1)) + ' Hz')
 
 def PrintCMDNum():
     print(board.cmd_buffer_num)
@@ -102,6 +108,7 @@ if __name__ == "__main__":
     #ReadChannel()
     #print(board.readADC())
     #ReadFastADCChannel()
+    #StreamADCChannel()
     #ReadADCreg()
     #PrintCMDNum()
     #DoLoopExample()
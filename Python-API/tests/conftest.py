@@ -0,0 +1,49 @@
+"""
+Fixtures running the API against the emulated firmware (emulator.py).
+"""
+import asyncio
+import pytest
+from Arduino import Arduino
+from Arduino.emulator import Emulator
+
+
+@pytest.fixture
+def em():
+    return Emulator()
+
+
+@pytest.fixture
+def board(em):
+    board = Arduino(sr=em)
+    yield board
+    if board.clock is not None:
+        board.clock.stop()
+
+
+@pytest.fixture
+def run_async():
+    """
+    run_async(coro_fn) awaits coro_fn(board, emulator) with an
+    AsyncArduino on a PtyBridge, the way a real port is used. The
+    emulator prints its power-on version byte before the board's
+    version request is answered, AsyncArduino drains both.
+    """
+    pytest.importorskip('termios')
+    from Arduino.asyncarduino import AsyncArduino
+    from Arduino.emulator import PtyBridge
+
+    def run(coro_fn):
+        em = Emulator()
+        bridge = PtyBridge(em)
+
+        async def main():
+            board = AsyncArduino(bridge.port)
+            try:
+                return await coro_fn(board, em)
+            finally:
+                board.close()
+        try:
+            return asyncio.run(main())
+        finally:
+            bridge.close()
+    return run
@@ -0,0 +1,197 @@
+import pytest
+from Arduino import Arduino
+from Arduino import m328p as uK
+from Arduino.arduino import (SET_REGISTER, READ_REGISTER, READ_REGISTER_BIT,
+                             READ_16_BIT_REGISTER_INCR_ADDR,
+                             READ_16_BIT_REGISTER_DECR_ADDR, decode_pulses)
+from Arduino.emulator import Square
+
+
+def test_read_ports(board):
+    board.pinMode(13, 'OUTPUT')
+    board.digitalWrite(13, 'HIGH')
+    assert board.readPorts() & 1 << 13
+    assert board.readPorts(as_array=True)[13]
+
+
+def test_write_many(em):
+    board = Arduino(sr=em, metrics=True)
+    board.pinModeMany({pin: 'OUTPUT' for pin in range(8)})
+    written = board.metrics.bytes_written
+    board.digitalWriteMany({pin: pin % 2 for pin in range(8)})
+    assert board.metrics.bytes_written - written == 4
+    board.digitalWriteMany({9: 'HIGH', 10: 'LOW'})
+    assert board.metrics.bytes_written - written == 8
+    em.advance(0.001)
+    assert em.mem[uK.DDRD] == 0xFF
+    assert em.mem[uK.PORTD] == 0xAA
+
+
+def test_write_many_is_not_recorded_from_the_shadow(em):
+    board = Arduino(sr=em, shadow=True)
+    board.setRegister(uK.PORTB, 0x20)
+
+    def builder(board):
+        board.digitalWriteMany({8: 'HIGH', 9: 'HIGH', 10: 'HIGH'})
+    program = board.compile(builder)
+    assert SET_REGISTER not in program.code[0::2]
+    board.setRegister(uK.PORTB, 0)
+    board.run(program)
+    em.advance(0.001)
+    assert em.mem[uK.PORTB] == 0x07
+
+
+def test_sample_every_timestamps_are_on_the_clock_timebase(board, em):
+    board.pinMode(2, 'INPUT')
+    reads = []
+    em.setInput(2, lambda t: reads.append(t) or 0)
+    clock = board.syncClock()
+    ticks = board.TimerOne.readStopWatchTicks()
+    # emulator seconds at device time 0, up to the stopwatch's round trip
+    offset = em.seconds() - clock.device_time(ticks)
+    samples, timestamps = board.sampleEvery(2000, ['PIND'], 10)
+    assert len(reads) == len(timestamps) == 10
+    errors = [t_read - t_device for t_read, t_device in zip(reads, timestamps)]
+    assert max(errors) - min(errors) < 1e-5
+    assert errors[0] == pytest.approx(offset, abs=1e-3)
+
+
+def test_clock_sync_thread_does_not_interleave(board):
+    board.pinMode(13, 'OUTPUT')
+    board.digitalWrite(13, 'HIGH')
+    clock = board.syncClock()
+    clock.start(0.001)
+    reads = []
+    while len(clock.samples) < 10:
+        reads.append(board.digitalRead(13))
+    clock.stop()
+    assert set(reads) == {1}
+
+
+def test_stopwatch_counts_every_overflow(board, em):
+    timer = board.TimerOne
+    timer.setAsStopWatch(1)                 # overflows every 4.1ms
+    timer.startStopWatch()
+    first, start = timer.readStopWatchTicks(), em.cycles
+    for _ in range(300):                    # ~80 overflows at all phases
+        ticks = timer.readStopWatchTicks()
+        assert abs(ticks - first - (em.cycles - start)) < 1000
+
+
+def test_stopwatch_overflow_after_the_flag_is_read(board):
+    timer = board.TimerOne
+    timer.resetStopWatch()
+    # TCNT1 wrapped after TOV1 was read: counted now, its flag next time
+    assert timer._countTicks(65000, 0, 100) == 65536 + 100
+    assert timer._countTicks(200, 1, 300) == 65536 + 300
+    assert timer._countTicks(400, 1, 500) == 2 * 65536 + 500
+
+
+@pytest.mark.parametrize('loop', [False, True])
+def test_analog_stream(board, em, loop):
+    em.setAnalog(3, lambda t: 1000 if t > 0.5 else 100)
+    samples = board.analogStream(3, 500, loop=loop)
+    assert samples.dtype.name == 'uint16' and len(samples) == 500
+    assert set(samples) == {100}
+    em.advance(0.5)
+    assert set(board.analogStream(3, 50, loop=loop)) == {1000}
+    assert board.analogRead(3) == 1000
+
+
+def test_batch_is_one_write(em):
+    board = Arduino(sr=em, metrics=True)
+    calls = board.metrics.write_calls
+    with board.batch():
+        for pin in range(2, 8):
+            board.pinMode(pin, 'OUTPUT')
+            with board.batch():
+                board.digitalWrite(pin, 'HIGH')
+        assert board.metrics.write_calls == calls
+    assert board.metrics.write_calls == calls + 1
+    em.advance(0.01)
+    assert em.mem[uK.PORTD] == 0xFC
+
+
+def test_read_inside_batch_sends_what_was_collected(board):
+    with board.batch():
+        board.pinMode(13, 'OUTPUT')
+        board.digitalWrite(13, 'HIGH')
+        assert board.readRegister(uK.PORTB) == 1 << 5
+        board.digitalWrite(13, 'LOW')
+    assert board.digitalRead(13) == 0
+
+
+def test_batch_rolls_back_on_error(em):
+    board = Arduino(sr=em, metrics=True)
+    calls = board.metrics.write_calls
+    with pytest.raises(RuntimeError):
+        with board.batch():
+            board.setRegister(uK.PORTD, 0xF0)
+            raise RuntimeError
+    assert board.metrics.write_calls == calls
+    assert board.readRegister(uK.PORTD) == 0
+
+
+def test_read_many(em):
+    board = Arduino(sr=em, metrics=True)
+    board.setRegister(uK.OCR1AH, 0x12)
+    board.setRegister(uK.OCR1AL, 0x34)
+    board.pinMode(13, 'OUTPUT')
+    board.digitalWrite(13, 'HIGH')
+    writes, reads = board.metrics.write_calls, board.metrics.read_calls
+    assert board.readMany([uK.PORTB,
+                           (READ_REGISTER, uK.DDRB),
+                           (READ_REGISTER_BIT, uK.PORTB5, uK.PORTB),
+                           (READ_16_BIT_REGISTER_INCR_ADDR, uK.OCR1AL),
+                           (READ_16_BIT_REGISTER_DECR_ADDR, uK.OCR1AH)]) \
+        == [1 << 5, 0xFF, 1, 0x1234, 0x1234]
+    assert board.metrics.write_calls == writes + 1
+    assert board.metrics.read_calls == reads + 1
+    with pytest.raises(ValueError):
+        board.readMany([(SET_REGISTER, uK.PORTB)])
+
+
+@pytest.mark.parametrize('loop', [False, True])
+def test_analog_scan(board, em, loop):
+    for channel in range(6):
+        em.setAnalog(channel, 100 * channel + 1)
+    samples, timestamps = board.analogScan([5, 0, 2], 40, loop=loop)
+    assert samples.shape == (40, 3)
+    assert samples.tolist() == [[501, 1, 201]] * 40
+    assert all(a <= b for a, b in zip(timestamps, timestamps[1:]))
+
+
+def test_sample_every(board, em):
+    em.setAnalog(1, 321)
+    board.pinMode(2, 'INPUT')
+    reads = []
+    em.setInput(2, lambda t: reads.append(t) or 1)
+    samples, timestamps = board.sampleEvery(2000, ['A1', 'PIND'], 5)
+    assert samples.shape == (5, 2)
+    assert samples[:, 0].tolist() == [321] * 5
+    assert all(samples[:, 1] & 1 << 2)
+    assert timestamps.tolist() == pytest.approx([0.002 * (i + 1) for i in range(5)])
+    # paced by Timer1, the first frame's commands were still on the wire
+    assert [b - a for a, b in zip(reads[1:], reads[2:])] == pytest.approx([0.002] * 3)
+    blocks = list(board.sampleEveryIter(2000, ['PIND'], 6, chunk=4))
+    assert [len(block) for block in blocks] == [4, 2]
+
+
+@pytest.mark.parametrize('edge', ['rising', 'falling'])
+def test_measure_pulses(board, em, edge):
+    em.setInput(8, Square(500, duty=0.25))
+    pulses = board.measurePulses(10, edge)
+    assert len(pulses.timestamps) == 10
+    assert pulses.period == pytest.approx(2e-3, rel=1e-3)
+    assert pulses.frequency == pytest.approx(500, rel=1e-3)
+    assert pulses.duty == pytest.approx(0.25, abs=0.01)   # HIGH either way
+
+
+def test_decode_pulses():
+    # ICR1 of the leading and the trailing edge, little endian, one tick 1us
+    rd = bytes([0, 0, 100, 0, 0xE8, 0x03, 0x4C, 0x04,
+                0xD0, 0x07, 0x34, 0x08])
+    pulses = decode_pulses(rd, True, 1e-6)
+    assert list(pulses.timestamps) == pytest.approx([0, 1e-3, 2e-3])
+    assert pulses.period == pytest.approx(1e-3)
+    assert pulses.duty == pytest.approx(0.1)
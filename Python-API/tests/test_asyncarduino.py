@@ -0,0 +1,79 @@
+import asyncio
+from Arduino import m328p as uK
+from Arduino.emulator import Square
+
+
+def test_read_ports(run_async):
+    async def read(board, em):
+        board.pinMode(13, 'OUTPUT')
+        board.digitalWrite(13, 'HIGH')
+        return await board.readPorts()
+    assert run_async(read) & 1 << 13
+
+
+def test_reads_are_matched_in_order(run_async):
+    async def read(board, em):
+        board.pinMode(13, 'OUTPUT')
+        board.digitalWrite(13, 'HIGH')
+        board.setRegister(uK.GPIOR1, 0x5A)
+        return await asyncio.gather(board.readRegister(uK.GPIOR1),
+                                    board.digitalRead(13),
+                                    board.readRegister(uK.PORTB),
+                                    board.readMany([uK.GPIOR1, uK.PORTB]))
+    assert run_async(read) == [0x5A, 1, 1 << 5, [0x5A, 1 << 5]]
+
+
+def test_writes_do_not_flush_on_the_loop(run_async):
+    flushes = []
+
+    async def write(board, em):
+        board.sr.flush = lambda: flushes.append(True)   # waits for the UART
+        for value in range(200):
+            board.setRegister(uK.GPIOR1, value)
+        return await board.readRegister(uK.GPIOR1)
+    assert run_async(write) == 199
+    assert not flushes
+
+
+def test_run_program_with_reads(run_async):
+    def builder(board):
+        board.pinMode(13, 'OUTPUT')
+        board.digitalWrite(13, 'HIGH')
+        board.readRegister(uK.PORTB)
+
+    async def run(board, em):
+        return await board.run(board.compile(builder))
+    assert run_async(run) == [1 << 5]
+
+
+def test_capture_edges(run_async):
+    async def capture(board, em):
+        em.setInput(8, Square(1000))
+        board.pinMode(8, 'INPUT')
+        return await board.captureEdges(['B'], 100)
+    capture = run_async(capture)
+    assert len(capture) == 100
+    assert len(capture.edges(8))
+
+
+def test_clock_sync(run_async):
+    async def sync(board, em):
+        clock = await board.syncClock()
+        await clock.sampleAsync()
+        samples, timestamps = await board.sampleEvery(2000, ['PINB'], 5)
+        return clock, timestamps
+    clock, timestamps = run_async(sync)
+    assert len(clock.samples) == 2
+    assert len(timestamps) == 5
+    assert timestamps[0] > clock.device_time(clock.samples[-1][1])
+
+
+def test_stopwatch(run_async):
+    async def stopwatch(board, em):
+        board.TimerOne.setAsStopWatch(8)
+        board.TimerOne.startStopWatch()
+        first = await board.TimerOne.readStopWatchTicks()
+        second = await board.TimerOne.readStopWatchTicks()
+        return first, second
+    first, second = run_async(stopwatch)
+    assert first is not None and second > first
@@ -0,0 +1,35 @@
+import json
+from Arduino.bench import compare, main, percentile
+
+
+def test_percentile_is_nearest_rank():
+    assert percentile(range(1, 11), 50) == 5
+    assert percentile(range(1, 51), 50) == 25
+    assert percentile(range(1, 101), 50) == 50
+    assert percentile(range(1, 101), 99) == 99
+    assert percentile([7], 95) == 7
+
+
+def test_compare_reports_worse_p50_only():
+    baseline = {'write': {'p50': 1000, 'unit': 'commands/s', 'higher_is_better': True},
+                'latency': {'p50': 100, 'unit': 'us', 'higher_is_better': False}}
+    results = {'write': {'p50': 950, 'unit': 'commands/s', 'higher_is_better': True},
+               'latency': {'p50': 120, 'unit': 'us', 'higher_is_better': False}}
+    assert len(compare(results, baseline)) == 1
+    assert compare(results, baseline, tolerance=0.25) == []
+
+
+def test_emulator_run_and_compare(tmp_path, capsys):
+    baseline = str(tmp_path / 'baseline.json')
+    args = ['--emulator', '--repeat', '3', '--only', 'latency', 'write']
+    assert main(args + ['--save', baseline]) == 0
+    with open(baseline) as f:
+        results = json.load(f)
+    assert sorted(results) == ['latency', 'write']
+    assert results['write']['n'] == 3
+    assert main(args + ['--compare', baseline]) == 0
+    results['write']['p50'] *= 2
+    with open(baseline, 'w') as f:
+        json.dump(results, f)
+    assert main(args + ['--compare', baseline]) == 1
+    assert 'REGRESSION write' in capsys.readouterr().err
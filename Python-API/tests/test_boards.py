@@ -0,0 +1,34 @@
+import pytest
+from Arduino import Arduino
+from Arduino.boards import get_profile
+
+
+def test_nano_has_a6_and_a7(em):
+    em.setAnalog(6, 300)
+    em.setAnalog(7, 700)
+    board = Arduino(sr=em, board='nano328')
+    assert board.analogRead(7) == 700
+    assert board.analogRead('A6') == 300
+    assert list(board.analogStream('A7', 3)) == [700] * 3
+    samples, timestamps = board.analogScan([6, 7], 2)
+    assert samples.tolist() == [[300, 700]] * 2
+
+
+def test_channels_without_a_pin_are_rejected(board):
+    with pytest.raises(ValueError):
+        board.analogRead(6)
+    with pytest.raises(ValueError):
+        board.analogStream('A6', 3)
+    with pytest.raises(ValueError):
+        board.analogScan([0, 6], 2)
+    with pytest.raises(ValueError):
+        board.sampleEvery(2000, ['A7'], 2)
+    assert board.analogRead('A5') == 0
+
+
+def test_profiles():
+    assert get_profile('NANO168').mcu == 'atmega168'
+    assert get_profile('nano328').adc_channel('A7') == 7
+    assert get_profile('uno').pins == get_profile('nano168').pins
+    with pytest.raises(ValueError):
+        get_profile('mega')
@@ -0,0 +1,37 @@
+import math
+import numpy as np
+from Arduino import m328p as uK
+from Arduino.capture import EdgeCapture
+
+
+def capture():
+    capture = EdgeCapture([uK.PINB])
+    capture.append(np.array([0, 0, 1, 1, 0, 0, 1, 1, 0, 0], dtype=np.uint8))
+    return capture
+
+
+def test_edges():
+    assert list(capture().edges(8)) == [2, 4, 6, 8]
+    assert list(capture().edges(8, 0, None, 'falling')) == [4, 8]
+
+
+def test_edge_at_window_start():
+    assert list(capture().edges(8, 2)) == [2, 4, 6, 8]
+    assert list(capture().edges(8, 6, None, 'rising')) == [6]
+    assert capture().frequency(8, 2) == 0.25
+
+
+def test_duty_cycle_and_expand():
+    assert capture().dutyCycle(8) == 0.4
+    assert list(capture().expand(1, 4)[:, 0]) == [0, 1, 1]
+    assert math.isnan(capture().frequency(8, 4))
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'run')
+    capture().save(path)
+    loaded = EdgeCapture.load(path)
+    assert len(loaded) == 10
+    assert list(loaded.edges(8)) == [2, 4, 6, 8]
+    loaded.append(np.ones(2, dtype=np.uint8))
+    assert list(loaded.edges(8, 9)) == [10]
@@ -0,0 +1,25 @@
+import numpy as np
+from Arduino import m328p as uK
+from Arduino.emulator import Square
+
+
+def test_capture_logic(board, em):
+    em.setInput(2, Square(1000))
+    board.pinMode(2, 'INPUT')
+    bits = board.captureLogic(['D'], 2000)
+    assert sorted(bits) == list(range(8))
+    assert all(len(samples) == 2000 for samples in bits.values())
+    edges = np.count_nonzero(np.diff(bits[2].astype(np.int8)))
+    seconds = 2000 / 11e3                   # ~11k snapshots/s of one port
+    assert 0.5 * seconds * 2000 < edges < 1.5 * seconds * 2000
+    assert not bits[1].any()                # TX, an output at LOW
+
+
+def test_capture_logic_raw(board, em):
+    em.setInput(8, 1)
+    em.setInput(2, 1)
+    board.pinMode(8, 'INPUT')
+    board.pinMode(2, 'INPUT')
+    raw = board.captureLogicRaw(['B', uK.PIND], 10)
+    assert raw.shape == (10, 2) and raw.dtype == np.uint8
+    assert (raw[:, 0] & 1).all() and (raw[:, 1] & 1 << 2).all()
@@ -0,0 +1,40 @@
+from Arduino import m328p as uK
+from Arduino.arduino import (SET_DATA, SET_REGISTER, SET_REGISTER_BIT,
+                             READ_REGISTER_BIT, WAIT_UNTIL_BIT_IS_CLEARED,
+                             READ_16_BIT_REGISTER_INCR_ADDR)
+from Arduino.encoder import (CommandEncoder, analog_read, command,
+                             set_register)
+
+
+def test_tables_hand_out_the_same_bytes():
+    assert command(SET_REGISTER_BIT + 5, uK.PORTB) == bytes([0x35, uK.PORTB])
+    assert command(SET_REGISTER_BIT + 5, uK.PORTB) is command(SET_REGISTER_BIT + 5, uK.PORTB)
+    assert set_register(uK.DDRB, 0xFF) == bytes([SET_DATA, 0xFF, SET_REGISTER, uK.DDRB])
+    assert analog_read(2) is analog_read(2)
+    assert analog_read(2) == bytes([SET_DATA, 0x42, SET_REGISTER, uK.ADMUX,
+                                    SET_DATA, 0xC7, SET_REGISTER, uK.ADCSRA,
+                                    WAIT_UNTIL_BIT_IS_CLEARED + uK.ADSC, uK.ADCSRA,
+                                    READ_16_BIT_REGISTER_INCR_ADDR, uK.ADCL])
+
+
+def test_encoder_reuses_its_buffer():
+    enc = CommandEncoder(4)
+    enc.setBit(5, uK.DDRB).readBit(5, uK.PINB)
+    assert bytes(enc.view()) == bytes([SET_REGISTER_BIT + 5, uK.DDRB,
+                                       READ_REGISTER_BIT + 5, uK.PINB])
+    kept = enc.view()
+    enc.setRegister(uK.PORTD, 0xAA)         # grows, the old view stays valid
+    assert len(enc) == 8 and len(kept) == 4
+    buffer = enc._buf
+    enc.clear().setData(1)
+    assert enc._buf is buffer and bytes(enc.view()) == bytes([SET_DATA, 1])
+
+
+def test_encode_into():
+    enc = CommandEncoder().setBit(5, uK.PORTB)
+    buf = bytearray(b'\x00\x00')
+    assert enc.encode_into(buf, 2) == 4
+    assert buf == bytes([0, 0, SET_REGISTER_BIT + 5, uK.PORTB])
+    buf = bytearray(4)
+    assert enc.encode_into(buf, 1) == 3
+    assert buf == bytes([0, SET_REGISTER_BIT + 5, uK.PORTB, 0])
@@ -0,0 +1,50 @@
+import time
+import pytest
+from Arduino import arduino
+
+PORTS = ['/dev/ttyUSB%d' % i for i in range(16)]
+
+
+class FakeSerial:
+    def __init__(self, port, baud, timeout=None):
+        self.port = port
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    """
+    Ports of the probed boards, the board is on PORTS[3].
+    """
+    probed = []
+
+    def get_version(sr):
+        probed.append(sr.port)
+        return 6 if sr.port == PORTS[3] else None
+    monkeypatch.setattr(arduino, 'BOOT_DELAY', 0.2)
+    monkeypatch.setattr(arduino, 'candidate_ports', lambda: PORTS)
+    monkeypatch.setattr(arduino, 'usb_serial_numbers',
+                        lambda: {PORTS[3]: 'A700eXyz'})
+    monkeypatch.setattr(arduino.serial, 'Serial', FakeSerial)
+    monkeypatch.setattr(arduino, 'get_version', get_version)
+    return probed
+
+
+def test_find_ports_stops_early(probes):
+    started = time.monotonic()
+    found = arduino.find_ports(115200, 2, count=1, cache=None)
+    assert [sr.port for sr in found] == PORTS[3:4]
+    assert time.monotonic() - started < 2 * 0.2
+
+
+def test_known_board_is_not_probed(probes, tmp_path):
+    cache = str(tmp_path / 'ports.json')
+    arduino.find_ports(115200, 2, count=1, cache=cache)
+    assert arduino.load_port_cache(cache)[PORTS[3]] == {
+        'serial_number': 'A700eXyz', 'version': 6}
+    del probes[:]               # probes of the first call may still be running
+    found = arduino.find_ports(115200, 2, count=1, cache=cache)
+    assert [sr.port for sr in found] == PORTS[3:4]
+    assert PORTS[3] not in probes
@@ -0,0 +1,50 @@
+import pytest
+from Arduino import Arduino
+from Arduino import m328p as uK
+from Arduino.emulator import Square
+
+
+def waiting_board(em, signal):
+    em.setInput(2, signal)
+    board = Arduino(sr=em, flow_control=True)
+    board.pinMode(2, 'INPUT')
+    board.pinMode(13, 'OUTPUT')
+    board.waitUntilBitIsSet(2)
+    return board
+
+
+def test_writes_behind_a_wait_do_not_overrun(em):
+    board = waiting_board(em, Square(100))
+    for i in range(200):
+        board.digitalWrite(13, 'HIGH' if i % 2 else 'LOW')
+    assert board.flow.sync_markers >= 1
+    assert board.flow.stalls >= 1
+    assert board.digitalRead(13) == 1
+    assert em.overruns == 0
+
+
+def test_without_flow_control_the_ring_overruns(em):
+    em.setInput(2, 0)
+    board = Arduino(sr=em)
+    board.pinMode(2, 'INPUT')
+    board.waitUntilBitIsSet(2)
+    for i in range(200):
+        board.digitalWrite(13, 'HIGH')
+    em.advance(0.1)
+    assert em.overruns > 0
+
+
+def test_wait_that_never_ends_raises(em):
+    board = waiting_board(em, 0)
+    board.flow.wait_timeout = 0
+    with pytest.raises(BufferError):
+        for i in range(200):
+            board.digitalWrite(13, 'HIGH')
+
+
+def test_full_ring_inside_a_loop_raises(em):
+    board = waiting_board(em, 0)
+    board.cmdDo()
+    with pytest.raises(BufferError):
+        for i in range(200):
+            board.setRegister(uK.GPIOR1, i)
@@ -0,0 +1,37 @@
+import json
+from Arduino import Arduino
+from Arduino import m328p as uK
+from Arduino.arduino import READ_REGISTER
+from Arduino.emulator import Square
+
+
+def test_counters_and_hooks(em):
+    board = Arduino(sr=em, metrics=True)
+    board.metrics.reset()
+    events = []
+    board.metrics.addHook(lambda event, value: events.append((event, value)))
+    board.pinMode(13, 'OUTPUT')
+    board.digitalWrite(13, 'HIGH')
+    assert board.readRegister(uK.PORTB) == 1 << 5
+    snapshot = board.metrics.snapshot()
+    assert snapshot['commands'] == {'SET_REGISTER_BIT': 2, 'READ_REGISTER': 1}
+    assert snapshot['bytes_written'] == 6 and snapshot['bytes_read'] == 1
+    assert snapshot['write_calls'] == 3 and snapshot['read_calls'] == 1
+    assert snapshot['short_reads'] == 0
+    assert snapshot['latency_us']['count'] == 1
+    assert snapshot['latency_us']['buckets'][-1] == ['+Inf', 1]
+    assert snapshot['ring_fill'] == {'last': 0, 'max': 6}
+    json.dumps(snapshot)
+    assert [event for event, value in events] == ['write', 'write', 'write',
+                                                  'read', 'latency']
+
+
+def test_sync_markers_are_counted(em):
+    em.setInput(2, Square(100))
+    board = Arduino(sr=em, flow_control=True, metrics=True)
+    board.pinMode(2, 'INPUT')
+    board.waitUntilBitIsSet(2)
+    for i in range(200):
+        board.digitalWrite(13, 'HIGH')
+    assert board.flow.sync_markers >= 1
+    assert board.metrics.commands[READ_REGISTER >> 4] == board.flow.sync_markers
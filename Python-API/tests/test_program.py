@@ -0,0 +1,48 @@
+from Arduino import Arduino
+from Arduino import m328p as uK
+from Arduino.emulator import Emulator
+from Arduino.program import program_cache, program_key
+
+
+def period(board, microseconds):
+    board.TimerOne.setPeriod(microseconds)
+
+
+def outputs(board, pins, levels=None):
+    for pin in pins:
+        board.pinMode(pin, 'OUTPUT')
+    for pin, level in (levels or {}).items():
+        board.digitalWrite(pin, level)
+
+
+def test_compile_key_includes_f_cpu():
+    a = Arduino(sr=Emulator())
+    b = Arduino(sr=Emulator())
+    b.calibrateFclk(a.F_CPU / 2)
+    assert a.compile(period, 1000).code != b.compile(period, 1000).code
+    assert a.compile(period, 1000) is a.compile(period, 1000)
+
+
+def test_run_program(board):
+    def builder(board):
+        board.pinMode(13, 'OUTPUT')
+        board.digitalWrite(13, 'HIGH')
+        board.readRegister(uK.PORTB)
+    assert board.run(board.compile(builder)) == [1 << 5]
+
+
+def test_compile_with_unhashable_args(board):
+    program = board.compile(outputs, [8, 9], levels={9: 'HIGH'})
+    assert board.compile(outputs, [8, 9], levels={9: 'HIGH'}) is program
+    assert board.compile(outputs, (8, 9), levels={9: 'HIGH'}) is not program
+    assert board.compile(outputs, [8, 9], levels={9: 'LOW'}) is not program
+    board.run(program)
+    assert board.readRegister(uK.PORTB) & 1 << 1
+
+
+def test_args_that_can_not_be_frozen_skip_the_cache(board):
+    pins = bytearray([8, 9])
+    assert program_key(outputs, (pins,), {}) is None
+    program_cache.clear()
+    assert board.compile(outputs, pins).code == board.compile(outputs, [8, 9]).code
+    assert len(program_cache) == 1
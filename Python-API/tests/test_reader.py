@@ -0,0 +1,86 @@
+import queue
+import time
+from Arduino import Arduino
+from Arduino import m328p as uK
+from Arduino.arduino import READ_REGISTER_BIT
+from Arduino.reader import ReaderThread
+
+
+class FakePort:
+    """
+    A port the test feeds by hand, bytes arrive when feed() is called.
+    """
+    def __init__(self):
+        self.timeout = 0.5
+        self._rx = queue.Queue()
+
+    def feed(self, data):
+        for byte in data:
+            self._rx.put(byte)
+
+    @property
+    def in_waiting(self):
+        return self._rx.qsize()
+
+    def inWaiting(self):
+        return self._rx.qsize()
+
+    def read(self, size=1):
+        data = bytearray()
+        try:
+            data.append(self._rx.get(timeout=self.timeout))
+            while len(data) < size:
+                data.append(self._rx.get_nowait())
+        except queue.Empty:
+            pass
+        return bytes(data)
+
+
+def wait_received(reader, count):
+    deadline = time.monotonic() + 1
+    while reader.received < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def test_pipelined_reads(em):
+    board = Arduino(sr=em, reader=True)
+    try:
+        board.pinMode(13, 'OUTPUT')
+        board.digitalWrite(13, 'HIGH')
+        assert board.readMany([uK.DDRB, uK.PORTB,
+                               (READ_REGISTER_BIT, uK.PORTB5, uK.PORTB)]) \
+            == [0xFF, 1 << 5, 1]
+        assert board.digitalRead(13) == 1
+    finally:
+        board.close()
+
+
+def test_late_response_does_not_shift_the_next_read():
+    port = FakePort()
+    reader = ReaderThread(port, timeout=0.05)
+    try:
+        reader.expect(1)
+        assert reader.read(1) == b''
+        reader.expect(1)
+        port.feed(b'\x01\x02')
+        assert reader.read(1) == b'\x02'
+        assert reader.stray == b''
+    finally:
+        reader.close()
+
+
+def test_unrequested_bytes_are_kept():
+    port = FakePort()
+    port.feed(b'\x06')
+    reader = ReaderThread(port, timeout=0.05)
+    try:
+        port.feed(b'\x07')
+        wait_received(reader, 1)
+        reader.flushInput()
+        future = reader.expect(1)
+        port.feed(b'\x08')
+        assert reader.read(1) == b'\x08'
+        assert future.result() == b'\x08'
+        assert reader.stray == b'\x06\x07'
+    finally:
+        reader.close()
@@ -0,0 +1,20 @@
+import pytest
+from Arduino.registerdb import database, encode
+
+
+def test_registers():
+    db = database()
+    assert db['TCCR1B'].address == 0x81
+    assert db[0x81].name == 'TCCR1B'
+    assert db['TCCR1B'].fields['CS1'] == ('CS1', 0, 3)
+    assert 'UDR' in db['UDR0'].aliases
+    assert 'SPM_PAGESIZE' not in db
+    assert all(0x20 <= register.address <= 0xFF for register in db)
+
+
+def test_encode_and_decode():
+    assert encode('TCCR1B', WGM13=1, CS1=2) == 0x12
+    assert database().decode('ADCSRA', 0x87) == {
+        'ADPS': 7, 'ADEN': 1, 'ADSC': 0, 'ADATE': 0, 'ADIF': 0, 'ADIE': 0}
+    with pytest.raises(ValueError):
+        encode('TCCR1B', CS1=8)
@@ -0,0 +1,59 @@
+import pytest
+from Arduino import Arduino
+from Arduino import m328p as uK
+
+
+@pytest.fixture
+def shadowed(em):
+    return Arduino(sr=em, shadow=True, metrics=True)
+
+
+def test_repeated_writes_are_elided(shadowed, em):
+    shadowed.pinMode(13, 'OUTPUT')
+    shadowed.digitalWrite(13, 'HIGH')
+    written = shadowed.metrics.bytes_written
+    shadowed.digitalWrite(13, 'HIGH')
+    shadowed.pinMode(13, 'OUTPUT')
+    assert shadowed.metrics.bytes_written == written
+    assert shadowed.registers.elided == 4
+    shadowed.digitalWrite(13, 'LOW')
+    assert shadowed.metrics.bytes_written == written + 2
+    em.advance(0.001)
+    assert not em.mem[uK.PORTB] & 1 << 5
+
+
+def test_known_registers_are_read_from_the_shadow(shadowed, em):
+    shadowed.setRegister(uK.OCR1AL, 0x5A)
+    reads = shadowed.metrics.read_calls
+    assert shadowed.readRegister(uK.OCR1AL) == 0x5A
+    assert shadowed.registers['OCR1AL'] == 0x5A
+    assert shadowed.metrics.read_calls == reads
+    em.setInput(2, 1)
+    shadowed.pinMode(2, 'INPUT')
+    assert shadowed.digitalRead(2) == 1
+    assert shadowed.readRegister(uK.PIND) & 1 << 2     # volatile, always read
+    assert shadowed.metrics.read_calls == reads + 2
+
+
+def test_nothing_is_known_after_a_loop(shadowed):
+    shadowed.setRegister(uK.OCR1AL, 0x5A)
+    shadowed.cmdDo()
+    shadowed.setRegister(uK.OCR1AL, 0x5A)
+    shadowed.cmdLoop()
+    shadowed.cmdStop()
+    assert uK.OCR1AL not in shadowed.registers
+    written = shadowed.metrics.bytes_written
+    shadowed.setRegister(uK.OCR1AL, 0x5A)
+    assert shadowed.metrics.bytes_written == written + 4
+
+
+def test_rollback_restores_shadow(shadowed, em):
+    shadowed.pinMode(13, 'OUTPUT')
+    shadowed.digitalWrite(13, 'LOW')
+    with pytest.raises(RuntimeError):
+        with shadowed.batch():
+            shadowed.digitalWrite(13, 'HIGH')
+            raise RuntimeError
+    shadowed.digitalWrite(13, 'HIGH')
+    em.advance(0.001)
+    assert em.mem[uK.PORTB] & 1 << 5
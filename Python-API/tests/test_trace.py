@@ -0,0 +1,30 @@
+from Arduino import Arduino
+from Arduino.emulator import Emulator
+from Arduino.trace import Trace
+
+
+def test_trace_of_a_session(tmp_path):
+    path = str(tmp_path / 'session.wire')
+    board = Arduino(sr=Emulator(), wire_log=path)
+    board.pinMode(13, 'OUTPUT')
+    board.digitalWrite(13, 'HIGH')
+    board.digitalRead(13)
+    board.close()
+    trace = Trace.fromLog(path)
+    names = [command.name for command in trace.commands]
+    assert names[-3:] == ['SET_REGISTER_BIT', 'SET_REGISTER_BIT', 'READ_REGISTER_BIT']
+    assert str(trace.commands[-2]).endswith('SET_REGISTER_BIT PORTB.PORTB5')
+    assert trace.bytes_read == 1
+    assert trace.fill[-1][1] == 0
+
+
+def test_trace_of_a_loop():
+    board = Arduino(sr=Emulator())
+    with board.record() as rec:
+        board.cmdDo()
+        board.digitalWrite(13, 'HIGH')
+        board.digitalWrite(13, 'LOW')
+        board.cmdLoop()
+    trace = Trace.fromBytes(rec.program.code)
+    assert len(trace.spans) == 1
+    assert trace.spans[0].size == 4
@@ -0,0 +1,64 @@
+import os
+from Arduino import Arduino
+from Arduino.emulator import Emulator
+from Arduino.reader import POLL_TIMEOUT
+from Arduino.wirelog import (WireLog, WireRecorder, ReplaySerial, read_log,
+                             WRITE, READ)
+
+
+def test_new_session_keeps_the_previous_log(tmp_path):
+    path = str(tmp_path / 'session.wire')
+    for session in (b'1', b'2', b'3'):
+        log = WireLog(path)
+        log.append(WRITE, session)
+        log.close()
+    assert [data for t_ns, kind, data in read_log(path)] == [b'1', b'2', b'3']
+    assert os.path.exists(path + '.2')
+
+
+def test_size_rotation(tmp_path):
+    path = str(tmp_path / 'session.wire')
+    log = WireLog(path, max_bytes=64, backup_count=2)
+    for i in range(20):
+        log.append(WRITE, bytes([i]))
+    log.close()
+    assert os.path.exists(path + '.2') and not os.path.exists(path + '.3')
+    assert [data for t_ns, kind, data in read_log(path)][-1] == bytes([19])
+
+
+def test_empty_polls_are_not_logged(tmp_path):
+    em = Emulator(banner=False)
+    sr = WireRecorder(em, str(tmp_path / 'session.wire'))
+    em.timeout = POLL_TIMEOUT
+    sr.read(1)
+    assert sr.log.records == 0
+    em.timeout = 0.5
+    sr.read(1)                          # a timeout waiting for a response
+    assert sr.log.records == 1
+    sr.close()
+
+
+def test_replay(tmp_path):
+    path = str(tmp_path / 'session.wire')
+    board = Arduino(sr=Emulator(), wire_log=path)
+    board.pinMode(13, 'OUTPUT')
+    board.digitalWrite(13, 'HIGH')
+    value = board.digitalRead(13)
+    board.close()
+    kinds = [kind for t_ns, kind, data in read_log(path)]
+    assert WRITE in kinds and READ in kinds
+    replayed = Arduino(sr=ReplaySerial(path))
+    replayed.pinMode(13, 'OUTPUT')
+    replayed.digitalWrite(13, 'HIGH')
+    assert replayed.digitalRead(13) == value == 1
+    assert replayed.sr.mismatches == 0
+
+
+def test_replay_counts_writes_that_differ(tmp_path):
+    path = str(tmp_path / 'session.wire')
+    board = Arduino(sr=Emulator(), wire_log=path)
+    board.digitalWrite(13, 'HIGH')
+    board.close()
+    replayed = Arduino(sr=ReplaySerial(path))
+    replayed.digitalWrite(13, 'LOW')
+    assert replayed.sr.mismatches == 1